@@ -0,0 +1,120 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+"""
+Content-addressed cache of complete analyses, shared by all recordings on this machine.
+
+An analysis is stored under a key that is derived from the fingerprint of the decoded 16 kHz PCM audio, the
+identity of the speech model (incl. the analysis mode) and the segment length. So the analysis of a recording is
+found again after it was renamed, moved or re-downloaded in another container format.
+
+Additionally, the cheap fingerprints of the source files (see audio_tools.get_source_fingerprint) are mapped to
+the keys, so a known source file does not even need to be decoded.
+"""
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.cache/music-extraction/analysis.sqlite")
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+class AnalysisCache:
+    """
+    SQLite based analysis cache with size-based LRU eviction. It can be used from several threads.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_size=DEFAULT_MAX_SIZE):
+        """
+        Args:
+            path: Path to the SQLite database.
+            max_size (int): If the stored analyses are larger (in bytes), the least recently used ones are evicted.
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+        self._connection = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS analyses ("
+                                     "key TEXT PRIMARY KEY, lines TEXT NOT NULL, size INTEGER NOT NULL, "
+                                     "last_access REAL NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS sources ("
+                                     "source_key TEXT PRIMARY KEY, key TEXT NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS analyses_last_access ON analyses (last_access)")
+
+    @staticmethod
+    def _get_key(fingerprint: str, model_identity: str, segment_length: int) -> str:
+        return hashlib.sha256(f"{fingerprint}\n{model_identity}\n{segment_length}".encode()).hexdigest()
+
+    def lookup_source(self, source_fingerprint: str, model_identity: str, segment_length: int):
+        """
+        Look up the analysis of a source file by its cheap fingerprint (no decoding needed).
+
+        Returns:
+            list: The speech lines of the analysis, or None if it is not cached.
+        """
+        source_key = self._get_key(source_fingerprint, model_identity, segment_length)
+        with self._lock:
+            row = self._connection.execute("SELECT key FROM sources WHERE source_key = ?", (source_key,)).fetchone()
+            return self._load(row[0]) if row else None
+
+    def lookup(self, pcm_fingerprint: str, model_identity: str, segment_length: int, source_fingerprint=None):
+        """
+        Look up the analysis of decoded audio. If it is found, the source file is remembered, too.
+
+        Returns:
+            list: The speech lines of the analysis, or None if it is not cached.
+        """
+        key = self._get_key(pcm_fingerprint, model_identity, segment_length)
+        with self._lock:
+            lines = self._load(key)
+            if lines is not None and source_fingerprint:
+                self._add_source(source_fingerprint, model_identity, segment_length, key)
+        return lines
+
+    def store(self, pcm_fingerprint: str, model_identity: str, segment_length: int, lines,
+              source_fingerprint=None):
+        """
+        Store the speech lines of a complete analysis.
+        """
+        key = self._get_key(pcm_fingerprint, model_identity, segment_length)
+        text = "\n".join(lines)
+        with self._lock:
+            with self._connection:
+                self._connection.execute("INSERT OR REPLACE INTO analyses (key, lines, size, last_access) "
+                                         "VALUES (?, ?, ?, ?)", (key, text, len(text.encode()), time.time()))
+            if source_fingerprint:
+                self._add_source(source_fingerprint, model_identity, segment_length, key)
+            self._evict()
+
+    def _add_source(self, source_fingerprint, model_identity, segment_length, key):
+        source_key = self._get_key(source_fingerprint, model_identity, segment_length)
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO sources (source_key, key) VALUES (?, ?)",
+                                     (source_key, key))
+
+    def _load(self, key):
+        row = self._connection.execute("SELECT lines FROM analyses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self._connection:
+            self._connection.execute("UPDATE analyses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return [line for line in row[0].split("\n") if line]
+
+    def _evict(self):
+        total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+        if total_size <= self._max_size:
+            return
+        with self._connection:
+            for key, size in self._connection.execute("SELECT key, size FROM analyses "
+                                                      "ORDER BY last_access").fetchall():
+                if total_size <= self._max_size:
+                    break
+                self._connection.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                self._connection.execute("DELETE FROM sources WHERE key = ?", (key,))
+                total_size -= size
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,70 @@
+from music_segments_finder import fetch_first_word_and_speech
+from seconds_formatter import seconds_to_min_sec
+from speech_file import format_speech_line, shift_word_times
+
+"""
+Two-tier speech recognition: the small model classifies every segment as speech or no speech, the large model
+only re-transcribes the speech segments next to music. These are the lines shown with the music segments, so the
+user decides with the better transcripts what to keep, while the large model processes only a small part of the
+audio.
+"""
+
+# Large Vosk model of the second tier
+DEFAULT_LARGE_MODEL_NAME = "vosk-model-de-0.21"
+
+
+def find_border_segments(lines, total_length: float):
+    """
+    Find the speech segments that border a music segment (i.e. a segment without speech).
+
+    Args:
+        lines (list): Lines of a complete analysis (segment length, speech lines, "end").
+        total_length (float): Length of the audio in seconds.
+
+    Returns:
+        list: The start times (in seconds) of the speech segments next to music.
+    """
+    segment_length = int(lines[0])
+    starts = [int(fetch_first_word_and_speech(line)[0]) for line in lines[1:-1]]
+    speech_starts = set(starts)
+    return [start for start in starts
+            if (start > 0 and start - segment_length not in speech_starts) or
+            (start + segment_length < total_length and start + segment_length not in speech_starts)]
+
+
+def retranscribe_border_segments(lines, total_length: float, transcribe):
+    """
+    Replace the speech lines next to music by the transcripts of the second tier. If the second tier recognizes
+    no speech in a segment, its line is kept (the classification is left to the first tier).
+
+    Args:
+        lines (list): Lines of a complete analysis (segment length, speech lines, "end").
+        total_length (float): Length of the audio in seconds.
+        transcribe (callable): Called with the start time of a segment and returns its speech and word times
+            (relative to the segment).
+
+    Returns:
+        list: The speech lines (without the segment length and "end").
+    """
+    border_segments = set(find_border_segments(lines, total_length))
+    speech_lines = []
+    for line in lines[1:-1]:
+        start_time = int(fetch_first_word_and_speech(line)[0])
+        if start_time in border_segments:
+            speech_segment, word_times = transcribe(start_time)
+            if speech_segment:
+                line = format_speech_line(start_time, speech_segment, shift_word_times(word_times, start_time))
+        speech_lines.append(line)
+    return speech_lines
+
+
+def format_tier_report(total_length: float, small_model_seconds: float, large_model_seconds: float) -> str:
+    """
+    Report which part of the audio each tier processed.
+    """
+    def fraction(seconds):
+        return seconds / total_length if total_length else 0.0
+
+    return (f"Small model processed {seconds_to_min_sec(small_model_seconds)} of "
+            f"{seconds_to_min_sec(total_length)} ({fraction(small_model_seconds):.1%}), large model "
+            f"{seconds_to_min_sec(large_model_seconds)} ({fraction(large_model_seconds):.1%})")
@@ -3,19 +3,46 @@ import wave
 from vosk import Model, KaldiRecognizer
 import os
 import json
+import instrumentation
+from instrumentation import instrumented
 
 # This software uses the Vosk library for speech recognition.
 # Vosk is licensed under the Apache License 2.0.
 
 
 class AudioSegmentAnalyser:
-    def __init__(self):
-        model_path = os.path.expanduser("~/.local/models/vosk-model-small-de-0.15")  # small version
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model path {model_path} does not exist. Please download and unzip a Vosk model.")
+    # Number of bytes fed into the recognizer at once (4000 frames of 16-bit mono audio)
+    CHUNK_SIZE = 8000
+
+    MODEL_DIR = "~/.local/models"
+    MODEL_NAME = "vosk-model-small-de-0.15"  # small version
+
+    def __init__(self, model_name=None):
+        """
+        Args:
+            model_name (str, optional): Name of the Vosk model in MODEL_DIR, MODEL_NAME by default.
+        """
+        self.model_name = model_name or self.MODEL_NAME
+        model_path = self.get_model_path(self.model_name)
 
-        self.model = Model(model_path)
+        with instrumentation.measure("model_load"):
+            self.model = Model(model_path)
         self._total_word_count = 0
+        # Seconds of audio processed by the speech recognition
+        self.processed_seconds = 0.0
+
+    @classmethod
+    def get_model_path(cls, model_name: str) -> str:
+        """
+        Get the path of a Vosk model in MODEL_DIR.
+
+        Raises:
+            FileNotFoundError: If the model does not exist.
+        """
+        model_path = os.path.expanduser(os.path.join(cls.MODEL_DIR, model_name))
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model path {model_path} does not exist. Please download and unzip a Vosk model.")
+        return model_path
 
     def get_speech(self, segment_path: Path):
         """
@@ -27,31 +54,58 @@ class AudioSegmentAnalyser:
         Returns:
             str: The recognized text from the audio segment.
         """
-        wf = wave.open(str(segment_path), "rb")
+        with wave.open(str(segment_path), "rb") as wf:
+            # Ensure the audio file is in the correct format
+            if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() != 16000:
+                raise ValueError("Audio file must be WAV format with mono channel, 16-bit samples, and 16 kHz sample rate.")
+
+            return self.get_speech_from_pcm(wf.readframes(wf.getnframes()))
+
+    def get_speech_from_pcm(self, pcm: bytes):
+        """
+        Perform speech recognition on raw PCM data using Vosk.
+
+        Args:
+            pcm (bytes): Mono 16-bit PCM data with a sample rate of 16 kHz.
+
+        Returns:
+            str: The recognized text from the PCM data.
+        """
+        return self.get_speech_and_word_times_from_pcm(pcm)[0]
 
-        # Ensure the audio file is in the correct format
-        if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() != 16000:
-            raise ValueError("Audio file must be WAV format with mono channel, 16-bit samples, and 16 kHz sample rate.")
+    @instrumented("asr")
+    def get_speech_and_word_times_from_pcm(self, pcm: bytes):
+        """
+        Perform speech recognition with word-level timing on raw PCM data using Vosk.
 
-        recognizer = KaldiRecognizer(self.model, wf.getframerate())
+        Args:
+            pcm (bytes): Mono 16-bit PCM data with a sample rate of 16 kHz.
+
+        Returns:
+            tuple: The recognized text and a list of (start, end) tuples of the recognized words in seconds
+                relative to the beginning of the PCM data.
+        """
+        recognizer = KaldiRecognizer(self.model, 16000)
+        recognizer.SetWords(True)
+        self.processed_seconds += len(pcm) / 32000
 
         self._total_word_count = 0
         text = []
-        while True:
-            data = wf.readframes(4000)
-            if len(data) == 0:
-                break
-            if recognizer.AcceptWaveform(data):
-                words = self.fetch_words(recognizer.Result())
-                self._append_words_to_text(text, words)
+        word_times = []
+        for offset in range(0, len(pcm), self.CHUNK_SIZE):
+            if recognizer.AcceptWaveform(pcm[offset:offset + self.CHUNK_SIZE]):
+                result = recognizer.Result()
+                self._append_words_to_text(text, self.fetch_words(result))
+                word_times.extend(self.fetch_word_times(result))
 
-        words = self.fetch_words(recognizer.FinalResult())
-        self._append_words_to_text(text, words)
+        result = recognizer.FinalResult()
+        self._append_words_to_text(text, self.fetch_words(result))
+        word_times.extend(self.fetch_word_times(result))
 
         if self._total_word_count > 4:
-            return " ".join(text)
+            return " ".join(text), word_times
         else:
-            return ""
+            return "", []
 
     def _append_words_to_text(self, recognized_text, words):
         word_count = len(words.split())
@@ -63,6 +117,10 @@ class AudioSegmentAnalyser:
     def fetch_words(result):
         return json.loads(result)['text'].strip()
 
+    @staticmethod
+    def fetch_word_times(result):
+        return [(word['start'], word['end']) for word in json.loads(result).get('result', [])]
+
 
 # Example usage
 if __name__ == "__main__":
@@ -1,60 +1,410 @@
+import hashlib
+import json
 import logging
 import os
+import resource
+import struct
 import subprocess
+import wave
 from pathlib import Path
-from pydub import AudioSegment
 import shutil
+import threading
+import numpy as np
+from instrumentation import instrumented
+import tool_runner
 
+# Number of bytes of converted PCM data that are processed at once
+CONVERSION_CHUNK_SIZE = 1 << 20
 
-def extract_segment(wav_path: Path, start_time: int, duration: int, segment_name="temp_segment.wav"):
+# Number of bytes at the beginning and at the end of a file that are used for its fingerprint
+FINGERPRINT_BLOCK_SIZE = 1 << 16
+
+# Number of blocks (of FINGERPRINT_BLOCK_SIZE bytes, spread evenly over the file) that are used for the fingerprint
+# of a source file in the analysis cache
+SOURCE_FINGERPRINT_BLOCKS = 32
+
+# Probed audio files: path -> ((modification time, size), AudioInfo)
+_probe_cache = {}
+_probe_cache_lock = threading.Lock()
+
+
+class AudioInfo:
+    """
+    Format of an audio file (of its first audio stream).
+    """
+
+    def __init__(self, duration: float, sample_rate: int, channels: int, codec: str):
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.codec = codec
+
+    @classmethod
+    def from_pcm(cls, pcm: bytes, sample_rate=16000, channels=1):
+        """
+        Get the format of 16-bit PCM data that is already in memory (no file is probed).
+        """
+        return cls(len(pcm) / (2 * channels * sample_rate), sample_rate, channels, "pcm_s16le")
+
+    def __eq__(self, other):
+        return isinstance(other, AudioInfo) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return (f"AudioInfo(duration={self.duration}, sample_rate={self.sample_rate}, channels={self.channels}, "
+                f"codec={self.codec!r})")
+
+
+def read_pcm_segments(wav_path: Path, start_time: int, segment_length: int, end_time: float):
+    """
+    Read consecutive segments of raw PCM data from an analysable (16 kHz mono) WAV file.
+
+    The file is opened once and the segment boundaries are computed from sample counts, so no
+    subprocess or temporary file is needed per segment.
+
+    Args:
+        wav_path (Path): Path to the analysable WAV file.
+        start_time (int): Start time of the first segment in seconds.
+        segment_length (int): Length of each segment in seconds.
+        end_time (float): No segment starts at or after this time (in seconds).
+
+    Yields:
+        tuple: The start time of the segment in seconds and its PCM data (bytes).
+    """
+    with wave.open(str(wav_path), "rb") as wf:
+        if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() != 16000:
+            raise ValueError(f"{wav_path} must be WAV format with mono channel, 16-bit samples, "
+                             f"and 16 kHz sample rate.")
+        frame_rate = wf.getframerate()
+        if start_time * frame_rate >= wf.getnframes():
+            return
+        wf.setpos(start_time * frame_rate)
+        while start_time < end_time:
+            data = wf.readframes(segment_length * frame_rate)
+            if len(data) == 0:
+                break
+            yield start_time, data
+            start_time += segment_length
+
+
+def read_pcm_segment(wav_file, start_time: int, segment_length: int) -> bytes:
     """
-    Extract a segment from the WAV audio file.
+    Read one segment of raw PCM data from an opened analysable WAV file (random access, see read_pcm_segments).
 
     Args:
-        wav_path (Path): Path to the input WAV file.
+        wav_file (wave.Wave_read): The opened analysable WAV file.
         start_time (int): Start time of the segment in seconds.
-        duration (int): Duration of the segment in seconds.
-        segment_name (str): The output segment file.
+        segment_length (int): Length of the segment in seconds.
+
+    Returns:
+        bytes: The PCM data, empty if the segment starts after the end of the file.
     """
-    segment_path = wav_path.parent / segment_name
-    command = f'ffmpeg -loglevel error -ss {start_time} -t {duration} -i "{wav_path}" "{segment_path}"'
-    result = subprocess.call(command, shell=True)
-    if result != 0:
-        logging.error(f"Failed to extract segment from {wav_path}")
-        raise RuntimeError(f"ffmpeg segment extraction failed for {wav_path}")
-    return segment_path
+    frame_rate = wav_file.getframerate()
+    if start_time * frame_rate >= wav_file.getnframes():
+        return b""
+    wav_file.setpos(start_time * frame_rate)
+    return wav_file.readframes(segment_length * frame_rate)
 
 
+@instrumented("decode")
 def create_analysable_audio(temp_dir: str, audio_path: Path, wav_name="temp_audio.wav") -> Path:
+    """
+    Create a mono 16-bit WAV file with a sample rate of 16 kHz from the given audio file.
+
+    The audio is decoded and resampled by a single ffmpeg process whose output is streamed into the WAV file
+    in chunks of CONVERSION_CHUNK_SIZE bytes, so the memory usage does not depend on the length of the audio.
+
+    Args:
+        temp_dir (str): Directory the WAV file is created in.
+        audio_path (Path): Path to the audio file.
+        wav_name (str): Name of the WAV file.
+
+    Returns:
+        Path: Path to the created WAV file.
+    """
     wav_path = Path(os.path.join(temp_dir, wav_name))
+
+    # Check if the audio is already a mono WAV with frame rate 16000
+    if _is_analysable_wav(audio_path):
+        # Copy the file directly
+        shutil.copy(audio_path, wav_path)
+        logging.info(f"Copied {audio_path} to {wav_path} as it already meets the requirements.")
+        return wav_path
+
+    command = ['ffmpeg', '-loglevel', 'error', '-i', str(audio_path), '-vn',
+               '-ar', '16000', '-ac', '1', '-f', 's16le', '-acodec', 'pcm_s16le', '-']
     try:
-        # Load the audio file
-        audio = AudioSegment.from_file(audio_path)
-
-        # Check if the audio is already a mono WAV with frame rate 16000
-        if (
-            audio.frame_rate == 16000 and
-            audio.channels == 1 and
-            audio_path.suffix.lower() == ".wav"
-        ):
-            # Copy the file directly
-            shutil.copy(audio_path, wav_path)
-            logging.info(f"Copied {audio_path} to {wav_path} as it already meets the requirements.")
-        else:
-            # Convert the audio to mono WAV with frame rate 16000
-            audio = audio.set_frame_rate(16000).set_channels(1)
-            audio.export(wav_path, format="wav")
-            logging.info(f"Converted {audio_path} to {wav_path}")
-    except Exception as e:
+        with subprocess.Popen(command, stdout=subprocess.PIPE) as process, wave.open(str(wav_path), "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(16000)
+            while chunk := process.stdout.read(CONVERSION_CHUNK_SIZE):
+                wf.writeframesraw(chunk)
+    except OSError as e:
         logging.error(f"Failed to process {audio_path}: {e}")
         raise RuntimeError(f"Failed to process {audio_path}")
+    if process.returncode != 0:
+        logging.error(f"Failed to process {audio_path}: ffmpeg exited with {process.returncode}")
+        raise RuntimeError(f"Failed to process {audio_path}")
 
+    peak_rss, peak_rss_ffmpeg = get_peak_rss_mib()
+    logging.info(f"Converted {audio_path} to {wav_path} "
+                 f"(peak RSS {peak_rss:.1f} MiB, ffmpeg {peak_rss_ffmpeg:.1f} MiB)")
     return wav_path
 
 
+def read_pcm_chunks(audio_path: Path, sample_rate: int, channels: int, chunk_size=CONVERSION_CHUNK_SIZE,
+                    start=0.0, length=None):
+    """
+    Decode an audio file (or a part of it) into 16-bit PCM data with the given sample rate and channels (the
+    samples of the channels interleaved). The audio is decoded by a single ffmpeg process whose output is streamed
+    in chunks.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        sample_rate (int): Sample rate of the PCM data in Hz.
+        channels (int): Number of channels of the PCM data.
+        chunk_size (int): Size of the chunks in bytes (all chunks but the last one have this size).
+        start (float): Start of the decoded part in seconds (ffmpeg seeks to it).
+        length (float): Length of the decoded part in seconds, None for the rest of the file.
+
+    Yields:
+        bytes: The PCM data.
+    """
+    command = ['ffmpeg', '-loglevel', 'error']
+    if start > 0:
+        command += ['-ss', str(start)]
+    if length is not None:
+        command += ['-t', str(length)]
+    command += ['-i', str(audio_path), '-vn', '-ar', str(sample_rate),
+                '-ac', str(channels), '-f', 's16le', '-acodec', 'pcm_s16le', '-']
+    try:
+        with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+            while chunk := process.stdout.read(chunk_size):
+                yield chunk
+    except OSError as e:
+        logging.error(f"Failed to decode {audio_path}: {e}")
+        raise RuntimeError(f"Failed to decode {audio_path}")
+    if process.returncode != 0:
+        logging.error(f"Failed to decode {audio_path}: ffmpeg exited with {process.returncode}")
+        raise RuntimeError(f"Failed to decode {audio_path}")
+
+
+@instrumented("decode_window")
+def read_pcm_window(audio_path: Path, start: float, length: float) -> bytes:
+    """
+    Decode a window of an audio file into raw 16 kHz mono 16-bit PCM data in memory. Only the window is
+    decoded (ffmpeg seeks to its start), no temporary file is written.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        start (float): Start of the window in seconds.
+        length (float): Length of the window in seconds.
+
+    Returns:
+        bytes: The PCM data.
+    """
+    return tool_runner.run(create_pcm_window_command(audio_path, start, length)).stdout
+
+
+@instrumented("decode_window")
+def read_pcm_windows(audio_path: Path, windows):
+    """
+    Decode several windows of an audio file at once (see read_pcm_window), one ffmpeg process per window.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        windows (list): Tuples of start and length (in seconds) of the windows.
+
+    Returns:
+        list: The PCM data of the windows in the given order.
+    """
+    results = tool_runner.run_all([create_pcm_window_command(audio_path, start, length) for start, length in windows])
+    return [result.stdout for result in results]
+
+
+def create_pcm_window_command(audio_path, start, length):
+    return ['ffmpeg', '-loglevel', 'error', '-ss', str(max(start, 0.0)), '-t', str(length),
+            '-i', str(audio_path), '-vn', '-ar', '16000', '-ac', '1', '-f', 's16le', '-acodec', 'pcm_s16le', '-']
+
+
+def get_wav_data_layout(wav_path: Path):
+    """
+    Find the PCM data in a WAV file (by walking its RIFF chunks).
+
+    Returns:
+        tuple: Byte offset of the PCM data in the file and its size in bytes.
+    """
+    with open(wav_path, "rb") as file:
+        riff, _, wave_id = struct.unpack("<4sI4s", file.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"{wav_path} is not a WAV file")
+        while chunk_header := file.read(8):
+            if len(chunk_header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"data":
+                data_offset = file.tell()
+                return data_offset, min(chunk_size, os.path.getsize(wav_path) - data_offset)
+            # Chunks are padded to an even size
+            file.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    raise ValueError(f"{wav_path} contains no PCM data")
+
+
+def read_pcm_shard_segments(wav_path: Path, offset: int, length: float, segment_length: int):
+    """
+    Read the segments of a shard (a part of an analysable WAV file) from the memory-mapped file, so the shard
+    does not need to be written as a file of its own. Only the pages of the shard are read.
+
+    Args:
+        wav_path (Path): Path to the analysable (16 kHz mono 16-bit) WAV file.
+        offset (int): Start of the shard in seconds (a multiple of segment_length).
+        length (float): Length of the shard in seconds.
+        segment_length (int): Length of each segment in seconds.
+
+    Yields:
+        tuple: The start time of the segment relative to the shard in seconds and its PCM data (bytes).
+    """
+    data_offset, data_size = get_wav_data_layout(wav_path)
+    if data_size < 2:
+        return
+    samples = np.memmap(wav_path, dtype="<i2", mode="r", offset=data_offset, shape=(data_size // 2,))
+    first_sample = offset * 16000
+    last_sample = min(len(samples), first_sample + int(round(length * 16000)))
+    for start in range(first_sample, last_sample, segment_length * 16000):
+        yield (start - first_sample) // 16000, samples[start:min(start + segment_length * 16000, last_sample)].tobytes()
+
+
+def _is_analysable_wav(audio_path: Path) -> bool:
+    if audio_path.suffix.lower() != ".wav":
+        return False
+    try:
+        with wave.open(str(audio_path), "rb") as wf:
+            return wf.getnchannels() == 1 and wf.getsampwidth() == 2 and wf.getframerate() == 16000
+    except (wave.Error, EOFError):
+        return False
+
+
+def get_peak_rss_mib():
+    """
+    Get the peak resident set size of this process and of its largest terminated child process
+    (e.g. ffmpeg).
+
+    Returns:
+        tuple: Both peak resident set sizes in MiB.
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+def get_file_fingerprint(path: Path) -> str:
+    """
+    Get a cheap fingerprint of a file from its size and its first and last FINGERPRINT_BLOCK_SIZE bytes.
+
+    Returns:
+        str: The fingerprint as hex string.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, "rb") as file:
+        digest.update(file.read(FINGERPRINT_BLOCK_SIZE))
+        if size > FINGERPRINT_BLOCK_SIZE:
+            file.seek(max(FINGERPRINT_BLOCK_SIZE, size - FINGERPRINT_BLOCK_SIZE))
+            digest.update(file.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def get_source_fingerprint(path: Path) -> str:
+    """
+    Get the fingerprint of a source file in the analysis cache from its size and SOURCE_FINGERPRINT_BLOCKS blocks
+    spread evenly over the file (the whole file if it is smaller). An analysis found by this fingerprint is used
+    without decoding the file, so unlike get_file_fingerprint it also samples the middle of the file: recordings
+    of the same stream often have the same size, beginning and end.
+
+    Returns:
+        str: The fingerprint as hex string.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    size = os.path.getsize(path)
+    digest.update(f"{size} {SOURCE_FINGERPRINT_BLOCKS}".encode())
+    with open(path, "rb") as file:
+        if size <= SOURCE_FINGERPRINT_BLOCKS * FINGERPRINT_BLOCK_SIZE:
+            digest.update(file.read())
+        else:
+            step = (size - FINGERPRINT_BLOCK_SIZE) / (SOURCE_FINGERPRINT_BLOCKS - 1)
+            for block in range(SOURCE_FINGERPRINT_BLOCKS):
+                file.seek(round(block * step))
+                digest.update(file.read(FINGERPRINT_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def get_pcm_fingerprint(wav_path: Path) -> str:
+    """
+    Get the fingerprint of the PCM data of an analysable WAV file (independent of the WAV header).
+
+    Returns:
+        str: The SHA-256 hash of the PCM data as hex string.
+    """
+    digest = hashlib.sha256()
+    with wave.open(str(wav_path), "rb") as wf:
+        digest.update(f"{wf.getnchannels()} {wf.getsampwidth()} {wf.getframerate()}".encode())
+        frames_per_chunk = CONVERSION_CHUNK_SIZE // (wf.getnchannels() * wf.getsampwidth())
+        while data := wf.readframes(frames_per_chunk):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def probe_audio(audio_path: Path) -> AudioInfo:
+    """
+    Get the duration, sample rate, number of channels and codec of an audio file. The result is memoised until
+    the file is modified (by its modification time and size). PCM WAV files are read from their header, other
+    files are probed by a single ffprobe call.
+    """
+    stat = os.stat(audio_path)
+    key, version = os.path.abspath(audio_path), (stat.st_mtime_ns, stat.st_size)
+    with _probe_cache_lock:
+        cached = _probe_cache.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    info = _read_wav_header(audio_path, stat.st_size) or _run_ffprobe(audio_path)
+    with _probe_cache_lock:
+        _probe_cache[key] = (version, info)
+    return info
+
+
+def _read_wav_header(audio_path: Path, file_size: int):
+    if Path(audio_path).suffix.lower() != ".wav":
+        return None
+    try:
+        with wave.open(str(audio_path), "rb") as wf:
+            frame_size = wf.getnchannels() * wf.getsampwidth()
+            # Streamed WAVs (e.g. written by ffmpeg to a pipe) have no valid data size
+            if not 0 < wf.getnframes() * frame_size <= file_size:
+                return None
+            return AudioInfo(wf.getnframes() / wf.getframerate(), wf.getframerate(), wf.getnchannels(),
+                             f"pcm_s{8 * wf.getsampwidth()}le" if wf.getsampwidth() > 1 else "pcm_u8")
+    except (wave.Error, EOFError):
+        return None
+
+
+@instrumented("probe")
+def _run_ffprobe(audio_path: Path) -> AudioInfo:
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+               '-show_entries', 'format=duration:stream=codec_name,sample_rate,channels', '-of', 'json',
+               str(audio_path)]
+    try:
+        result = json.loads(tool_runner.run(command).stdout)
+        stream = result["streams"][0]
+        return AudioInfo(float(result["format"]["duration"]), int(stream["sample_rate"]), int(stream["channels"]),
+                         stream["codec_name"])
+    except (RuntimeError, ValueError, KeyError, IndexError) as e:
+        logging.error(f"Error occurred while probing {audio_path}: {e}")
+        raise RuntimeError(f"Probing the audio format failed for {audio_path}")
+
+
 def get_total_length_of_audio(audio_path: Path) -> float:
     """
-    Get the total length of an audio file in seconds using ffprobe.
+    Get the total length of an audio file in seconds (see probe_audio).
 
     Args:
         audio_path (Path): Path to the audio file.
@@ -62,40 +412,69 @@ def get_total_length_of_audio(audio_path: Path) -> float:
     Returns:
         float: Total length of the audio file in seconds.
     """
-    command = [
-        'ffprobe', '-i', str(audio_path),
-        '-show_entries', 'format=duration',
-        '-v', 'quiet',
-        '-of', 'csv=p=0'
-    ]
+    return probe_audio(audio_path).duration
+
+
+@instrumented("cut")
+def split_audio_ranges(audio_path, ranges, overwrite=False):
+    """
+    Cut several ranges of an audio file in a single pass: one ffmpeg process reads the audio file once and writes
+    all ranges, so the cost does not grow with the number of ranges times the length of the file.
+
+    Args:
+        audio_path: Path to the audio file.
+        ranges (list): Tuples of start (seconds), end (seconds), output path and optionally the metadata tags
+            (dict) of each range.
+        overwrite (bool): If True, existing output files are overwritten, otherwise ffmpeg fails if one exists.
 
+    Raises:
+        RuntimeError: If ffmpeg fails. The output files written by ffmpeg are removed then, the files that existed
+            before (and were not overwritten) are kept.
+    """
+    if not ranges:
+        return
+    output_paths = [Path(output_path) for _, _, output_path, *_ in ranges]
+    existing_paths = set() if overwrite else {output_path for output_path in output_paths if output_path.exists()}
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        duration_str = result.stdout.strip()
-        duration = float(duration_str)
-        return duration
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error occurred while retrieving audio duration: {e}")
-        raise RuntimeError(f"Retrieving audio duration failed for {audio_path}")
+        tool_runner.run(create_ffmpeg_multi_split_command(audio_path, ranges, overwrite))
+    except RuntimeError:
+        for output_path in output_paths:
+            if output_path not in existing_paths:
+                output_path.unlink(missing_ok=True)
+        raise
 
 
-def split_audio(audio_path, start, end, output_name: str, suffix: str) -> Path:
-    output_path = Path(output_name + suffix)
-    duration = end - start
-    command = create_ffmpeg_split_command(suffix, audio_path, output_path, start, duration)
-    subprocess.call(command, shell=True)
-    return output_path
+def create_ffmpeg_multi_split_command(audio_path, ranges, overwrite=False):
+    command = ['ffmpeg', '-loglevel', 'error', '-y' if overwrite else '-n', '-i', str(audio_path)]
+    for start, end, output_path, *tags in ranges:
+        command += ['-ss', str(start), '-t', str(end - start)]
+        if Path(output_path).suffix.lower() not in [".flac", ".wav"]:
+            command += ['-c', 'copy']
+        for name, value in (tags[0] if tags else {}).items():
+            command += ['-metadata', f'{name}={value}']
+        if tags and Path(output_path).suffix.lower() in [".m4a", ".mp4"]:
+            command += ['-movflags', 'use_metadata_tags']
+        command.append(str(output_path))
+    return command
 
 
-def create_ffmpeg_split_command(suffix, audio_path, output_path, start, duration):
-    if suffix.lower() in [".flac", ".wav"]:
-        return f'ffmpeg -loglevel error -i "{audio_path}" -ss {start} -t {duration} "{output_path}"'
-    else:
-        return f'ffmpeg -loglevel error -ss {start} -i "{audio_path}" -t {duration} -c copy "{output_path}"'
+@instrumented("gain")
+def mp3_gain(mp3_audio_path: Path, gain_steps=None) -> str:
+    """
+    Normalize the volume of an MP3 file with mp3gain (lossless, the global gain of the frames is changed).
 
+    Args:
+        mp3_audio_path (Path): Path to the MP3 file.
+        gain_steps (int, optional): Apply this gain (in steps of 1.5 dB) without analysing the file. By default,
+            mp3gain analyses the file and applies the track gain without clipping.
 
-def mp3_gain(mp3_audio_path: Path):
-    try:
-        result = subprocess.call(f"mp3gain -r -k \"{str(mp3_audio_path)}\"", shell=True)
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Error executing mp3gain: {e}")
+    Returns:
+        str: The console output of mp3gain.
+    """
+    result = tool_runner.run(create_mp3_gain_command(mp3_audio_path, gain_steps))
+    return result.stdout.decode(errors='replace').strip()
+
+
+def create_mp3_gain_command(mp3_audio_path, gain_steps=None):
+    options = ['-r', '-k'] if gain_steps is None else ['-g', str(gain_steps)]
+    return ['mp3gain'] + options + [str(mp3_audio_path)]
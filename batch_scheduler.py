@@ -0,0 +1,136 @@
+import glob
+import heapq
+import itertools
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+
+"""
+Scheduling of the analysis of several audio files on one shared worker pool.
+
+The shards of all files are analysed by the same SpeechWorkerPool (so the Vosk model is loaded only once per
+worker and no core is idle at the end of a file). The files are decoded concurrently and the shards of a file are
+handed to the pool as soon as it is decoded, so the workers do not wait for the decoding of all files. The shards
+are handed to the pool on demand, the next shard is always one of the file with the least remaining work (see
+ShardScheduler), so a short file that is decoded later is not queued behind a long one.
+"""
+
+# Suffixes of the audio files that are collected from directories and glob patterns
+AUDIO_SUFFIXES = (".aac", ".flac", ".m4a", ".mp3", ".ogg", ".opus", ".wav")
+
+# Kinds of the events of analyse_shards_on_demand
+_FILE = "file"
+_FILES_DONE = "files done"
+_RESULT = "result"
+_ERROR = "error"
+
+
+def collect_audio_files(arguments):
+    """
+    Collect the audio files from the given files, directories and glob patterns.
+
+    Args:
+        arguments (iterable): Paths of audio files or directories or glob patterns.
+
+    Returns:
+        list: The paths of the audio files (each only once, in the given order).
+    """
+    audio_files = []
+    for argument in arguments:
+        path = Path(argument)
+        if path.is_file():
+            candidates = [path]
+        else:
+            candidates = sorted(path.iterdir()) if path.is_dir() else sorted(Path(p) for p in glob.glob(argument))
+            candidates = [candidate for candidate in candidates
+                          if candidate.is_file() and candidate.suffix.lower() in AUDIO_SUFFIXES]
+        for candidate in candidates:
+            if candidate not in audio_files:
+                audio_files.append(candidate)
+    return audio_files
+
+
+class ShardScheduler:
+    """
+    The shards of several files that are handed out one at a time: always the next shard of the file with the
+    least remaining (not yet handed out) work, so the files are completed as early as possible. Files can be added
+    while the shards are handed out, a shorter file that is added later is worked on first.
+    """
+
+    def __init__(self):
+        # (remaining work, order of addition, file key, shards) per file with shards left
+        self._heap = []
+        self._order = itertools.count()
+
+    def add(self, key, shards):
+        """
+        Args:
+            key: Key of the file.
+            shards (iterable): (offset, path, length) tuples of the shards of the file.
+        """
+        shards = deque(sorted(shards, key=lambda shard: shard[0]))
+        if shards:
+            heapq.heappush(self._heap, (sum(length for _, _, length in shards), next(self._order), key, shards))
+
+    def pop(self):
+        """
+        Returns:
+            tuple: File key, offset, path and length of the next shard.
+        """
+        remaining, order, key, shards = heapq.heappop(self._heap)
+        offset, path, length = shards.popleft()
+        if shards:
+            heapq.heappush(self._heap, (remaining - length, order, key, shards))
+        return key, offset, path, length
+
+    def __len__(self):
+        return sum(len(shards) for _, _, _, shards in self._heap)
+
+
+def analyse_shards_on_demand(files, analyse_shard, max_in_flight):
+    """
+    Hand the shards of the given files to a worker pool on demand: at most max_in_flight shards are handed out at
+    once, the next one is chosen by a ShardScheduler when a worker gets free or a file is added. So the order of
+    the shards that wait for a worker is not fixed when they are added.
+
+    Args:
+        files (iterable): (file key, shards) tuples, see ShardScheduler.add. The iterable is consumed in a
+            background thread, so it can still produce files (e.g. decode them) while the first ones are analysed.
+        analyse_shard (callable): Starts the analysis of a shard, called with the shard (file key, offset, path,
+            length), a callback for its result and a callback for an exception.
+        max_in_flight (int): Maximum number of shards that are handed out but not finished.
+
+    Yields:
+        The results of the shards in the order they are finished.
+    """
+    events = queue.Queue()
+
+    def add_files():
+        try:
+            for key, shards in files:
+                events.put((_FILE, (key, shards)))
+        except Exception as e:
+            events.put((_ERROR, e))
+        else:
+            events.put((_FILES_DONE, None))
+
+    threading.Thread(target=add_files, daemon=True).start()
+    scheduler = ShardScheduler()
+    in_flight = 0
+    files_done = False
+    while not files_done or len(scheduler) or in_flight:
+        while len(scheduler) and in_flight < max_in_flight:
+            analyse_shard(scheduler.pop(), lambda result: events.put((_RESULT, result)),
+                          lambda e: events.put((_ERROR, e)))
+            in_flight += 1
+        kind, value = events.get()
+        if kind == _FILE:
+            scheduler.add(*value)
+        elif kind == _FILES_DONE:
+            files_done = True
+        elif kind == _ERROR:
+            raise value
+        else:
+            in_flight -= 1
+            yield value
@@ -0,0 +1,252 @@
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from vosk import SetLogLevel
+from audio_segment_analyser import AudioSegmentAnalyser
+from audio_tools import (create_analysable_audio, read_pcm_segments, read_pcm_window, split_audio_ranges,
+                         get_total_length_of_audio)
+from audio_trimmer import find_trim_points
+from loudness import measure_block_statistics, get_gain
+from speech_finder import SpeechFinder
+from synthetic_corpus import create_recording
+import vad_model
+
+"""
+Benchmark of the analysis and export stages with a synthetic broadcast corpus (see synthetic_corpus.py).
+
+Every stage is timed separately (wall and CPU time, incl. subprocesses) and its real-time factor is computed.
+Every recording is benchmarked several times and the median of the runs is taken, so a single slow run does not
+look like a regression. The results are written as JSON. If a baseline (the JSON of an earlier run) is given,
+stages whose real-time factor got worse by more than the threshold are reported as regressions and the exit code
+is 1. A baseline is only compared with if it was created with the same seed, model, lengths and codecs.
+"""
+
+STAGES = ("decode", "asr", "vad_trim", "export", "gain")
+
+DEFAULT_LENGTHS_MIN = (2, 10)
+DEFAULT_CODECS = ("mp3", "flac", "wav")
+DEFAULT_THRESHOLD = 1.25
+DEFAULT_SEED = 1
+DEFAULT_REPEATS = 3
+
+# ffmpeg encoder options of the codecs of the corpus
+CODEC_OPTIONS = {
+    "mp3": ['-c:a', 'libmp3lame', '-b:a', '192k'],
+    "flac": ['-c:a', 'flac'],
+    "m4a": ['-c:a', 'aac', '-b:a', '192k'],
+    "wav": ['-c:a', 'pcm_s16le'],
+}
+
+
+def _get_cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+@contextmanager
+def _measure(stage_results, stage, audio_length):
+    wall_start, cpu_start = time.perf_counter(), _get_cpu_time()
+    yield
+    wall_time, cpu_time = time.perf_counter() - wall_start, _get_cpu_time() - cpu_start
+    stage_results[stage] = {"wall_seconds": round(wall_time, 4), "cpu_seconds": round(cpu_time, 4),
+                            "realtime_factor": round(wall_time / audio_length, 6)}
+
+
+def encode(wav_path: Path, codec: str) -> Path:
+    output_path = wav_path.with_suffix(f".{codec}")
+    if codec == "wav":
+        return wav_path
+    command = ['ffmpeg', '-loglevel', 'error', '-y', '-i', str(wav_path)] + CODEC_OPTIONS[codec] + [str(output_path)]
+    if subprocess.run(command).returncode != 0:
+        raise RuntimeError(f"Encoding {wav_path} as {codec} failed")
+    return output_path
+
+
+def benchmark_recording(audio_path: Path, layout, work_dir: Path, segment_analyser):
+    """
+    Run and time all stages for one recording of the corpus.
+
+    Returns:
+        dict: The results of the stages (see _measure).
+    """
+    audio_length = get_total_length_of_audio(audio_path)
+    music_parts = [(start, end) for start, end, kind in layout
+                   if kind == "music" and end - start >= SpeechFinder.SEGMENT_LENGTH_SEC + 5.0]
+    stage_results = {}
+
+    with _measure(stage_results, "decode", audio_length):
+        wav_path = create_analysable_audio(str(work_dir), audio_path)
+
+    with _measure(stage_results, "asr", audio_length):
+        for _, pcm in read_pcm_segments(wav_path, 0, SpeechFinder.SEGMENT_LENGTH_SEC, audio_length):
+            segment_analyser.get_speech_and_word_times_from_pcm(pcm)
+
+    with _measure(stage_results, "vad_trim", audio_length):
+        trimmed_parts = []
+        for start, end in music_parts:
+            begin, trimmed_end = find_trim_points(
+                lambda window_start, length: read_pcm_window(audio_path, start + window_start, length),
+                end - start, SpeechFinder.SEGMENT_LENGTH_SEC + 5.0)
+            trimmed_parts.append((start + begin, start + trimmed_end))
+
+    with _measure(stage_results, "export", audio_length):
+        split_audio_ranges(audio_path, [(begin, end, work_dir / f"{no:02d}_export{audio_path.suffix}")
+                                        for no, (begin, end) in enumerate(trimmed_parts, start=1)])
+
+    with _measure(stage_results, "gain", audio_length):
+        for begin, end in trimmed_parts:
+            get_gain(measure_block_statistics(audio_path, begin, end - begin), 0.0, end - begin)
+
+    return stage_results
+
+
+def get_median_stage_results(runs):
+    """
+    Combine the stage results of several runs of a recording.
+
+    Args:
+        runs (list): The stage results of every run (see benchmark_recording).
+
+    Returns:
+        dict: The median of every value of every stage.
+    """
+    return {stage: {key: round(statistics.median(run[stage][key] for run in runs), 6) for key in runs[0][stage]}
+            for stage in STAGES}
+
+
+def summarize(results):
+    """
+    Sum up the stage results of all recordings.
+
+    Returns:
+        dict: Wall seconds, CPU seconds and real-time factor of every stage.
+    """
+    audio_seconds = sum(result["audio_seconds"] for result in results)
+    summary = {}
+    for stage in STAGES:
+        wall_seconds = sum(result["stages"][stage]["wall_seconds"] for result in results)
+        cpu_seconds = sum(result["stages"][stage]["cpu_seconds"] for result in results)
+        summary[stage] = {"wall_seconds": round(wall_seconds, 4), "cpu_seconds": round(cpu_seconds, 4),
+                          "realtime_factor": round(wall_seconds / audio_seconds, 6)}
+    return summary
+
+
+def get_configuration_differences(baseline, seed: int, model: str, lengths, codecs):
+    """
+    Compare the configuration of a benchmark run with the one of a baseline.
+
+    Returns:
+        list: Descriptions of the differences, empty if the results can be compared.
+    """
+    differences = []
+    if baseline.get("seed") != seed:
+        differences.append(f"seed {baseline.get('seed')} instead of {seed}")
+    if baseline.get("model") != model:
+        differences.append(f"model {baseline.get('model')} instead of {model}")
+    baseline_recordings = sorted((result["length_min"], result["codec"]) for result in baseline.get("recordings", []))
+    recordings = sorted((length_min, codec) for length_min in lengths for codec in codecs)
+    if baseline_recordings != recordings:
+        differences.append(f"recordings {baseline_recordings} instead of {recordings}")
+    return differences
+
+
+def find_regressions(summary, baseline_summary, threshold):
+    """
+    Compare the real-time factors of the stages with a baseline.
+
+    Returns:
+        list: Descriptions of the stages whose real-time factor is more than threshold times the baseline.
+    """
+    regressions = []
+    for stage, result in summary.items():
+        baseline = baseline_summary.get(stage)
+        if not baseline or not baseline["realtime_factor"]:
+            continue
+        ratio = result["realtime_factor"] / baseline["realtime_factor"]
+        result["baseline_ratio"] = round(ratio, 3)
+        if ratio > threshold:
+            regressions.append(f"{stage}: real-time factor {result['realtime_factor']} is {ratio:.2f} times "
+                               f"the baseline ({baseline['realtime_factor']})")
+    return regressions
+
+
+def init_argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-l', '--lengths', type=float, nargs='+', default=DEFAULT_LENGTHS_MIN,
+                        help='Lengths of the synthetic recordings in minutes')
+    parser.add_argument('-c', '--codecs', nargs='+', default=DEFAULT_CODECS, choices=sorted(CODEC_OPTIONS),
+                        help='Codecs the recordings are encoded with')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Seed of the synthetic corpus')
+    parser.add_argument('-r', '--repeats', type=int, default=DEFAULT_REPEATS,
+                        help='Number of runs of every recording, the median of the runs is reported')
+    parser.add_argument('-o', '--output', help='Write the JSON results into this file (default: stdout)')
+    parser.add_argument('-b', '--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='A stage regressed if its real-time factor is more than THRESHOLD times the baseline')
+    return parser.parse_args()
+
+
+def main():
+    args = init_argument_parser()
+    if args.repeats < 1:
+        print("The value for --repeats must be at least 1.", file=sys.stderr)
+        sys.exit(2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differences = get_configuration_differences(baseline, args.seed, AudioSegmentAnalyser.MODEL_NAME,
+                                                    args.lengths, args.codecs)
+        if differences:
+            print(f"The baseline {args.baseline} was created with another configuration: {'; '.join(differences)}",
+                  file=sys.stderr)
+            sys.exit(2)
+    SetLogLevel(-1)
+    segment_analyser = AudioSegmentAnalyser()
+    vad_model.warm_up()
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for index, length_min in enumerate(args.lengths):
+            recording_dir = Path(temp_dir) / f"recording_{index}"
+            recording_dir.mkdir()
+            wav_path = recording_dir / "recording.wav"
+            layout = create_recording(wav_path, length_min * 60, args.seed + index)
+            for codec in args.codecs:
+                audio_path = encode(wav_path, codec)
+                runs = []
+                for _ in range(args.repeats):
+                    with tempfile.TemporaryDirectory(dir=recording_dir) as work_dir:
+                        runs.append(benchmark_recording(audio_path, layout, Path(work_dir), segment_analyser))
+                stage_results = get_median_stage_results(runs)
+                results.append({"length_min": length_min, "codec": codec, "audio_seconds": length_min * 60,
+                                "stages": stage_results})
+                print(f"{length_min} min {codec}: " +
+                      ", ".join(f"{stage} {stage_results[stage]['wall_seconds']:.2f} s" for stage in STAGES),
+                      file=sys.stderr)
+
+    report = {"seed": args.seed, "model": AudioSegmentAnalyser.MODEL_NAME, "repeats": args.repeats,
+              "recordings": results, "summary": summarize(results), "regressions": []}
+    if baseline:
+        report["regressions"] = find_regressions(report["summary"], baseline["summary"], args.threshold)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    for regression in report["regressions"]:
+        print(f"Regression: {regression}", file=sys.stderr)
+    sys.exit(1 if report["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
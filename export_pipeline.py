@@ -0,0 +1,89 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from pathlib import Path
+
+"""
+Bounded parallel pipeline for the export of the selected music segments.
+
+The segments are exported concurrently. Every export is a sequence of stages (e.g. gain) and the
+number of exports that can be in the same stage at once is limited per stage. The reports of the exports are
+printed in the order of the segments. If an export fails, the outputs of all exports are removed.
+"""
+
+# Default number of exports that can be in the same stage at once
+DEFAULT_STAGE_LIMITS = {
+    "gain": os.cpu_count(),
+}
+
+
+class ExportPipeline:
+    """
+    Runs export jobs concurrently with per-stage concurrency limits.
+    """
+
+    def __init__(self, stage_limits=None, max_workers=None, report=print):
+        """
+        Args:
+            stage_limits (dict, optional): Maximum number of exports per stage (by stage name). Stages that are
+                not given are not limited.
+            max_workers (int, optional): Maximum number of concurrent exports (default: number of CPUs).
+            report (callable): Called with the report of every export, in the order of the jobs.
+        """
+        self._semaphores = {name: threading.BoundedSemaphore(limit)
+                            for name, limit in (stage_limits or DEFAULT_STAGE_LIMITS).items()}
+        self._max_workers = max_workers or os.cpu_count()
+        self._report = report
+
+    def stage(self, name):
+        """
+        Context manager that is entered by an export that enters the stage with the given name. It blocks while
+        the stage is full.
+        """
+        return self._semaphores.get(name) or _NoLimit()
+
+    def run(self, jobs):
+        """
+        Run the export jobs.
+
+        Args:
+            jobs (list): Tuples of the output paths of the job and a callable that does the export and returns
+                its report (str).
+
+        Raises:
+            Exception: The first exception of a failed job. The outputs of all jobs are removed before.
+        """
+        reports = {}
+        next_report = 0
+        with ThreadPoolExecutor(self._max_workers) as executor:
+            futures = {executor.submit(function): index for index, (_, function) in enumerate(jobs)}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+                failed = [future for future in done if future.exception()]
+                if failed:
+                    for future in pending:
+                        future.cancel()
+                    wait(pending)
+                    self._remove_outputs(jobs)
+                    raise failed[0].exception()
+                for future in done:
+                    reports[futures[future]] = future.result()
+                while next_report in reports:
+                    self._report(reports.pop(next_report))
+                    next_report += 1
+
+    @staticmethod
+    def _remove_outputs(jobs):
+        for output_paths, _ in jobs:
+            for output_path in output_paths:
+                Path(output_path).unlink(missing_ok=True)
+
+
+class _NoLimit:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
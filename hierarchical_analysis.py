@@ -0,0 +1,95 @@
+"""
+Coarse-to-fine search for the speech segments of a recording.
+
+Instead of transcribing every segment, only every COARSE_SEGMENTS-th segment is classified first. A segment is
+only transcribed if both cheap checks leave speech possible: the pre-gate (not certainly music) and the VAD (speech
+detected). Between two of these probes with a different result (speech/music), the segments are bisected until the
+transition is found at the resolution of one segment; the word times of the transcribed segments at the transition
+give the exact boundary. Between two probes with the same result, the class is inferred and only checked by the
+cheap checks: a segment inferred as music is only transcribed if the pre-gate and the VAD both allow speech in it,
+a segment inferred as speech that is certainly music or in which the VAD detects no speech becomes music. Finally, every speech segment next to music is
+transcribed, so the speech around the music segments is known. The speech recognition work grows with the number
+of transitions, the music segments with detected speech (e.g. vocals) and the length of the speech divided by
+COARSE_SEGMENTS, not with the length of the recording.
+
+Music runs shorter than COARSE_SEGMENTS segments between speech may only be found if the pre-gate recognizes them
+or the VAD detects no speech in them (so short music with vocals can be missed).
+"""
+
+# Distance of the coarse probes in segments
+COARSE_SEGMENTS = 4
+
+# Speech of a segment that was not transcribed, because its class was inferred from its neighbours
+INFERRED_SPEECH = "..."
+
+
+def find_speech_segments(segment_count: int, transcribe, is_certainly_music, may_contain_speech,
+                         coarse_segments=COARSE_SEGMENTS):
+    """
+    Find the segments with speech from coarse to fine.
+
+    Args:
+        segment_count (int): Number of segments of the recording.
+        transcribe (callable): Called with the index of a segment and returns its speech (str) and word times.
+        is_certainly_music (callable): Called with the index of a segment and returns True if the segment is
+            certainly music (cheap pre-classification).
+        may_contain_speech (callable): Called with the index of a segment and returns False if the segment
+            certainly contains no speech (e.g. no speech detected by the VAD).
+        coarse_segments (int): Distance of the coarse probes in segments.
+
+    Returns:
+        dict: Speech and word times of all segments with speech by their index. The speech of segments that were
+            not transcribed is INFERRED_SPEECH (without word times).
+    """
+    transcriptions = {}
+
+    def is_speech(index):
+        if index not in transcriptions:
+            transcriptions[index] = transcribe(index)
+        return bool(transcriptions[index][0])
+
+    def classify(index):
+        return not is_certainly_music(index) and may_contain_speech(index) and is_speech(index)
+
+    if segment_count <= 0:
+        return {}
+    probes = list(range(0, segment_count, coarse_segments))
+    if probes[-1] != segment_count - 1:
+        probes.append(segment_count - 1)
+    speech = {index: classify(index) for index in probes}
+
+    def refine(first, last):
+        if last - first < 2:
+            return
+        middle = (first + last) // 2
+        speech[middle] = classify(middle)
+        if speech[middle] != speech[first]:
+            refine(first, middle)
+        if speech[middle] != speech[last]:
+            refine(middle, last)
+
+    for first, last in zip(probes, probes[1:]):
+        if speech[first] != speech[last]:
+            refine(first, last)
+
+    # Between known segments with the same class, the class is inferred and checked by the pre-gate and the VAD
+    known = sorted(speech)
+    for first, last in zip(known, known[1:]):
+        for index in range(first + 1, last):
+            if speech[first]:
+                speech[index] = not is_certainly_music(index) and may_contain_speech(index)
+            else:
+                speech[index] = classify(index)
+
+    # The speech next to music is transcribed (which can turn inferred speech into music)
+    changed = True
+    while changed:
+        changed = False
+        for index in range(segment_count):
+            if speech[index] and index not in transcriptions and (
+                    (index > 0 and not speech[index - 1]) or (index < segment_count - 1 and not speech[index + 1])):
+                speech[index] = is_speech(index)
+                changed = True
+
+    return {index: transcriptions.get(index, (INFERRED_SPEECH, []))
+            for index in range(segment_count) if speech[index]}
@@ -0,0 +1,196 @@
+import functools
+import json
+import resource
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from seconds_formatter import seconds_to_min_sec
+
+"""
+Lightweight instrumentation of the hot paths (decoding, speech recognition, VAD, cutting, gain).
+
+The instrumented functions record their calls, wall time, CPU time (of the calling thread and of the finished
+subprocesses), bytes read and number of started subprocesses per stage. Additionally, the time of every analysed
+segment and the real-time factor of the analysis are recorded. Nothing is recorded until enable() is called.
+
+Stages can run concurrently (e.g. in the export), so the CPU time of subprocesses, the bytes read and the
+subprocess counts of a stage are only approximations then.
+"""
+
+# Number of slowest segments in the report
+SLOWEST_SEGMENTS = 5
+
+_enabled = False
+_lock = threading.Lock()
+_stages = {}
+_segments = []
+_analysis = []
+_subprocess_count = 0
+_original_popen_init = subprocess.Popen.__init__
+
+
+def enable():
+    """
+    Enable the instrumentation (and count the started subprocesses from now on).
+    """
+    global _enabled
+    if not _enabled:
+        _enabled = True
+        subprocess.Popen.__init__ = _counting_popen_init
+
+
+def disable():
+    """
+    Disable the instrumentation and stop counting the started subprocesses. The recorded data is kept until
+    reset() is called.
+    """
+    global _enabled
+    if _enabled:
+        _enabled = False
+        subprocess.Popen.__init__ = _original_popen_init
+
+
+def _counting_popen_init(self, *args, **kwargs):
+    global _subprocess_count
+    with _lock:
+        _subprocess_count += 1
+    _original_popen_init(self, *args, **kwargs)
+
+
+def _get_bytes_read():
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _get_children_cpu_time():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return children.ru_utime + children.ru_stime
+
+
+@contextmanager
+def measure(stage: str):
+    """
+    Context manager that records the statistics of the enclosed code as one call of the given stage.
+    """
+    if not _enabled:
+        yield
+        return
+    wall_start, cpu_start, children_cpu_start = time.perf_counter(), time.thread_time(), _get_children_cpu_time()
+    bytes_start, subprocesses_start = _get_bytes_read(), _subprocess_count
+    try:
+        yield
+    finally:
+        cpu_time = time.thread_time() - cpu_start + _get_children_cpu_time() - children_cpu_start
+        with _lock:
+            statistics = _stages.setdefault(stage, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                    "bytes_read": 0, "subprocesses": 0})
+            statistics["calls"] += 1
+            statistics["wall_seconds"] += time.perf_counter() - wall_start
+            statistics["cpu_seconds"] += cpu_time
+            statistics["bytes_read"] += _get_bytes_read() - bytes_start
+            statistics["subprocesses"] += _subprocess_count - subprocesses_start
+
+
+def instrumented(stage: str):
+    """
+    Decorator that records every call of the decorated function as one call of the given stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with measure(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def segment(start_time: int):
+    """
+    Context manager that records the time of the analysis of the segment at the given start time.
+    """
+    wall_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _enabled:
+            with _lock:
+                _segments.append((time.perf_counter() - wall_start, start_time))
+
+
+def record_analysis(audio_seconds: float, wall_seconds: float):
+    """
+    Record an analysis of audio_seconds of audio that took wall_seconds.
+    """
+    if _enabled:
+        with _lock:
+            _analysis.append((audio_seconds, wall_seconds))
+
+
+def get_summary():
+    """
+    Returns:
+        dict: The statistics of the stages, the real-time factor of the analysis and the slowest segments.
+    """
+    with _lock:
+        summary = {"stages": {stage: dict(statistics) for stage, statistics in sorted(_stages.items())},
+                   "slowest_segments": [{"start": start_time, "seconds": round(seconds, 3)}
+                                        for seconds, start_time in sorted(_segments, reverse=True)[:SLOWEST_SEGMENTS]]}
+        if _analysis:
+            audio_seconds = sum(audio for audio, _ in _analysis)
+            wall_seconds = sum(wall for _, wall in _analysis)
+            summary["analysis"] = {"audio_seconds": round(audio_seconds, 3), "wall_seconds": round(wall_seconds, 3),
+                                   "realtime_factor": round(wall_seconds / audio_seconds, 6) if audio_seconds else None}
+    return summary
+
+
+def format_summary(summary) -> str:
+    """
+    Format the summary (see get_summary) as a table.
+    """
+    lines = ["Stage statistics:",
+             f"{'stage':<12}{'calls':>8}{'wall s':>10}{'cpu s':>10}{'MiB read':>10}{'processes':>11}"]
+    for stage, statistics in summary["stages"].items():
+        lines.append(f"{stage:<12}{statistics['calls']:>8}{statistics['wall_seconds']:>10.2f}"
+                     f"{statistics['cpu_seconds']:>10.2f}{statistics['bytes_read'] / (1 << 20):>10.1f}"
+                     f"{statistics['subprocesses']:>11}")
+    analysis = summary.get("analysis")
+    if analysis:
+        lines.append(f"Analysis of {seconds_to_min_sec(analysis['audio_seconds'])} of audio took "
+                     f"{seconds_to_min_sec(analysis['wall_seconds'])} (real-time factor "
+                     f"{analysis['realtime_factor']:.4f})")
+    if summary["slowest_segments"]:
+        lines.append("Slowest segments:")
+        lines.extend(f"{seconds_to_min_sec(segment_time['start']):>8}  {segment_time['seconds']:.2f} s"
+                     for segment_time in summary["slowest_segments"])
+    return "\n".join(lines)
+
+
+def report(output=None):
+    """
+    Print the summary or, if an output path is given, write it as JSON.
+    """
+    summary = get_summary()
+    if output:
+        with open(output, "w") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        print(format_summary(summary))
+
+
+def reset():
+    global _subprocess_count
+    with _lock:
+        _stages.clear()
+        _segments.clear()
+        _analysis.clear()
+        _subprocess_count = 0
@@ -0,0 +1,208 @@
+import logging
+import math
+import os
+import subprocess
+import time
+from pathlib import Path
+from audio_tools import get_file_fingerprint
+from music_segments_finder import find as find_music_segments
+from seconds_formatter import seconds_to_min_sec
+from speech_file import (format_speech_line, shift_word_times, load_lines, read_header, SpeechFileHeader,
+                         SpeechFileWriter, STATE_COMPLETE, MODE_LINEAR, SEGMENT_LENGTH_SEC)
+
+"""
+Analysis of recordings that are still being captured.
+
+The audio is read as a stream of raw 16 kHz mono 16-bit PCM data: from a growing audio file (decoded by ffmpeg,
+which waits for new data at the end of the file), from stdin or from a FIFO. Every segment is analysed as soon as
+it is complete and appended to the .speech file, and every music segment is reported as soon as the speech after
+it is detected. The analysis is only marked as complete when the stream ended regularly: ffmpeg exited
+successfully or the followed audio file did not grow for the idle timeout.
+"""
+
+# Bytes of one second of analysable PCM data
+PCM_BYTES_PER_SECOND = 32000
+
+# If a followed audio file does not grow for this time (in seconds), the recording is regarded as finished
+DEFAULT_IDLE_TIMEOUT = 60
+
+
+def follow_audio_file(audio_path: Path, start_time=0, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """
+    Start an ffmpeg process that decodes a (growing) audio file into analysable PCM data. At the end of the file,
+    ffmpeg waits for new data until the file did not grow for idle_timeout seconds.
+
+    Returns:
+        subprocess.Popen: The ffmpeg process, the PCM data is read from its stdout.
+    """
+    command = ['ffmpeg', '-loglevel', 'error', '-follow', '1', '-rw_timeout', str(int(idle_timeout * 1000000)),
+               '-ss', str(start_time), '-i', f'file:{audio_path}', '-vn',
+               '-ar', '16000', '-ac', '1', '-f', 's16le', '-acodec', 'pcm_s16le', '-']
+    return subprocess.Popen(command, stdout=subprocess.PIPE)
+
+
+def wait_for_audio_file(audio_path: Path, idle_timeout=DEFAULT_IDLE_TIMEOUT, poll_interval=1.0):
+    """
+    Wait until a recording that has not been started yet creates its audio file.
+
+    Raises:
+        RuntimeError: If the audio file was not created within idle_timeout seconds.
+    """
+    deadline = time.monotonic() + idle_timeout
+    while not audio_path.exists():
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"{audio_path} was not created within {idle_timeout:g} seconds")
+        time.sleep(poll_interval)
+
+
+def has_stopped_growing(audio_path: Path, idle_timeout=DEFAULT_IDLE_TIMEOUT) -> bool:
+    """
+    Returns:
+        bool: True if the audio file was not modified for idle_timeout seconds.
+    """
+    return time.time() - os.stat(audio_path).st_mtime >= idle_timeout
+
+
+def read_blocks(stream, block_size: int):
+    """
+    Read a stream in blocks of block_size bytes. A block is only returned when it is complete (or the stream ended).
+
+    Yields:
+        bytes: The blocks, the last one can be shorter.
+    """
+    while True:
+        block = bytearray()
+        while len(block) < block_size:
+            data = stream.read(block_size - len(block))
+            if not data:
+                break
+            block += data
+        if block:
+            yield bytes(block)
+        if len(block) < block_size:
+            return
+
+
+class LiveSpeechFinder:
+    """
+    Analyses a stream of analysable PCM data segment by segment while it is being recorded.
+    """
+
+    SEGMENT_LENGTH_SEC = SEGMENT_LENGTH_SEC
+
+    def __init__(self, speech_path: Path, on_music_segment=print, silent_operation=False, fsync=True,
+                 segment_analyser=None):
+        """
+        Args:
+            speech_path (Path): Path of the .speech file. An unfinished analysis in it is continued.
+            on_music_segment (callable): Called with every music segment (MusicSegment) as soon as it is closed
+                by speech.
+            silent_operation (bool): If True, the progress is not printed.
+            fsync (bool): If True, every checkpoint is synced to the disk.
+            segment_analyser (optional): Transcribes the segments (see AudioSegmentAnalyser, which is used by
+                default).
+        """
+        self._speech_path = speech_path
+        self._on_music_segment = on_music_segment
+        self._silent_operation = silent_operation
+        self._fsync = fsync
+        self._segment_analyser = segment_analyser
+        self._reported_music_segments = 0
+
+    def get_resume_time(self) -> int:
+        """
+        Returns:
+            int: The time (in seconds) to continue an unfinished analysis from, 0 for a new analysis.
+        """
+        if not self._speech_path.exists():
+            return 0
+        header = read_header(self._speech_path)
+        lines = load_lines(self._speech_path)
+        if (lines and lines[-1] != "end" and int(lines[0]) == self.SEGMENT_LENGTH_SEC and
+                (header is None or header.mode == MODE_LINEAR)):
+            return int(lines[-1])
+        raise RuntimeError(f"{self._speech_path} already contains an analysis")
+
+    def analyse(self, pcm_stream, start_time=0, fingerprint_source=None, process=None,
+                idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        Analyse the PCM stream until it ends.
+
+        Args:
+            pcm_stream: Binary stream of analysable (16 kHz mono 16-bit) PCM data.
+            start_time (int): Time of the beginning of the stream in the recording (in seconds), an unfinished
+                analysis is continued from there.
+            fingerprint_source (Path, optional): The recorded audio file. When the stream ended, its fingerprint is
+                stored in the .speech file, so the analysis is used for the extraction of the file.
+            process (subprocess.Popen, optional): The ffmpeg process that decodes fingerprint_source into the
+                stream (see follow_audio_file).
+            idle_timeout (float): The idle timeout of the process in seconds.
+
+        Returns:
+            list: The lines of the analysis.
+
+        Raises:
+            RuntimeError: If the process failed before the audio file stopped growing. The analysis stays
+                unfinished and is continued from its last checkpoint.
+        """
+        segment_analyser = self._segment_analyser or self._create_segment_analyser()
+        if start_time:
+            analysis_file = SpeechFileWriter.append_to(self._speech_path)
+            self.inform(f"Continuing the analysis at {seconds_to_min_sec(start_time)}")
+        else:
+            analysis_file = SpeechFileWriter(self._speech_path, SpeechFileHeader(self.SEGMENT_LENGTH_SEC, 0.0, ""))
+        lines = load_lines(self._speech_path)[:-1]
+        # The music segments before the last speech were reported before
+        self._reported_music_segments = len(find_music_segments(lines + ["end"], 0))
+
+        end_time = start_time
+        with analysis_file:
+            try:
+                for pcm in read_blocks(pcm_stream, self.SEGMENT_LENGTH_SEC * PCM_BYTES_PER_SECOND):
+                    end_time = start_time + len(pcm) / PCM_BYTES_PER_SECOND
+                    speech_segment, word_times = segment_analyser.get_speech_and_word_times_from_pcm(pcm)
+                    if speech_segment:
+                        line = format_speech_line(start_time, speech_segment, shift_word_times(word_times, start_time))
+                        analysis_file.append(line)
+                        lines.append(line)
+                        self.inform(f"{seconds_to_min_sec(start_time)} {speech_segment}")
+                        self._report_closed_music_segments(lines, end_time)
+                    elif start_time % 60 == 0:
+                        self.inform(f"{seconds_to_min_sec(start_time)}...")
+                    analysis_file.header.duration = end_time
+                    if end_time - start_time == self.SEGMENT_LENGTH_SEC:
+                        analysis_file.checkpoint(int(end_time), self._fsync)
+                    start_time = int(end_time)
+            except KeyboardInterrupt:
+                # The state stays "running", so the analysis is continued from the last checkpoint
+                print(f"User interrupted analysis at {seconds_to_min_sec(start_time)}.")
+                raise
+            if process is not None:
+                returncode = process.wait()
+                if returncode != 0 and not has_stopped_growing(fingerprint_source, idle_timeout):
+                    # The state stays "running", so the analysis is continued from the last checkpoint
+                    logging.error(f"Decoding {fingerprint_source} failed: ffmpeg exited with {returncode}")
+                    raise RuntimeError(f"Decoding {fingerprint_source} failed at {seconds_to_min_sec(start_time)}")
+            if fingerprint_source:
+                analysis_file.header.fingerprint = get_file_fingerprint(fingerprint_source)
+            analysis_file.set_state(STATE_COMPLETE, math.ceil(end_time), self._fsync)
+        return load_lines(self._speech_path)
+
+    @staticmethod
+    def _create_segment_analyser():
+        from vosk import SetLogLevel
+        from audio_segment_analyser import AudioSegmentAnalyser
+
+        SetLogLevel(-1)
+        return AudioSegmentAnalyser()
+
+    def _report_closed_music_segments(self, lines, end_time):
+        # The speech at end_time closes all music segments before it, so the last segment found is never open
+        music_segments = find_music_segments(lines + ["end"], end_time)
+        for music_segment in music_segments[self._reported_music_segments:]:
+            self._on_music_segment(music_segment)
+        self._reported_music_segments = len(music_segments)
+
+    def inform(self, message: str):
+        if not self._silent_operation:
+            print(message)
@@ -0,0 +1,157 @@
+import functools
+from pathlib import Path
+import numpy as np
+from audio_tools import read_pcm_chunks, probe_audio
+from instrumentation import instrumented
+
+"""
+Loudness analysis (EBU R128 / ITU-R BS.1770) of 16-bit PCM audio with NumPy.
+
+The K-weighted mean square and the peak of every 100 ms block are computed per channel from the audio decoded
+with its own sample rate and channels. Only the parts of the audio file that are exported are decoded. The mean
+squares of the channels are summed up (BS.1770 channel weight 1.0) and the peak is the highest sample of any
+channel, so uncorrelated stereo is measured as loud as it is and a peak in one channel is not hidden by a downmix.
+The gain of any range within a measured part is computed from its block statistics.
+
+The K-weighting is applied in the frequency domain per block (the filter state is not carried across blocks).
+So the results are a close approximation of BS.1770 that is accurate enough for normalization.
+"""
+
+SAMPLE_RATE = 16000
+BLOCK_LENGTH_SEC = 0.1
+
+# Gating blocks of BS.1770 consist of 4 blocks (400 ms, 75 % overlap)
+GATING_BLOCKS = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# Target loudness of ReplayGain 2.0
+REFERENCE_LOUDNESS = -18.0
+
+# Gain of one mp3gain step in dB
+MP3_GAIN_STEP = 1.5
+
+# Length of the chunks (in seconds) in which the decoded audio is measured
+READ_LENGTH_SEC = 600
+
+# Coefficients of the two K-weighting filters (high shelf and high pass) for 48 kHz (ITU-R BS.1770)
+_SHELF_B = (1.53512485958697, -2.69169618940638, 1.19839281085285)
+_SHELF_A = (1.0, -1.69065929318241, 0.73248077421585)
+_HIGH_PASS_B = (1.0, -2.0, 1.0)
+_HIGH_PASS_A = (1.0, -1.99004745483398, 0.99007225036621)
+
+
+@functools.lru_cache
+def _get_k_weighting_power_response(sample_rate: int):
+    block_samples = int(sample_rate * BLOCK_LENGTH_SEC)
+    # The filters are defined for 48 kHz, higher frequencies get the response at the Nyquist frequency of 48 kHz
+    frequencies = np.minimum(np.fft.rfftfreq(block_samples, d=1.0 / sample_rate), 24000)
+    z = np.exp(-1j * 2 * np.pi * frequencies / 48000)
+    response = np.ones_like(z)
+    for b, a in ((_SHELF_B, _SHELF_A), (_HIGH_PASS_B, _HIGH_PASS_A)):
+        response *= (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    power_response = np.abs(response) ** 2
+    # Parseval: the bins between DC and Nyquist stand for two (conjugate) bins
+    power_response[1:-1] *= 2
+    return power_response / block_samples ** 2
+
+
+def get_block_statistics(pcm: bytes, channels=1, sample_rate=SAMPLE_RATE):
+    """
+    Compute the K-weighted mean square and the peak of every complete 100 ms block of PCM data.
+
+    Args:
+        pcm (bytes): 16-bit PCM data (the samples of the channels interleaved).
+        channels (int): Number of channels.
+        sample_rate (int): Sample rate in Hz.
+
+    Returns:
+        numpy.ndarray: One row (mean square summed up over the channels, peak of all channels) per block.
+    """
+    block_samples = int(sample_rate * BLOCK_LENGTH_SEC)
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    block_count = len(samples) // (block_samples * channels)
+    # Blocks x channels x samples
+    blocks = samples[:block_count * block_samples * channels].reshape(block_count, block_samples, channels)
+    blocks = blocks.transpose(0, 2, 1)
+    channel_mean_squares = (np.abs(np.fft.rfft(blocks, axis=2)) ** 2) @ _get_k_weighting_power_response(sample_rate)
+    mean_squares = channel_mean_squares.sum(axis=1)
+    peaks = np.abs(blocks).max(axis=(1, 2)) if block_count else np.zeros(0)
+    return np.column_stack((mean_squares, peaks))
+
+
+@instrumented("loudness")
+def measure_block_statistics(audio_path: Path, start=0.0, length=None):
+    """
+    Compute the block statistics (see get_block_statistics) of an audio file or of a part of it. Only the part is
+    decoded, with the own sample rate and channels of the audio file.
+
+    Args:
+        audio_path (Path): Path to the audio file.
+        start (float): Start of the part in seconds, the first block begins there.
+        length (float): Length of the part in seconds, None for the rest of the file.
+    """
+    info = probe_audio(audio_path)
+    chunk_size = READ_LENGTH_SEC * info.sample_rate * info.channels * 2
+    parts = [get_block_statistics(pcm, info.channels, info.sample_rate)
+             for pcm in read_pcm_chunks(audio_path, info.sample_rate, info.channels, chunk_size, start, length)]
+    return np.concatenate(parts) if parts else np.zeros((0, 2))
+
+
+def get_integrated_loudness(block_statistics):
+    """
+    Compute the gated integrated loudness (BS.1770) from block statistics.
+
+    Args:
+        block_statistics (numpy.ndarray): See get_block_statistics.
+
+    Returns:
+        float: The loudness in LUFS, or None if the audio is silent or too short.
+    """
+    mean_squares = block_statistics[:, 0]
+    if len(mean_squares) < GATING_BLOCKS:
+        return None
+    gating_block_energies = np.convolve(mean_squares, np.ones(GATING_BLOCKS) / GATING_BLOCKS, mode='valid')
+    with np.errstate(divide='ignore'):
+        gating_block_loudness = -0.691 + 10 * np.log10(gating_block_energies)
+    above_absolute_gate = gating_block_energies[gating_block_loudness > ABSOLUTE_GATE]
+    if len(above_absolute_gate) == 0:
+        return None
+    relative_gate = -0.691 + 10 * np.log10(above_absolute_gate.mean()) + RELATIVE_GATE
+    gated = gating_block_energies[(gating_block_loudness > ABSOLUTE_GATE) & (gating_block_loudness > relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def get_gain(block_statistics, begin: float, end: float):
+    """
+    Compute the ReplayGain 2.0 gain of a part of the audio. The gain is limited, so the peak does not clip.
+
+    Args:
+        block_statistics (numpy.ndarray): See get_block_statistics.
+        begin (float): Begin of the part in seconds.
+        end (float): End of the part in seconds.
+
+    Returns:
+        tuple: The gain in dB and the peak (1.0 is full scale), or (None, None) if the part is silent.
+    """
+    part = block_statistics[int(begin / BLOCK_LENGTH_SEC):int(end / BLOCK_LENGTH_SEC)]
+    loudness = get_integrated_loudness(part)
+    if loudness is None:
+        return None, None
+    peak = float(part[:, 1].max())
+    return min(REFERENCE_LOUDNESS - loudness, -20 * np.log10(max(peak, 1e-9))), peak
+
+
+def get_mp3_gain_steps(gain: float) -> int:
+    """
+    Convert a gain in dB into mp3gain steps (1.5 dB each), rounded down so the peak does not clip.
+    """
+    return int(np.floor(gain / MP3_GAIN_STEP))
+
+
+def get_replay_gain_tags(gain: float, peak: float):
+    """
+    Returns:
+        dict: The ReplayGain track tags for the given gain and peak.
+    """
+    return {"REPLAYGAIN_TRACK_GAIN": f"{gain:+.2f} dB", "REPLAYGAIN_TRACK_PEAK": f"{peak:.6f}"}
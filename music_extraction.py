@@ -1,17 +1,24 @@
 import os
-import subprocess
 import sys
 from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
-from audio_trimmer import AudioTrimmer
+from audio_trimmer import find_trim_points, get_trim_windows, get_backup_path
 from speech_finder import SpeechFinder
 from music_segments_finder import find as find_music_segments
 from seconds_formatter import seconds_to_min_sec
 from music_segments_finder import MusicSegment
 import re
-from audio_tools import mp3_gain
+from audio_tools import mp3_gain, split_audio_ranges, read_pcm_windows
+from loudness import measure_block_statistics, get_gain, get_mp3_gain_steps, get_replay_gain_tags
 from music_speech_segments_finder import find as find_music_speech_segments
+import vad_model
+from analysis_cache import AnalysisCache
+from asr_cascade import DEFAULT_LARGE_MODEL_NAME
+import instrumentation
+from export_pipeline import ExportPipeline
 
 """
 Extracts music parts from an audio file (e.g. a radio recording)
@@ -30,7 +37,8 @@ def print_music_segments(segments):
 
 def merge_segments(segments, from_no, to_no):
     return MusicSegment(segments[from_no - 1].begin_seconds, segments[from_no - 1].speech_before,
-                        segments[to_no - 1].end_seconds, segments[to_no - 1].speech_after)
+                        segments[to_no - 1].end_seconds, segments[to_no - 1].speech_after,
+                        segments[from_no - 1].music_begin_seconds, segments[to_no - 1].music_end_seconds)
 
 
 def get_user_input_segments_to_keep():
@@ -58,34 +66,134 @@ def combine_segments(segments, segments_to_keep):
     return combined_segments
 
 
-def split_audio(audio_path, segments, less_silence_beginning, less_silence_end, concert_mode):
+def get_output_paths(audio_path, segment_count, with_speech=False):
+    """
+    Get the paths of the files the export of the segments writes.
+
+    Returns:
+        list: For each segment, the path of the trimmed audio and (if with_speech is set) of the untrimmed audio.
+    """
     file_extension = os.path.splitext(audio_path)[1]
-    for no, segment in enumerate(segments, start=1):
-        start, end = segment.begin_seconds, segment.end_seconds
+    output_paths = []
+    for no in range(1, segment_count + 1):
         output_path = Path(f'{no:02d}_{extraction_name}{file_extension}')
-        duration = end - start
-        command = create_ffmpeg_split_command(file_extension, audio_path, str(output_path), start, duration)
-        subprocess.call(command, shell=True)
-        audio_trimmer = AudioTrimmer(output_path,
-                                     SpeechFinder.SEGMENT_LENGTH_SEC + 5.0,
-                                     less_silence_beginning = less_silence_beginning,
-                                     less_silence_end = less_silence_end,
-                                     with_backup = True,
-                                     keep_speech_at_end=concert_mode)
-        audio_trimmer.trim()
-        print(f"Exported {str(output_path)} from ~{seconds_to_min_sec(start)} to ~{seconds_to_min_sec(end)} "
-              f"({seconds_to_min_sec(audio_trimmer.trimmed_length)})")
-        if output_path.suffix.lower() == ".mp3":
-            mp3_gain(output_path)
-            mp3_gain(audio_trimmer.audio_path_backup)
-
-
-
-def create_ffmpeg_split_command(file_extension, audio_path, output_path, start, duration):
-    if file_extension.lower() in [".flac", ".wav"]:
-        return f'ffmpeg -loglevel error -i "{audio_path}" -ss {start} -t {duration} "{output_path}"'
+        output_paths.append([output_path, get_backup_path(output_path)] if with_speech else [output_path])
+    return output_paths
+
+
+def split_audio(audio_path, segments, less_silence_beginning, less_silence_end, concert_mode, with_speech=False,
+                overwrite=False):
+    """
+    Export the segments. First the final (trimmed) boundaries of all segments are resolved from the original audio
+    file, then all segments are cut in a single pass, so every output file is written exactly once. Finally, the
+    volume of MP3s is normalized concurrently (see ExportPipeline). If the export of a segment fails, the files
+    written by the export are removed.
+
+    Args:
+        with_speech (bool): If True, the untrimmed segments are exported, too ("_with_speech").
+        overwrite (bool): If True, existing files are overwritten, otherwise the export fails if one exists (see
+            get_output_paths).
+    """
+    pcm_windows = read_trim_windows(audio_path, segments)
+    boundaries = [plan_boundaries(segment, pcm_windows, less_silence_beginning, less_silence_end, concert_mode)
+                  for segment in segments]
+
+    cuts = []
+    jobs = []
+    pipeline = ExportPipeline()
+    for segment, (begin, end), output_paths in zip(segments, boundaries,
+                                                   get_output_paths(audio_path, len(segments), with_speech)):
+        ranges = [(begin, end), (segment.begin_seconds, segment.end_seconds)][:len(output_paths)]
+        # The loudness is measured only in the exported audio: the untrimmed segment contains the trimmed one
+        measured_begin = min(range_begin for range_begin, _ in ranges)
+        measured_end = max(range_end for _, range_end in ranges)
+        block_statistics = measure_block_statistics(Path(audio_path), measured_begin, measured_end - measured_begin)
+        mp3_gain_steps = []
+        for output_path, (range_begin, range_end) in zip(output_paths, ranges):
+            gain, peak = get_gain(block_statistics, range_begin - measured_begin, range_end - measured_begin)
+            if output_path.suffix.lower() == ".mp3":
+                cuts.append((range_begin, range_end, output_path))
+                mp3_gain_steps.append(None if gain is None else get_mp3_gain_steps(gain))
+            else:
+                cuts.append((range_begin, range_end, output_path, {} if gain is None else
+                             get_replay_gain_tags(gain, peak)))
+        jobs.append((output_paths, partial(export_segment, pipeline, segment, output_paths, end - begin,
+                                           mp3_gain_steps)))
+
+    split_audio_ranges(audio_path, cuts, overwrite)
+    pipeline.run(jobs)
+
+
+def export_segment(pipeline, segment, output_paths, trimmed_length, mp3_gain_steps):
+    """
+    Finish the export of one cut segment: apply the (already measured) gain to MP3s. Other formats got ReplayGain
+    tags when they were cut.
+
+    Returns:
+        str: The report of the export.
+    """
+    start, end = segment.begin_seconds, segment.end_seconds
+    report = [f"Exported {str(output_paths[0])} from ~{seconds_to_min_sec(start)} to ~{seconds_to_min_sec(end)} "
+              f"({seconds_to_min_sec(trimmed_length)})"]
+    for output_path, gain_steps in zip(output_paths, mp3_gain_steps):
+        if gain_steps:
+            with pipeline.stage("gain"):
+                report.append(mp3_gain(output_path, gain_steps))
+    return "\n".join(line for line in report if line)
+
+
+def read_trim_windows(audio_path, segments):
+    """
+    Decode the windows at the beginning and end of all segments without precise boundaries at once: the ffmpeg
+    processes run concurrently (see tool_runner) while the VAD model is loaded.
+
+    Returns:
+        dict: The PCM data of the windows by their absolute start and length (in seconds).
+    """
+    windows = [(segment.begin_seconds + window_start, length) for segment in segments
+               if not segment.has_precise_boundaries
+               for window_start, length in get_trim_windows(segment.end_seconds - segment.begin_seconds,
+                                                            SpeechFinder.SEGMENT_LENGTH_SEC + 5.0)]
+    if not windows:
+        return {}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        warm_up = executor.submit(vad_model.warm_up)
+        pcm_windows = dict(zip(windows, read_pcm_windows(audio_path, windows)))
+        warm_up.result()
+    return pcm_windows
+
+
+def plan_boundaries(segment, pcm_windows, less_silence_beginning, less_silence_end, concert_mode):
+    """
+    Resolve the final boundaries of a segment before anything is written: from the word times of the surrounding
+    speech or, if there are none, with the help of the VAD in the windows at the beginning and end of the segment
+    (see read_trim_windows).
+
+    Returns:
+        tuple: Begin and end of the trimmed audio in seconds.
+    """
+    if segment.has_precise_boundaries:
+        return get_precise_boundaries(segment, less_silence_beginning, less_silence_end, concert_mode)
+    start = segment.begin_seconds
+    begin, end = find_trim_points(lambda window_start, length: pcm_windows[(start + window_start, length)],
+                                  segment.end_seconds - start, SpeechFinder.SEGMENT_LENGTH_SEC + 5.0,
+                                  less_silence_beginning, less_silence_end, keep_speech_at_end=concert_mode)
+    return start + begin, start + end
+
+
+def get_precise_boundaries(segment, less_silence_beginning, less_silence_end, concert_mode):
+    """
+    Get the boundaries of the music from the word times of the surrounding speech, so no VAD pass is needed.
+
+    Returns:
+        tuple: Begin and end of the trimmed audio in seconds.
+    """
+    begin = min(segment.music_begin_seconds + less_silence_beginning, segment.end_seconds)
+    if concert_mode:
+        end = min(segment.music_end_seconds + less_silence_end, segment.end_seconds)
     else:
-        return f'ffmpeg -loglevel error -ss {start} -i "{audio_path}" -t {duration} -c copy "{output_path}"'
+        end = max(segment.music_end_seconds - less_silence_end, begin)
+    return begin, end
 
 
 def get_user_combined_segments(segments):
@@ -117,6 +225,43 @@ def init_argument_parser() -> Namespace:
     parser.add_argument('-c', '--concert', action='store_true',
                         help='If set, the extracted parts contain music and all the speech that follows it')
 
+    parser.add_argument('-g', '--pre_gate', action='store_true',
+                        help='If set, segments that are certainly music are not analysed by the speech recognition')
+    parser.add_argument('--pre_gate_report', action='store_true',
+                        help='If set, all segments are analysed by the speech recognition and the skip rate and '
+                             'skip precision of the pre-gate (see -g) are reported')
+
+    parser.add_argument('-v', '--vad_first', action='store_true',
+                        help='If set, the VAD is run over the whole audio file first and only the segments with '
+                             'speech are analysed by the speech recognition')
+    parser.add_argument('-H', '--hierarchical', action='store_true',
+                        help='If set, the audio file is analysed from coarse to fine, so only the segments around '
+                             'the transitions between music and speech are analysed by the speech recognition')
+    parser.add_argument('-L', '--large_model', action='store_true',
+                        help='If set, the speech next to music is transcribed again by a large Vosk model')
+    parser.add_argument('--large_model_name', metavar='MODEL',
+                        help=f'Name of the large Vosk model of -L (default: {DEFAULT_LARGE_MODEL_NAME})')
+
+    parser.add_argument('--checkpoint_interval', type=int, default=3,
+                        help='Number of analysed segments after which the analysis is checkpointed, so that it can '
+                             'be continued after a crash')
+    parser.add_argument('--no_fsync', action='store_true',
+                        help='If set, checkpoints are only flushed to the operating system, not synced to the disk')
+
+    parser.add_argument('--no_cache', action='store_true',
+                        help='If set, the analysis cache (~/.cache/music-extraction) is neither used nor updated')
+
+    parser.add_argument('--stats', action='store_true',
+                        help='If set, the time spent in the stages (decoding, speech recognition, VAD, cutting, gain),'
+                             ' the real-time factor of the analysis and the slowest segments are printed at the end')
+
+    parser.add_argument('--stats_file', metavar='FILE',
+                        help='If set, the statistics of --stats are written as JSON into this file instead')
+
+    parser.add_argument('-w', '--with_speech', action='store_true',
+                        help='If set, the untrimmed segments (with the speech at the beginning and end) are '
+                             'exported, too ("_with_speech")')
+
     parser.add_argument('-b', '--less_silence_beginning', type=float,
                         default=DEFAULT_LESS_SILENCE_SECONDS,
                         help='Less silence at the beginning of the trimmed audio file in seconds')
@@ -161,9 +306,34 @@ def main():
         print("The value for -e/--less_silence_end must not be negative.")
         sys.exit(1)
 
-    lines, total_length = SpeechFinder(audio_path, args.silent).find_segments()
+    if args.checkpoint_interval < 1:
+        print("The value for --checkpoint_interval must be at least 1.")
+        sys.exit(1)
+
+    with_stats = args.stats or args.stats_file
+    if with_stats:
+        instrumentation.enable()
+    try:
+        analyse_and_extract(args, audio_path, less_silence_beginning, less_silence_end)
+    finally:
+        if with_stats:
+            instrumentation.report(args.stats_file)
+            instrumentation.disable()
+
+
+def analyse_and_extract(args, audio_path, less_silence_beginning, less_silence_end):
+    analysis_cache = None if args.no_cache else AnalysisCache()
+    large_model_name = (args.large_model_name or DEFAULT_LARGE_MODEL_NAME) if args.large_model else None
+    speech_finder = SpeechFinder(audio_path, args.silent, args.pre_gate, args.pre_gate_report, args.vad_first,
+                                 args.checkpoint_interval, not args.no_fsync, analysis_cache, args.hierarchical,
+                                 large_model_name)
+    lines, total_length = speech_finder.find_segments()
 
     if not args.analyse:
+        if speech_finder.is_unfinished_hierarchical_analysis():
+            print("The coarse-to-fine analysis is unfinished, so no music segments can be extracted yet. "
+                  "Run the script again with -H to continue it.")
+            sys.exit(1)
         if args.concert:
             segments = find_music_speech_segments(lines, total_length)
         else:
@@ -176,7 +346,22 @@ def main():
                 break
         global extraction_name
         extraction_name = get_user_input_extraction_name()
-        split_audio(audio_path, combined_segments, less_silence_beginning, less_silence_end, args.concert)
+        existing_paths = [output_path for output_paths in get_output_paths(audio_path, len(combined_segments),
+                                                                           args.with_speech)
+                          for output_path in output_paths if output_path.exists()]
+        if existing_paths:
+            print("These files exist already:")
+            for output_path in existing_paths:
+                print(output_path)
+            if not get_user_confirmation("Overwrite them?"):
+                print("Export cancelled.")
+                sys.exit(1)
+        try:
+            split_audio(audio_path, combined_segments, less_silence_beginning, less_silence_end, args.concert,
+                        args.with_speech, overwrite=bool(existing_paths))
+        except RuntimeError as e:
+            print(f"Export failed, the files written by the export were removed: {e}")
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,51 +1,236 @@
 # music_extraction_fast.py
+import argparse
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import audio_tools
 import sys
-import subprocess
 import tempfile
+from analysis_cache import AnalysisCache
+from audio_segment_analyser import AudioSegmentAnalyser
+from batch_scheduler import collect_audio_files, analyse_shards_on_demand
+from seconds_formatter import seconds_to_min_sec
+from speech_file import (read_header, load_lines, write_atomically, SpeechFileHeader, SpeechFileWriter,
+                         STATE_COMPLETE, MODE_LINEAR)
+from speech_files_merger import IncrementalMerger
+from speech_finder import SpeechFinder
+from speech_worker_pool import SpeechWorkerPool
 
-if len(sys.argv) < 2:
-    print("Missing argument: <audio file>")
-    exit(1)
+# Length of the shards (in seconds) the audio files are split into, a multiple of the segment length, so no
+# segment is split between two shards
+EXTRACTION_LENGTH = 15 * SpeechFinder.SEGMENT_LENGTH_SEC
 
-audio_file = Path(sys.argv[1])
-if not audio_file.exists():
-    print(f"File \"{audio_file}\" does not exist.")
-    exit(1)
+# Number of audio files that are decoded (prepared) at once
+CONCURRENT_PREPARATIONS = 4
 
-output_speech_file = audio_file.with_suffix('.speech')
-if output_speech_file.exists():
-    print(f"Output speech file '{output_speech_file.name}' already exists.")
-    exit(0)
+# Number of shards per worker process that are handed to the pool at once (so no worker waits for the next shard)
+SHARDS_IN_FLIGHT_PER_PROCESS = 2
 
-with tempfile.TemporaryDirectory() as tmpdir:
-    print(f"Use working directory {tmpdir}")
-    print("Copy and then split audio file for analysis...")
 
-    wav_file = audio_tools.create_analysable_audio(tmpdir, audio_file)
-    total_length = audio_tools.get_total_length_of_audio(wav_file)
-    extraction_length = 300
+class FileAnalysis:
+    """
+    Sharded analysis of one audio file that writes its .speech file.
+    """
 
-    for start in range(0, int(total_length), extraction_length):
-        end = min(start + extraction_length * 1.0, total_length)
-        audio_tools.split_audio(wav_file, start, end, f"{tmpdir}/{start:06d}", ".wav")
+    def __init__(self, audio_file: Path, work_dir: Path, analysis_cache=None, fsync=True):
+        """
+        Args:
+            audio_file (Path): Path to the audio file.
+            work_dir (Path): Directory (of this file only) for the analysable audio.
+            analysis_cache (AnalysisCache, optional): Cache of complete analyses.
+            fsync (bool): If True, every checkpoint is synced to the disk.
+        """
+        self.audio_file = audio_file
+        self.speech_file = audio_file.with_suffix('.speech')
+        self.shards = []
+        self._work_dir = work_dir
+        self._analysis_cache = analysis_cache
+        self._fsync = fsync
+        self._fingerprint = None
+        self._source_fingerprint = None
+        self._pcm_fingerprint = None
+        self._total_length = None
+        self._wav_file = None
+        self._resume_time = 0
+        self._analysis_file = None
+        self._merger = None
 
-    wav_file.unlink()
+    def prepare(self) -> bool:
+        """
+        Check whether the file must be analysed and, if so, decode it and divide it into shards (offset, path of
+        the analysable audio, length).
+
+        Returns:
+            bool: True if shards must be analysed.
+        """
+        self._fingerprint = audio_tools.get_file_fingerprint(self.audio_file)
+        if self._analysis_cache:
+            self._source_fingerprint = audio_tools.get_source_fingerprint(self.audio_file)
+        if self.speech_file.exists():
+            header = read_header(self.speech_file)
+            if (header is None or header.state == STATE_COMPLETE or header.fingerprint != self._fingerprint or
+                    header.segment_length != SpeechFinder.SEGMENT_LENGTH_SEC or header.mode != MODE_LINEAR):
+                print(f"{self.audio_file.name}: output speech file '{self.speech_file.name}' already exists.")
+                return False
+            self._resume_time = header.resume_time
+            print(f"{self.audio_file.name}: continuing the analysis at {seconds_to_min_sec(self._resume_time)}")
+
+        if not self._resume_time and self._write_cached_analysis(self._lookup_source()):
+            return False
+
+        self._work_dir.mkdir(parents=True, exist_ok=True)
+        wav_file = audio_tools.create_analysable_audio(str(self._work_dir), self.audio_file)
+        self._total_length = audio_tools.get_total_length_of_audio(wav_file)
+        if self._analysis_cache:
+            self._pcm_fingerprint = audio_tools.get_pcm_fingerprint(wav_file)
+            if not self._resume_time and self._write_cached_analysis(self._analysis_cache.lookup(
+                    self._pcm_fingerprint, AudioSegmentAnalyser.MODEL_NAME, SpeechFinder.SEGMENT_LENGTH_SEC,
+                    self._source_fingerprint)):
+                wav_file.unlink()
+                return False
+
+        self._wav_file = wav_file
+        for start in range(self._resume_time, math.ceil(self._total_length), EXTRACTION_LENGTH):
+            end = min(start + EXTRACTION_LENGTH * 1.0, self._total_length)
+            self.shards.append((start, wav_file, end - start))
+        return True
+
+    def open(self):
+        """
+        Open the .speech file (continue it if the analysis was interrupted).
+        """
+        if self._resume_time:
+            self._analysis_file = SpeechFileWriter.append_to(self.speech_file)
+        else:
+            header = SpeechFileHeader(SpeechFinder.SEGMENT_LENGTH_SEC, self._total_length, self._fingerprint)
+            self._analysis_file = SpeechFileWriter(self.speech_file, header)
+        self._merger = IncrementalMerger(self._analysis_file, [offset for offset, _, _ in self.shards], self._fsync)
+        if not self.shards:
+            self._finish()
+
+    def add(self, offset, speech_segments):
+        """
+        Add the analysis result of a shard. The .speech file is completed with the last shard.
+        """
+        self._merger.add(offset, SpeechFinder.SEGMENT_LENGTH_SEC, speech_segments)
+        self.shards = [shard for shard in self.shards if shard[0] != offset]
+        if not self.shards:
+            self._finish()
+
+    def close(self):
+        """
+        Close the .speech file (an unfinished analysis can be continued later).
+        """
+        if self._analysis_file:
+            self._analysis_file.close()
+            self._analysis_file = None
+
+    def _finish(self):
+        self.close()
+        if self._wav_file:
+            self._wav_file.unlink(missing_ok=True)
+        if self._pcm_fingerprint:
+            self._analysis_cache.store(self._pcm_fingerprint, AudioSegmentAnalyser.MODEL_NAME,
+                                       SpeechFinder.SEGMENT_LENGTH_SEC, load_lines(self.speech_file)[1:-1],
+                                       self._source_fingerprint)
+        print(f"Finished analysis of {self.audio_file.name}")
+
+    def _lookup_source(self):
+        if not self._analysis_cache:
+            return None
+        return self._analysis_cache.lookup_source(self._source_fingerprint, AudioSegmentAnalyser.MODEL_NAME,
+                                                  SpeechFinder.SEGMENT_LENGTH_SEC)
+
+    def _write_cached_analysis(self, lines) -> bool:
+        if lines is None:
+            return False
+        print(f"{self.audio_file.name}: analysis found in cache")
+        total_length = self._total_length or audio_tools.get_total_length_of_audio(self.audio_file)
+        header = SpeechFileHeader(SpeechFinder.SEGMENT_LENGTH_SEC, total_length, self._fingerprint, STATE_COMPLETE,
+                                  math.ceil(total_length))
+        write_atomically(self.speech_file, header, lines)
+        return True
+
+
+def prepare_files(audio_files, work_dir: Path, analysis_cache=None, fsync=True):
+    """
+    Prepare the analyses of the given audio files, CONCURRENT_PREPARATIONS files at once (the decoding runs in
+    ffmpeg processes).
+
+    Yields:
+        tuple: The index of the audio file and its FileAnalysis, for every file that must be analysed, as soon as
+            it is prepared.
+    """
+    with ThreadPoolExecutor(CONCURRENT_PREPARATIONS) as executor:
+        futures = {}
+        for index, audio_file in enumerate(audio_files):
+            analysis = FileAnalysis(audio_file, work_dir / f"{index:04d}", analysis_cache, fsync)
+            futures[executor.submit(analysis.prepare)] = index, analysis
+        for future in as_completed(futures):
+            index, analysis = futures[future]
+            try:
+                if future.result():
+                    yield index, analysis
+            except RuntimeError as e:
+                logging.error(f"Skipping {analysis.audio_file}: {e}")
+
+
+def analyse_files(audio_files, work_dir: Path, pool, analysis_cache=None, fsync=True):
+    """
+    Analyse the given audio files with the shards of all files scheduled on one worker pool. The files are
+    prepared concurrently and the shards of a file are scheduled as soon as the file is prepared, so the workers
+    start while the other files are still decoded. The shards are handed to the pool on demand, the file with the
+    least remaining work first (see batch_scheduler.ShardScheduler).
+
+    Args:
+        audio_files (iterable): Paths of the audio files.
+        work_dir (Path): Temporary directory for the analysable audio.
+        pool (SpeechWorkerPool): The worker pool.
+        analysis_cache (AnalysisCache, optional): Cache of complete analyses.
+        fsync (bool): If True, every checkpoint is synced to the disk.
+    """
+    analyses = {}
+
+    def get_files():
+        # Runs in a background thread, the results of a file's shards only arrive after it was opened
+        for index, analysis in prepare_files(audio_files, work_dir, analysis_cache, fsync):
+            print(f"Audio analysis of {analysis.audio_file.name}...")
+            analyses[index] = analysis
+            analysis.open()
+            yield index, list(analysis.shards)
 
-    print("Audio analysis...")
-    venv_python = Path(__file__).parent / '.venv' / 'bin' / 'python3'
-    main_py_path = Path(__file__).parent / '__main__.py'
-    merge_script = Path(__file__).parent / 'merge_speech_files.sh'
     try:
-        subprocess.run(
-            f'find . -maxdepth 1 -type f -iname "*.wav" -print0 | xargs -0 -n 1 -P $(nproc) -- "{venv_python}" "{main_py_path}" -a -s',
-            shell=True, check=True, cwd=tmpdir
-        )
-        subprocess.run(
-            f'"{merge_script}" "{output_speech_file.resolve()}"',
-            shell=True, check=True, cwd=tmpdir
-        )
-    except subprocess.CalledProcessError as e:
-        print(f"An error occurred while executing commands: {e}")
-        exit(1)
\ No newline at end of file
+        for index, offset, speech_segments in analyse_shards_on_demand(
+                get_files(), pool.analyse_shard, SHARDS_IN_FLIGHT_PER_PROCESS * pool.processes):
+            analyses[index].add(offset, speech_segments)
+    finally:
+        for analysis in list(analyses.values()):
+            analysis.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse audio files in parallel (creates the .speech files only)')
+    parser.add_argument('audio_files', nargs='+', help='Audio files, directories or glob patterns')
+    parser.add_argument('-p', '--processes', type=int, help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='If set, the analysis cache (~/.cache/music-extraction) is neither used nor updated')
+    parser.add_argument('--no_fsync', action='store_true',
+                        help='If set, checkpoints are only flushed to the operating system, not synced to the disk')
+    args = parser.parse_args()
+
+    audio_files = collect_audio_files(args.audio_files)
+    if not audio_files:
+        print(f"No audio files found in {', '.join(args.audio_files)}.")
+        sys.exit(1)
+
+    analysis_cache = None if args.no_cache else AnalysisCache()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"Use working directory {tmpdir}")
+        print("Decode and analyse audio files...")
+        with SpeechWorkerPool(args.processes) as pool:
+            analyse_files(audio_files, Path(tmpdir), pool, analysis_cache, not args.no_fsync)
+
+
+if __name__ == "__main__":
+    main()
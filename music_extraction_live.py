@@ -0,0 +1,62 @@
+# music_extraction_live.py
+import argparse
+import stat
+import os
+import sys
+from pathlib import Path
+from live_speech_finder import LiveSpeechFinder, follow_audio_file, wait_for_audio_file, DEFAULT_IDLE_TIMEOUT
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse a recording while it is being captured '
+                                                 '(creates the .speech file only)')
+    parser.add_argument('source', help='The growing audio file, a FIFO or "-" (stdin) with raw 16 kHz mono '
+                                       '16-bit PCM data')
+    parser.add_argument('-o', '--output', help='The .speech file (default: the audio file with suffix .speech, '
+                                               'required for a FIFO or stdin)')
+    parser.add_argument('--idle_timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help='The recording is finished if the audio file did not grow for this number of seconds')
+    parser.add_argument('-s', '--silent', action='store_true',
+                        help='If set, only the music segments are printed')
+    parser.add_argument('--no_fsync', action='store_true',
+                        help='If set, checkpoints are only flushed to the operating system, not synced to the disk')
+    args = parser.parse_args()
+
+    try:
+        is_pcm_stream = args.source == "-" or stat.S_ISFIFO(os.stat(args.source).st_mode)
+    except FileNotFoundError:
+        # The recording has not been started yet
+        is_pcm_stream = False
+    if is_pcm_stream and not args.output:
+        print("The output .speech file (-o) must be given for a FIFO or stdin.")
+        sys.exit(1)
+    speech_path = Path(args.output) if args.output else Path(args.source).with_suffix('.speech')
+
+    def print_music_segment(music_segment):
+        print(f"\nMusic segment:\n{music_segment}\n", flush=True)
+
+    finder = LiveSpeechFinder(speech_path, print_music_segment, args.silent, not args.no_fsync)
+    try:
+        start_time = finder.get_resume_time()
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+
+    if args.source == "-":
+        finder.analyse(sys.stdin.buffer, start_time)
+    elif is_pcm_stream:
+        with open(args.source, "rb") as fifo:
+            finder.analyse(fifo, start_time)
+    else:
+        try:
+            wait_for_audio_file(Path(args.source), args.idle_timeout)
+            with follow_audio_file(Path(args.source), start_time, args.idle_timeout) as ffmpeg:
+                finder.analyse(ffmpeg.stdout, start_time, fingerprint_source=Path(args.source), process=ffmpeg,
+                               idle_timeout=args.idle_timeout)
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
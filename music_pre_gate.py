@@ -0,0 +1,141 @@
+import numpy as np
+
+"""
+Cheap spectral pre-classification of analysable audio segments (mono, 16-bit, 16 kHz).
+
+Segments that are "certainly music" do not need to be transcribed by Vosk. The decision is deliberately
+conservative: a segment is only classified as music if all features agree, everything else is left to the
+speech recognition.
+"""
+
+SAMPLE_RATE = 16000
+FRAME_LENGTH = 512  # 32 ms
+MIN_FRAMES = 64  # ~2 seconds
+
+# Frames below this mean square value are treated as silence
+SILENCE_ENERGY = 1e-6
+
+# Speech: syllable rate of ~4 Hz modulates the energy envelope (modulation depth ~0.5 and more), many short pauses,
+# alternating voiced/unvoiced sounds. Music: steady envelope (depth below ~0.1, strongly rhythmic music more),
+# sustained tones. Chords have no single pitch, so their harmonicity is lower than that of a single tone.
+MAX_MODULATION_4HZ = 0.3
+MAX_LOW_ENERGY_RATIO = 0.15
+MAX_ZCR_VARIATION = 0.6
+MAX_SPECTRAL_FLATNESS = 0.2
+MIN_HARMONICITY = 0.4
+
+# Lags of the autocorrelation that are searched for a pitch (500 Hz down to 62.5 Hz)
+MIN_PITCH_LAG = SAMPLE_RATE // 500
+MAX_PITCH_LAG = SAMPLE_RATE // 62
+
+
+def get_features(pcm: bytes):
+    """
+    Compute the features of an audio segment that are used for the music/speech decision.
+
+    Args:
+        pcm (bytes): Mono 16-bit PCM data with a sample rate of 16 kHz.
+
+    Returns:
+        dict: The features, or None if the segment is too short or silent.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    frame_count = len(samples) // FRAME_LENGTH
+    if frame_count < MIN_FRAMES:
+        return None
+    frames = samples[:frame_count * FRAME_LENGTH].reshape(frame_count, FRAME_LENGTH)
+
+    energy = np.mean(frames ** 2, axis=1)
+    active = energy > SILENCE_ENERGY
+    if np.count_nonzero(active) < MIN_FRAMES // 2:
+        return None
+
+    # Modulation depth of the envelope from 3 to 6 Hz: RMS amplitude of the modulation relative to the mean of
+    # the envelope (a steady envelope has a depth close to 0, whatever its noise)
+    envelope = np.sqrt(energy)
+    modulation = np.abs(np.fft.rfft(envelope - envelope.mean())) ** 2
+    modulation_frequencies = np.fft.rfftfreq(frame_count, d=FRAME_LENGTH / SAMPLE_RATE)
+    syllable_band = (modulation_frequencies >= 3.0) & (modulation_frequencies <= 6.0)
+    modulation_4hz = np.sqrt(2 * modulation[syllable_band].sum()) / frame_count / (envelope.mean() + 1e-12)
+
+    low_energy_ratio = np.mean(energy < 0.1 * energy.mean())
+
+    zero_crossing_rate = np.mean(np.diff(np.signbit(frames[active]), axis=1), axis=1)
+    zcr_variation = zero_crossing_rate.std() / (zero_crossing_rate.mean() + 1e-12)
+
+    window = np.hanning(FRAME_LENGTH)
+    spectrum = np.fft.rfft(frames[active] * window, n=2 * FRAME_LENGTH)
+    power = np.abs(spectrum) ** 2 + 1e-12
+    spectral_flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+    # Autocorrelation (via the power spectrum), corrected by the autocorrelation of the window
+    autocorrelation = np.fft.irfft(power, axis=1)
+    window_autocorrelation = np.fft.irfft(np.abs(np.fft.rfft(window, n=2 * FRAME_LENGTH)) ** 2)
+    normalised = ((autocorrelation[:, MIN_PITCH_LAG:MAX_PITCH_LAG] / autocorrelation[:, :1]) /
+                  (window_autocorrelation[MIN_PITCH_LAG:MAX_PITCH_LAG] / window_autocorrelation[0]))
+    harmonicity = normalised.max(axis=1)
+
+    return {
+        "modulation_4hz": float(modulation_4hz),
+        "low_energy_ratio": float(low_energy_ratio),
+        "zcr_variation": float(zcr_variation),
+        "spectral_flatness": float(np.median(spectral_flatness)),
+        "harmonicity": float(np.median(harmonicity)),
+    }
+
+
+def is_certainly_music(pcm: bytes) -> bool:
+    """
+    Check whether an audio segment certainly contains music only, so it can skip the speech recognition.
+
+    Args:
+        pcm (bytes): Mono 16-bit PCM data with a sample rate of 16 kHz.
+
+    Returns:
+        bool: True if the segment is certainly music, False if it may contain speech.
+    """
+    features = get_features(pcm)
+    if features is None:
+        return False
+    return (features["modulation_4hz"] < MAX_MODULATION_4HZ and
+            features["low_energy_ratio"] < MAX_LOW_ENERGY_RATIO and
+            features["zcr_variation"] < MAX_ZCR_VARIATION and
+            features["spectral_flatness"] < MAX_SPECTRAL_FLATNESS and
+            features["harmonicity"] > MIN_HARMONICITY)
+
+
+class PreGateStatistics:
+    """
+    Counts how many segments were skipped by the pre-gate and, if the speech recognition was run for every
+    segment anyway, how many of the skipped segments contained speech (errors of the pre-gate). The pre-gate is
+    conservative: a segment that is not skipped may be music as well, so only the skipped segments are judged.
+    """
+
+    def __init__(self):
+        self.segment_count = 0
+        self.skipped_count = 0
+        self.checked_skipped_count = 0
+        self.skipped_with_speech_count = 0
+
+    def add(self, skipped: bool, speech_found=None):
+        """
+        Args:
+            skipped (bool): True if the pre-gate classified the segment as music.
+            speech_found (bool, optional): Result of the speech recognition for the segment, if it was run.
+        """
+        self.segment_count += 1
+        if skipped:
+            self.skipped_count += 1
+        if skipped and speech_found is not None:
+            self.checked_skipped_count += 1
+            if speech_found:
+                self.skipped_with_speech_count += 1
+
+    def __repr__(self):
+        skip_rate = self.skipped_count / self.segment_count if self.segment_count else 0.0
+        report = f"Pre-gate skipped {self.skipped_count} of {self.segment_count} segments ({skip_rate:.1%})"
+        if self.checked_skipped_count:
+            precision = 1 - self.skipped_with_speech_count / self.checked_skipped_count
+            report += (f"\nSkip precision: {precision:.1%} of the skipped segments contained no speech "
+                       f"({self.skipped_with_speech_count} skipped segments contained speech)")
+        return report
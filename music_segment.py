@@ -3,11 +3,27 @@ from seconds_formatter import seconds_to_min_sec
 
 
 class MusicSegment:
-    def __init__(self, begin_seconds: int, speech_before: str, end_seconds: float, speech_after: str):
+    """
+    A music segment from the beginning of the speech segment before the music to the end of the speech segment
+    after the music.
+
+    If the word times of the surrounding speech are known, music_begin_seconds (end of the last word before the
+    music) and music_end_seconds (begin of the first word after the music) give the precise boundaries of the
+    music. Otherwise they are None.
+    """
+
+    def __init__(self, begin_seconds: int, speech_before: str, end_seconds: float, speech_after: str,
+                 music_begin_seconds=None, music_end_seconds=None):
         self.begin_seconds = begin_seconds
         self.speech_before = speech_before
         self.end_seconds = end_seconds
         self.speech_after = speech_after
+        self.music_begin_seconds = music_begin_seconds
+        self.music_end_seconds = music_end_seconds
+
+    @property
+    def has_precise_boundaries(self):
+        return self.music_begin_seconds is not None and self.music_end_seconds is not None
 
     def __repr__(self):
         duration = self.end_seconds - self.begin_seconds
@@ -19,4 +35,12 @@ class MusicSegment:
         return (self.begin_seconds == other.begin_seconds and
                 self.speech_before == other.speech_before and
                 isclose(self.end_seconds, other.end_seconds, abs_tol=0.01) and
-                self.speech_after == other.speech_after)
+                self.speech_after == other.speech_after and
+                _is_close_or_none(self.music_begin_seconds, other.music_begin_seconds) and
+                _is_close_or_none(self.music_end_seconds, other.music_end_seconds))
+
+
+def _is_close_or_none(seconds, other_seconds):
+    if seconds is None or other_seconds is None:
+        return seconds is None and other_seconds is None
+    return isclose(seconds, other_seconds, abs_tol=0.01)
@@ -1,12 +1,16 @@
 from music_segment import MusicSegment
+from speech_file import parse_word_times, strip_word_times
 
 
 def find(lines: list, total_length: float):
     segment_length_sec = int(lines[0])
+    # Precise boundaries are only known for analyses with word times (the begin and end of the audio, too)
+    with_word_times = any(parse_word_times(line) for line in lines[1:])
 
     last_speech_begin = 0
     last_speech_end = 0
     last_speech = "..."
+    last_word_end = 0.0 if with_word_times else None
 
     segments = []
     for line in lines[1:]:
@@ -16,22 +20,28 @@ def find(lines: list, total_length: float):
             break
 
         speech_begin = int(first_word)
+        word_times = parse_word_times(line)
         if speech_begin > last_speech_end:
-            segments.append(MusicSegment(last_speech_begin, last_speech, speech_begin + segment_length_sec, speech))
+            first_word_begin = word_times[0][0] if word_times else None
+            segments.append(MusicSegment(last_speech_begin, last_speech, speech_begin + segment_length_sec, speech,
+                                         last_word_end, first_word_begin))
 
         last_speech_begin = speech_begin
         last_speech_end = speech_begin + segment_length_sec
         last_speech = speech
+        last_word_end = word_times[-1][1] if word_times else None
 
     speech_begin = total_length
     speech = "..."
     if speech_begin > last_speech_end:
-        segments.append(MusicSegment(last_speech_begin, last_speech, speech_begin, speech))
+        segments.append(MusicSegment(last_speech_begin, last_speech, speech_begin, speech,
+                                     last_word_end, total_length if with_word_times else None))
 
     return segments
 
 
 def fetch_first_word_and_speech(line: str):
+    line = strip_word_times(line)
     first_word = line.split(" ")[0]
     speech = line[len(first_word) + 1:]
     return first_word, speech
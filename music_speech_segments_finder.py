@@ -15,7 +15,9 @@ def find(lines: list, total_length: float):
 
     if last_segment:
         if last_segment.end_seconds < total_length:
-            segments.append(MusicSegment(last_segment.begin_seconds, last_segment.speech_before, total_length, "..."))
+            segments.append(MusicSegment(last_segment.begin_seconds, last_segment.speech_before, total_length, "...",
+                                         last_segment.music_begin_seconds,
+                                         total_length if last_segment.music_begin_seconds is not None else None))
         else:
             segments.append(last_segment)
 
@@ -23,5 +25,7 @@ def find(lines: list, total_length: float):
 
 
 def create_music_speech_segment(music_segment: MusicSegment, next_music_segment: MusicSegment, segment_length_sec: int) -> MusicSegment:
-    return MusicSegment(music_segment.begin_seconds, music_segment.speech_before, next_music_segment.begin_seconds + segment_length_sec, next_music_segment.speech_before)
+    # The speech after the music ends where the next music begins
+    return MusicSegment(music_segment.begin_seconds, music_segment.speech_before, next_music_segment.begin_seconds + segment_length_sec, next_music_segment.speech_before,
+                        music_segment.music_begin_seconds, next_music_segment.music_begin_seconds)
 
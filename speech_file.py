@@ -0,0 +1,321 @@
+import fcntl
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+"""
+Format of the analysis (.speech) files.
+
+Version 2 starts with a header line of fixed size (HEADER_SIZE bytes in new files) that holds the segment length,
+the duration and a fingerprint of the analysed audio, the state of the analysis, the time to resume it from and the
+size of the file at the last checkpoint, e.g. "#speech-v2 segment=20 duration=6962.233 fingerprint=...
+state=interrupted resume=1160 size=2843". The header is updated in place, so checking the state of an analysis
+only needs to read the header, and the body (the speech lines) is append-only.
+
+An unfinished coarse-to-fine analysis (see hierarchical_analysis.py) is marked by "mode=hierarchical" in the
+header. Its body holds the transcribed segments in the order they were transcribed, segments without speech as
+a line with the start time only. When the analysis is complete, the file is rewritten with the speech lines in
+order.
+
+Version 1 (still readable) starts with a line with the segment length. The last line is "end" for a complete
+analysis or the time to resume an interrupted analysis from.
+
+A speech line consists of the start time of the segment in seconds and the recognized speech, optionally
+followed by a tab and the start and end times of the recognized words in seconds (e.g. "20 hello world\t21.30-21.62
+21.70-22.05"). Lines without word times (older analyses) are still valid.
+"""
+
+WORD_TIMES_SEPARATOR = "\t"
+
+# Length of the analysed segments in seconds
+SEGMENT_LENGTH_SEC = 20
+
+HEADER_SIZE = 256
+HEADER_MAGIC = "#speech-v2"
+
+STATE_RUNNING = "running"
+STATE_INTERRUPTED = "interrupted"
+STATE_COMPLETE = "complete"
+
+MODE_LINEAR = "linear"
+MODE_HIERARCHICAL = "hierarchical"
+
+
+class SpeechFileHeader:
+    """
+    Header of a version 2 analysis file.
+    """
+
+    def __init__(self, segment_length: int, duration: float, fingerprint: str, state=STATE_RUNNING,
+                 resume_time=0, checkpoint_size=None, header_size=HEADER_SIZE, mode=MODE_LINEAR):
+        self.segment_length = segment_length
+        self.duration = duration
+        self.fingerprint = fingerprint
+        self.state = state
+        self.resume_time = resume_time
+        # Size of the file at the last checkpoint (None if unknown)
+        self.checkpoint_size = checkpoint_size
+        self.header_size = header_size
+        # Order in which the segments are analysed (MODE_LINEAR or MODE_HIERARCHICAL)
+        self.mode = mode
+
+    def to_bytes(self) -> bytes:
+        header = (f"{HEADER_MAGIC} segment={self.segment_length} duration={self.duration:.3f} "
+                  f"fingerprint={self.fingerprint} state={self.state} resume={self.resume_time}")
+        if self.checkpoint_size is not None:
+            header += f" size={self.checkpoint_size}"
+        if self.mode != MODE_LINEAR:
+            header += f" mode={self.mode}"
+        if len(header) >= self.header_size:
+            raise ValueError(f"Header is longer than {self.header_size - 1} characters: {header}")
+        return (header.ljust(self.header_size - 1) + "\n").encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        Returns:
+            SpeechFileHeader: The parsed header, or None if the data is no version 2 header.
+        """
+        header_end = data.find(b"\n")
+        if not data.startswith(HEADER_MAGIC.encode()) or header_end < 0:
+            return None
+        try:
+            fields = dict(field.split("=", 1) for field in data[:header_end].decode().split()[1:])
+            return cls(int(fields["segment"]), float(fields["duration"]), fields["fingerprint"],
+                       fields["state"], int(fields["resume"]),
+                       int(fields["size"]) if "size" in fields else None, header_end + 1,
+                       fields.get("mode", MODE_LINEAR))
+        except (UnicodeDecodeError, KeyError, ValueError):
+            return None
+
+
+def read_header(path):
+    """
+    Read the header of an analysis file (without reading its body).
+
+    Returns:
+        SpeechFileHeader: The header, or None if the file is no version 2 analysis file.
+    """
+    with open(path, "rb") as file:
+        return SpeechFileHeader.from_bytes(file.read(HEADER_SIZE))
+
+
+def load_lines(path):
+    """
+    Load the non-empty lines of an analysis file of any version in the format of version 1, i.e. the segment
+    length, the speech lines and finally "end" or the time to resume the analysis from.
+    """
+    with open(path, "rb") as file:
+        header = SpeechFileHeader.from_bytes(file.read(HEADER_SIZE))
+        file.seek(header.header_size if header else 0)
+        body = file.read().decode()
+
+    lines = [line.strip() for line in body.splitlines() if line.strip()]
+    if header is None:
+        return lines
+    last_line = "end" if header.state == STATE_COMPLETE else str(header.resume_time)
+    return [str(header.segment_length)] + lines + [last_line]
+
+
+class SpeechFileWriter:
+    """
+    Writes a version 2 analysis file: the body is appended line by line, the header is updated in place.
+
+    The file is locked while it is written, so no second process can write the same analysis.
+    """
+
+    def __init__(self, path, header: SpeechFileHeader, append=False):
+        """
+        Args:
+            path: Path to the analysis file.
+            header (SpeechFileHeader): Header of the file.
+            append (bool): If True, the lines are appended to the existing file, otherwise a new file is created.
+                If the analysis was not finished properly (state "running"), everything after the last
+                checkpoint is discarded.
+        """
+        self._header = header
+        self._file = os.fdopen(os.open(path, os.O_RDWR if append else os.O_RDWR | os.O_CREAT), "r+b")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            raise RuntimeError(f"{path} is being written by another process")
+        if not append:
+            self._file.truncate(0)
+            self._header.checkpoint_size = self._header.header_size
+        elif header.state == STATE_RUNNING and header.checkpoint_size is not None:
+            self._file.truncate(header.checkpoint_size)
+        self._write_header()
+        self._file.seek(0, os.SEEK_END)
+
+    @classmethod
+    def append_to(cls, path):
+        """
+        Open an existing version 2 analysis file for appending.
+        """
+        header = read_header(path)
+        if header is None:
+            raise ValueError(f"{path} is no version 2 analysis file")
+        return cls(path, header, append=True)
+
+    @classmethod
+    def continue_analysis(cls, path, duration: float, fingerprint: str):
+        """
+        Open the analysis file of an interrupted analysis for appending. An analysis file of version 1 is
+        converted to version 2 first.
+
+        Args:
+            duration (float): Length of the audio in seconds (for the header of a converted file).
+            fingerprint (str): Fingerprint of the audio file (for the header of a converted file).
+        """
+        if read_header(path) is not None:
+            return cls.append_to(path)
+
+        lines = load_lines(path)
+        analysis_file = cls(path, SpeechFileHeader(int(lines[0]), duration, fingerprint, STATE_INTERRUPTED,
+                                                   int(lines[-1])))
+        for line in lines[1:-1]:
+            analysis_file.append(line)
+        return analysis_file
+
+    @property
+    def header(self):
+        return self._header
+
+    def append(self, line: str):
+        self._file.write((line + "\n").encode())
+
+    def checkpoint(self, resume_time, fsync=True):
+        """
+        Make all appended lines durable and record the time to resume the analysis from after a crash.
+
+        Args:
+            resume_time (int): All segments before this time (in seconds) are analysed.
+            fsync (bool): If True, the data is synced to the disk, otherwise it is only flushed to the OS.
+        """
+        self.set_state(STATE_RUNNING, resume_time, fsync)
+
+    def set_state(self, state: str, resume_time, fsync=True):
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        self._header.state = state
+        self._header.resume_time = resume_time
+        self._header.checkpoint_size = self._file.tell()
+        self._write_header()
+        self._file.seek(0, os.SEEK_END)
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(self._header.to_bytes())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_atomically(path, header: SpeechFileHeader, lines):
+    """
+    Write a complete version 2 analysis file into a temporary file next to it and then rename it, so the file is
+    either missing or complete.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(header.to_bytes())
+            file.write("".join(line + "\n" for line in lines).encode())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def format_speech_line(start_time, speech: str, word_times=()):
+    """
+    Args:
+        start_time (int): Start time of the segment in seconds.
+        speech (str): The recognized speech.
+        word_times (iterable, optional): (start, end) tuples of the recognized words in seconds.
+
+    Returns:
+        str: The speech line (without line break).
+    """
+    line = f"{start_time} {speech}"
+    if word_times:
+        line += WORD_TIMES_SEPARATOR + " ".join(f"{begin:.2f}-{end:.2f}" for begin, end in word_times)
+    return line
+
+
+def strip_word_times(line: str) -> str:
+    """
+    Remove the word times from a speech line.
+    """
+    return line.partition(WORD_TIMES_SEPARATOR)[0]
+
+
+def parse_word_times(line: str):
+    """
+    Get the word times of a speech line.
+
+    Returns:
+        list: (start, end) tuples of the recognized words in seconds, or None if the line has no word times.
+    """
+    _, separator, word_times = line.partition(WORD_TIMES_SEPARATOR)
+    if not separator or not word_times.strip():
+        return None
+    return [tuple(float(time) for time in word_time.split("-")) for word_time in word_times.split()]
+
+
+def shift_word_times(word_times, offset):
+    return [(begin + offset, end + offset) for begin, end in word_times]
+
+
+def get_analysis_state(path):
+    """
+    Get the state of an analysis file. For version 2 only the header is read.
+
+    Returns:
+        str: STATE_COMPLETE, STATE_INTERRUPTED, STATE_RUNNING or None if the file is no valid analysis file.
+    """
+    header = read_header(path)
+    if header is not None:
+        return header.state
+
+    lines = load_lines(path)
+    if len(lines) < 2 or not lines[0].isdigit():
+        return None
+    if lines[-1] == "end":
+        return STATE_COMPLETE
+    return STATE_INTERRUPTED if lines[-1].isdigit() else None
+
+
+def main():
+    """
+    List the state of the analysis files in the given directories (or of the given analysis files).
+    """
+    if len(sys.argv) < 2:
+        print("Usage: speech_file.py <directory or .speech file>...")
+        sys.exit(1)
+
+    for argument in sys.argv[1:]:
+        path = Path(argument)
+        paths = sorted(path.glob("*.speech")) if path.is_dir() else [path]
+        for speech_path in paths:
+            print(f"{get_analysis_state(speech_path) or 'invalid':<12} {speech_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import math
+from speech_file import format_speech_line, shift_word_times, SpeechFileWriter, STATE_COMPLETE
+
+"""
+Merges the analysis results of several shards (consecutive parts) of an audio file into one .speech file.
+"""
+
+
+def get_shard_lines(offset, speech_segments):
+    """
+    Offset the speech segments of a shard to the whole audio file.
+
+    Args:
+        offset (int): Offset of the shard in seconds.
+        speech_segments (list): (start time, speech, word times) tuples, all times relative to the shard.
+
+    Returns:
+        list: The speech lines of the shard.
+    """
+    return [format_speech_line(offset + start_time, speech, shift_word_times(word_times, offset))
+            for start_time, speech, word_times in speech_segments]
+
+
+class IncrementalMerger:
+    """
+    Appends the results of the shards to an analysis file as soon as all shards before them are finished and
+    checkpoints the file after every shard, so an aborted analysis only loses the shards that were in progress.
+    """
+
+    def __init__(self, analysis_file: SpeechFileWriter, shard_offsets, fsync=True):
+        """
+        Args:
+            analysis_file (SpeechFileWriter): The analysis file.
+            shard_offsets (iterable): Offsets of all shards (in seconds) that still have to be added.
+            fsync (bool): If True, every checkpoint is synced to the disk.
+        """
+        self._analysis_file = analysis_file
+        self._shard_offsets = sorted(shard_offsets)
+        self._next_shard = 0
+        self._finished_shards = {}
+        self._fsync = fsync
+        if not self._shard_offsets:
+            self._complete()
+
+    def add(self, offset, segment_length, speech_segments):
+        """
+        Add the result of a shard.
+
+        Args:
+            offset (int): Offset of the shard in seconds.
+            segment_length (int): Segment length of the shard's analysis in seconds.
+            speech_segments (list): See get_shard_lines.
+        """
+        if segment_length != self._analysis_file.header.segment_length:
+            raise ValueError(f"Shard at {offset} has segment length {segment_length} instead of "
+                             f"{self._analysis_file.header.segment_length}")
+        self._finished_shards[offset] = speech_segments
+
+        while (self._next_shard < len(self._shard_offsets) and
+               self._shard_offsets[self._next_shard] in self._finished_shards):
+            shard_offset = self._shard_offsets[self._next_shard]
+            for line in get_shard_lines(shard_offset, self._finished_shards.pop(shard_offset)):
+                self._analysis_file.append(line)
+            self._next_shard += 1
+            if self._next_shard < len(self._shard_offsets):
+                self._analysis_file.checkpoint(self._shard_offsets[self._next_shard], self._fsync)
+            else:
+                self._complete()
+
+    def _complete(self):
+        self._analysis_file.set_state(STATE_COMPLETE, math.ceil(self._analysis_file.header.duration), self._fsync)
@@ -1,15 +1,34 @@
+import math
 import os
 import signal
 import sys
 import tempfile
+import time
+import wave
 from enum import Enum
 from pathlib import Path
-from audio_tools import extract_segment, create_analysable_audio, get_total_length_of_audio
+from audio_tools import read_pcm_segments, read_pcm_segment, create_analysable_audio, get_total_length_of_audio, \
+    get_peak_rss_mib, get_file_fingerprint, get_source_fingerprint, get_pcm_fingerprint
+import instrumentation
 from seconds_formatter import seconds_to_min_sec
 from audio_segment_analyser import AudioSegmentAnalyser
+from music_pre_gate import is_certainly_music, PreGateStatistics
+from hierarchical_analysis import find_speech_segments
+from asr_cascade import retranscribe_border_segments, format_tier_report
+from vad_segments import get_speech_segment_starts
+from speech_file import (format_speech_line, shift_word_times, load_lines, read_header, SpeechFileHeader,
+                         SpeechFileWriter, STATE_RUNNING, STATE_INTERRUPTED, STATE_COMPLETE, MODE_LINEAR,
+                         MODE_HIERARCHICAL, SEGMENT_LENGTH_SEC, write_atomically, parse_word_times)
+from music_segments_finder import fetch_first_word_and_speech
 from vosk import SetLogLevel
 
 
+class _AnalysisInterrupted(Exception):
+    """
+    Raised to stop a coarse-to-fine analysis when the user interrupted it.
+    """
+
+
 class AnalyzeFileStatus(Enum):
     """
     Enumeration to represent the status of the analysis file.
@@ -41,102 +60,348 @@ class SpeechFinder:
         _interrupt (bool): Flag to indicate if the process was interrupted.
     """
 
-    SEGMENT_LENGTH_SEC = 20
+    SEGMENT_LENGTH_SEC = SEGMENT_LENGTH_SEC
 
-    def __init__(self, audio_path: str, silent_operation=False):
+    def __init__(self, audio_path: str, silent_operation=False, pre_gate=False, pre_gate_report=False,
+                 vad_first=False, checkpoint_interval=3, fsync=True, analysis_cache=None, hierarchical=False,
+                 large_model_name=None):
         """
         Initialize the SpeechFinder with the given audio file path.
 
         Args:
             audio_path (str): Path to the audio file.
+            silent_operation (bool): If True, nothing is printed during the analysis.
+            pre_gate (bool): If True, segments that are certainly music skip the speech recognition.
+            pre_gate_report (bool): If True, the pre-gate is evaluated, but every segment is still transcribed to
+                report how many of the segments skipped by the pre-gate contained speech.
+            vad_first (bool): If True, the VAD is run over the whole audio first and only the segments that
+                contain speech according to the VAD are transcribed.
+            checkpoint_interval (int): Number of segments after which the analysis file is checkpointed, so a
+                crashed analysis can be continued from the last checkpoint.
+            fsync (bool): If True, every checkpoint is synced to the disk, otherwise it is only flushed to the OS.
+            analysis_cache (AnalysisCache, optional): Cache of complete analyses that is checked before the audio
+                is analysed and that the results are stored in.
+            hierarchical (bool): If True, the segments are analysed from coarse to fine (see
+                hierarchical_analysis.py), so only the segments around the transitions between music and speech
+                are transcribed. An interrupted analysis is continued from coarse to fine.
+            large_model_name (str, optional): Name of a large Vosk model. If given, the speech segments next to
+                music are transcribed again by it when the analysis is complete (see asr_cascade.py).
+
+        Raises:
+            FileNotFoundError: If the large model does not exist.
         """
         self._audio_path = Path(audio_path)
         self._analyze_file_path = str(self._audio_path.with_suffix('.speech'))
         self._interrupt = False
         self._total_length = 0.0
         self._silent_operation = silent_operation
+        self._pre_gate = pre_gate or pre_gate_report
+        self._pre_gate_report = pre_gate_report
+        self._vad_first = vad_first
+        self._speech_segment_starts = None
+        self._fingerprint = None
+        self._source_fingerprint = None
+        self._checkpoint_interval = checkpoint_interval
+        self._fsync = fsync
+        self._analysis_cache = analysis_cache
+        self._hierarchical = hierarchical
+        self._large_model_name = large_model_name
+        if large_model_name:
+            # Checked now, so a missing model does not stop the program after the analysis
+            AudioSegmentAnalyser.get_model_path(large_model_name)
         SetLogLevel(-1)
 
     def find_segments(self):
         self._total_length = get_total_length_of_audio(self._audio_path)
+        self._fingerprint = get_file_fingerprint(self._audio_path)
+        self._source_fingerprint = get_source_fingerprint(self._audio_path) if self._analysis_cache else None
         necessary_analysis = self._get_necessary_analysis()
 
         if necessary_analysis == NecessaryAnalysis.NOT_NECESSARY:
             pass
         elif necessary_analysis == NecessaryAnalysis.FULLY:
-            self.inform("Full analysis")
             self._delete_analysis_file_if_exists()
-            self._do_analysis()
+            if not self._load_cached_analysis_of_source():
+                self.inform("Full analysis")
+                self._do_analysis()
         elif necessary_analysis == NecessaryAnalysis.CONTINUE:
             self.inform("Continuing the analysis")
-            lines = self._load_lines_of_analysis_file()
-            self._do_analysis(lines)
+            self._do_analysis(continue_analysis=True)
         else:
             raise NotImplementedError(f"Not implemented for {necessary_analysis}")
 
         return self._load_lines_of_analysis_file(), self._total_length
 
-    def _do_analysis(self, old_lines=()):
+    def _do_analysis(self, continue_analysis=False):
         """
         Perform the speech recognition analysis on the audio file, segment by segment.
 
         Args:
-            old_lines (tuple, optional): Existing lines from a previous analysis. Defaults to ().
+            continue_analysis (bool, optional): If True, an interrupted analysis is continued. Defaults to False.
         """
         with tempfile.TemporaryDirectory() as temp_dir:
             self.inform("Create analysable audio file...")
             analysable_audio_path = create_analysable_audio(temp_dir, self._audio_path)
+            peak_rss, peak_rss_ffmpeg = get_peak_rss_mib()
+            self.inform(f"Peak memory usage: {peak_rss:.0f} MiB (ffmpeg: {peak_rss_ffmpeg:.0f} MiB)")
+            pcm_fingerprint = get_pcm_fingerprint(analysable_audio_path) if self._analysis_cache else None
+            if pcm_fingerprint and not continue_analysis and self._load_cached_analysis_of_pcm(pcm_fingerprint):
+                return
+            if self._vad_first:
+                # The VAD (and torch) is only loaded when it is used
+                from vad_model import find_speech_spans
+
+                self.inform("Detecting speech with VAD...")
+                self._speech_segment_starts = get_speech_segment_starts(find_speech_spans(analysable_audio_path),
+                                                                        self.SEGMENT_LENGTH_SEC)
+                segment_count = math.ceil(self._total_length / self.SEGMENT_LENGTH_SEC)
+                self.inform(f"VAD detected speech in {len(self._speech_segment_starts)} of {segment_count} segments")
             segment_analyser = AudioSegmentAnalyser()
             total_length_display = seconds_to_min_sec(int(self._total_length))
-            if old_lines:
-                start_time, old_lines = int(old_lines[-1]), old_lines[:-1]
+            if continue_analysis:
+                header = read_header(self._analyze_file_path)
+                if header and header.state == STATE_RUNNING:
+                    self.inform("The analysis was aborted, recovering it from the last checkpoint")
+                analysis_file = SpeechFileWriter.continue_analysis(self._analyze_file_path, self._total_length,
+                                                                   self._fingerprint)
+                start_time = analysis_file.header.resume_time
                 self.inform(f"Continue analysing audio segments... (Press Ctrl+C to interrupt)")
                 if not self.needs_print(start_time):
                     self.inform(f"{seconds_to_min_sec(start_time)} (of {total_length_display})...")
             else:
                 self.inform("Analysing audio segments... (Press Ctrl+C to interrupt)")
+                analysis_file = SpeechFileWriter(self._analyze_file_path,
+                                                 SpeechFileHeader(self.SEGMENT_LENGTH_SEC, self._total_length,
+                                                                  self._fingerprint, mode=self._get_mode()))
                 start_time = 0
+            if self._hierarchical:
+                self._do_hierarchical_analysis(analysable_audio_path, segment_analyser, analysis_file,
+                                               pcm_fingerprint)
+                return
 
+            pre_gate_statistics = PreGateStatistics()
             self._interrupt = False  # Reset interrupt flag before starting analysis
             signal.signal(signal.SIGINT, self._signal_handler)
 
-            with open(self._analyze_file_path, "w") as file:
-                if old_lines:
-                    for old_line in old_lines:
-                        file.write(old_line + "\n")
-                else:
-                    file.write(f"{self.SEGMENT_LENGTH_SEC}\n")
-
-                while start_time < self._total_length:
-                    end_time = start_time + self.SEGMENT_LENGTH_SEC
-                    if end_time > self._total_length:
-                        end_time = self._total_length
-
-                    try:
-                        segment_path = extract_segment(analysable_audio_path, start_time, self.SEGMENT_LENGTH_SEC,
-                                                       segment_name=f"tmp_segment_{start_time}.wav")
-                        speech_segment = segment_analyser.get_speech(segment_path)
-                        if speech_segment:
-                            line = f"{start_time} {speech_segment}"
-                            file.write(line + "\n")
-                            self.inform(f"{seconds_to_min_sec(start_time)} {speech_segment}")
-                        elif self.needs_print(start_time):
-                            self.inform(f"{seconds_to_min_sec(start_time)} (of {total_length_display})...")
-                    finally:
-                        if os.path.exists(segment_path):
-                            os.remove(segment_path)
-
-                    start_time = end_time
+            segments_since_checkpoint = 0
+            completed = False
+            analysis_start, analysis_wall_start = start_time, time.perf_counter()
+            analysed_until = start_time
+            with analysis_file:
+                for start_time, pcm in read_pcm_segments(analysable_audio_path, start_time,
+                                                         self.SEGMENT_LENGTH_SEC, self._total_length):
+                    end_time = min(start_time + self.SEGMENT_LENGTH_SEC, self._total_length)
+
+                    with instrumentation.segment(start_time):
+                        speech_segment, word_times = self._get_speech(segment_analyser, start_time, pcm,
+                                                                      pre_gate_statistics)
+                    analysed_until = end_time
+                    if speech_segment:
+                        line = format_speech_line(start_time, speech_segment, shift_word_times(word_times, start_time))
+                        analysis_file.append(line)
+                        self.inform(f"{seconds_to_min_sec(start_time)} {speech_segment}")
+                    elif self.needs_print(start_time):
+                        self.inform(f"{seconds_to_min_sec(start_time)} (of {total_length_display})...")
 
                     if self._interrupt and end_time < self._total_length:
-                        file.write(f"{end_time}\n")
+                        analysis_file.set_state(STATE_INTERRUPTED, end_time, self._fsync)
                         print(f"User interrupted analysis at {seconds_to_min_sec(end_time)}.")
                         break
+
+                    segments_since_checkpoint += 1
+                    if segments_since_checkpoint >= self._checkpoint_interval and end_time < self._total_length:
+                        analysis_file.checkpoint(end_time, self._fsync)
+                        segments_since_checkpoint = 0
                 else:
-                    file.write(f"end\n")
+                    analysis_file.set_state(STATE_COMPLETE, math.ceil(self._total_length), self._fsync)
+                    completed = True
 
             signal.signal(signal.SIGINT, signal.SIG_DFL)
+            instrumentation.record_analysis(analysed_until - analysis_start, time.perf_counter() - analysis_wall_start)
+            if completed and self._large_model_name:
+                self._retranscribe_border_segments(analysable_audio_path, segment_analyser)
+            if completed and pcm_fingerprint:
+                self._analysis_cache.store(pcm_fingerprint, self._get_model_identity(), self.SEGMENT_LENGTH_SEC,
+                                           self._load_lines_of_analysis_file()[1:-1], self._source_fingerprint)
+            if self._pre_gate:
+                self.inform(str(pre_gate_statistics))
+
+    def _do_hierarchical_analysis(self, analysable_audio_path, segment_analyser, analysis_file, pcm_fingerprint):
+        """
+        Analyse the segments from coarse to fine (see hierarchical_analysis.py). Every transcription is appended to
+        the analysis file and checkpointed, so an interrupted analysis is continued without transcribing the
+        segments again. When the analysis is complete, the file is rewritten with the speech lines in order.
+        """
+        from vad_model import find_speech_spans_in_pcm
+
+        segment_count = math.ceil(self._total_length / self.SEGMENT_LENGTH_SEC)
+        analysis_wall_start = time.perf_counter()
+        transcriptions = self._load_transcriptions()
+        if transcriptions:
+            self.inform(f"{len(transcriptions)} segments were transcribed before")
+        self.inform("Analysing audio segments from coarse to fine... (Press Ctrl+C to interrupt)")
+        transcribed_count = len(transcriptions)
+        segments_since_checkpoint = 0
+        # A converted version 1 analysis is continued from coarse to fine from now on
+        analysis_file.header.mode = MODE_HIERARCHICAL
+        self._interrupt = False
+        signal.signal(signal.SIGINT, self._signal_handler)
+
+        with analysis_file, wave.open(str(analysable_audio_path), "rb") as wav_file:
+            def read_segment(index):
+                return read_pcm_segment(wav_file, index * self.SEGMENT_LENGTH_SEC, self.SEGMENT_LENGTH_SEC)
+
+            def transcribe(index):
+                nonlocal transcribed_count, segments_since_checkpoint
+                if index in transcriptions:
+                    return transcriptions[index]
+                if self._interrupt:
+                    raise _AnalysisInterrupted()
+                start_time = index * self.SEGMENT_LENGTH_SEC
+                with instrumentation.segment(start_time):
+                    speech_segment, word_times = segment_analyser.get_speech_and_word_times_from_pcm(
+                        read_segment(index))
+                transcriptions[index] = speech_segment, word_times
+                transcribed_count += 1
+                if speech_segment:
+                    analysis_file.append(format_speech_line(start_time, speech_segment,
+                                                            shift_word_times(word_times, start_time)))
+                    self.inform(f"{seconds_to_min_sec(start_time)} {speech_segment}")
+                else:
+                    analysis_file.append(str(start_time))
+                segments_since_checkpoint += 1
+                if segments_since_checkpoint >= self._checkpoint_interval:
+                    analysis_file.checkpoint(0, self._fsync)
+                    segments_since_checkpoint = 0
+                return speech_segment, word_times
+
+            try:
+                speech_segments = find_speech_segments(
+                    segment_count, transcribe, lambda index: is_certainly_music(read_segment(index)),
+                    lambda index: bool(find_speech_spans_in_pcm(read_segment(index))))
+            except _AnalysisInterrupted:
+                analysis_file.set_state(STATE_INTERRUPTED, 0, self._fsync)
+                print(f"User interrupted analysis after {transcribed_count} transcribed segments.")
+                return
+            finally:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+            header = SpeechFileHeader(self.SEGMENT_LENGTH_SEC, self._total_length, self._fingerprint, STATE_COMPLETE,
+                                      math.ceil(self._total_length))
+            write_atomically(self._analyze_file_path, header,
+                             [format_speech_line(index * self.SEGMENT_LENGTH_SEC, speech_segment,
+                                                 shift_word_times(word_times, index * self.SEGMENT_LENGTH_SEC))
+                              for index, (speech_segment, word_times) in sorted(speech_segments.items())])
+
+        instrumentation.record_analysis(self._total_length, time.perf_counter() - analysis_wall_start)
+        self.inform(f"Transcribed {transcribed_count} of {segment_count} segments")
+        if self._large_model_name:
+            self._retranscribe_border_segments(analysable_audio_path, segment_analyser)
+        if pcm_fingerprint:
+            self._analysis_cache.store(pcm_fingerprint, self._get_model_identity(), self.SEGMENT_LENGTH_SEC,
+                                       self._load_lines_of_analysis_file()[1:-1], self._source_fingerprint)
+
+    def _load_transcriptions(self):
+        """
+        Load the transcriptions of an unfinished coarse-to-fine analysis.
+
+        Returns:
+            dict: Speech and word times (relative to the segment) by the index of the segment.
+        """
+        transcriptions = {}
+        for line in self._load_lines_of_analysis_file()[1:-1]:
+            start_time, speech_segment = fetch_first_word_and_speech(line)
+            start_time = int(start_time)
+            transcriptions[start_time // self.SEGMENT_LENGTH_SEC] = (
+                speech_segment, shift_word_times(parse_word_times(line) or [], -start_time))
+        return transcriptions
+
+    def _retranscribe_border_segments(self, analysable_audio_path, segment_analyser):
+        """
+        Transcribe the speech segments next to music again with the large model and rewrite the analysis file.
+        """
+        self.inform(f"Transcribing the speech next to music with {self._large_model_name}...")
+        large_segment_analyser = AudioSegmentAnalyser(self._large_model_name)
+        with wave.open(str(analysable_audio_path), "rb") as wav_file:
+            speech_lines = retranscribe_border_segments(
+                self._load_lines_of_analysis_file(), self._total_length,
+                lambda start_time: large_segment_analyser.get_speech_and_word_times_from_pcm(
+                    read_pcm_segment(wav_file, start_time, self.SEGMENT_LENGTH_SEC)))
+        header = SpeechFileHeader(self.SEGMENT_LENGTH_SEC, self._total_length, self._fingerprint, STATE_COMPLETE,
+                                  math.ceil(self._total_length))
+        write_atomically(self._analyze_file_path, header, speech_lines)
+        self.inform(format_tier_report(self._total_length, segment_analyser.processed_seconds,
+                                       large_segment_analyser.processed_seconds))
+
+    def _get_speech(self, segment_analyser, start_time, pcm, pre_gate_statistics):
+        """
+        Get the speech and word times of a segment, skipping the speech recognition if the VAD detected no
+        speech in the segment or if the pre-gate is enabled and the segment is certainly music.
+        """
+        if self._speech_segment_starts is not None and start_time not in self._speech_segment_starts:
+            return "", []
+        if not self._pre_gate:
+            return segment_analyser.get_speech_and_word_times_from_pcm(pcm)
+
+        skipped = is_certainly_music(pcm)
+        if skipped and not self._pre_gate_report:
+            pre_gate_statistics.add(skipped)
+            return "", []
+
+        speech_segment, word_times = segment_analyser.get_speech_and_word_times_from_pcm(pcm)
+        pre_gate_statistics.add(skipped, bool(speech_segment) if self._pre_gate_report else None)
+        return speech_segment, word_times
+
+    def _get_mode(self) -> str:
+        return MODE_HIERARCHICAL if self._hierarchical else MODE_LINEAR
+
+    def _get_model_identity(self) -> str:
+        """
+        Identity of the speech model and of the analysis modes that change the results (for the analysis cache).
+        """
+        model_identity = AudioSegmentAnalyser.MODEL_NAME
+        if self._pre_gate and not self._pre_gate_report:
+            model_identity += "+pre-gate"
+        if self._vad_first:
+            model_identity += "+vad-first"
+        if self._hierarchical:
+            model_identity += "+hierarchical"
+        if self._large_model_name:
+            model_identity += f"+{self._large_model_name}"
+        return model_identity
+
+    def _load_cached_analysis_of_source(self) -> bool:
+        """
+        Write the analysis file from the analysis cache if the source file is known (no decoding needed).
 
+        Returns:
+            bool: True if the analysis was found in the cache.
+        """
+        if not self._analysis_cache:
+            return False
+        lines = self._analysis_cache.lookup_source(self._source_fingerprint, self._get_model_identity(),
+                                                   self.SEGMENT_LENGTH_SEC)
+        return self._write_cached_analysis(lines)
+
+    def _load_cached_analysis_of_pcm(self, pcm_fingerprint) -> bool:
+        """
+        Write the analysis file from the analysis cache if the decoded audio is known.
+
+        Returns:
+            bool: True if the analysis was found in the cache.
+        """
+        lines = self._analysis_cache.lookup(pcm_fingerprint, self._get_model_identity(), self.SEGMENT_LENGTH_SEC,
+                                            self._source_fingerprint)
+        return self._write_cached_analysis(lines)
+
+    def _write_cached_analysis(self, lines) -> bool:
+        if lines is None:
+            return False
+        self.inform("Analysis found in cache")
+        header = SpeechFileHeader(self.SEGMENT_LENGTH_SEC, self._total_length, self._fingerprint, STATE_COMPLETE,
+                                  math.ceil(self._total_length))
+        write_atomically(self._analyze_file_path, header, lines)
+        return True
 
     @staticmethod
     def needs_print(start_time):
@@ -180,6 +445,10 @@ class SpeechFinder:
         if os.path.getsize(self._analyze_file_path) == 0:
             return AnalyzeFileStatus.EMPTY
 
+        header = read_header(self._analyze_file_path)
+        if header is not None:
+            return self._get_analyze_file_status_of_header(header)
+
         lines = self._load_lines_of_analysis_file()
 
         if not lines:
@@ -200,14 +469,36 @@ class SpeechFinder:
         else: # only 1 line
             return AnalyzeFileStatus.INCORRECT
 
+    def _get_analyze_file_status_of_header(self, header: SpeechFileHeader) -> AnalyzeFileStatus:
+        """
+        Get the status of a version 2 analysis file from its header only.
+        """
+        if header.segment_length != self.SEGMENT_LENGTH_SEC or header.fingerprint != self._fingerprint:
+            return AnalyzeFileStatus.INCORRECT
+        if header.state != STATE_COMPLETE and header.mode != self._get_mode():
+            # An unfinished analysis can only be continued in the same mode
+            return AnalyzeFileStatus.INCORRECT
+        if header.state == STATE_COMPLETE:
+            return AnalyzeFileStatus.SEVERAL_LINES_AND_LAST_LINE_IS_END
+        elif header.state == STATE_INTERRUPTED:
+            return AnalyzeFileStatus.SEVERAL_LINES_AND_LAST_LINE_IS_DIGIT
+        elif header.state == STATE_RUNNING and header.checkpoint_size is not None:
+            # A running analysis was aborted (e.g. by a crash) and can be continued from its last checkpoint
+            return AnalyzeFileStatus.SEVERAL_LINES_AND_LAST_LINE_IS_DIGIT
+        else:
+            return AnalyzeFileStatus.INCORRECT
+
     def _load_lines_of_analysis_file(self):
-        lines = []
-        with open(self._analyze_file_path, 'r') as analyze_file:
-            for line in analyze_file.readlines():
-                line_strip = line.strip()
-                if line_strip:
-                    lines.append(line_strip)
-        return lines
+        return load_lines(self._analyze_file_path)
+
+    def is_unfinished_hierarchical_analysis(self):
+        """
+        Returns:
+            bool: True if the analysis file contains an unfinished coarse-to-fine analysis. Its lines are the
+                transcribed segments in the order of the search, so the music segments can not be found in them.
+        """
+        header = read_header(self._analyze_file_path) if os.path.isfile(self._analyze_file_path) else None
+        return header is not None and header.mode == MODE_HIERARCHICAL and header.state != STATE_COMPLETE
 
     def _signal_handler(self, sig, frame):
         """
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+from pathlib import Path
+from vosk import SetLogLevel
+from audio_segment_analyser import AudioSegmentAnalyser
+from audio_tools import read_pcm_shard_segments
+from speech_finder import SpeechFinder
+from speech_file import shift_word_times
+
+"""
+Pool of worker processes that analyse audio shards for speech.
+
+Every worker loads the Vosk model once and then pulls shards from the pool's task queue, so loading the
+model costs O(workers) instead of O(shards). Shards are only descriptors (offset and length) of a part of an
+analysable WAV file, the workers read their samples from the memory-mapped file.
+"""
+
+# The analyser of the current worker process (created by _init_worker)
+_segment_analyser = None
+
+
+def _init_worker():
+    global _segment_analyser
+    SetLogLevel(-1)
+    _segment_analyser = AudioSegmentAnalyser()
+
+
+def _analyse_shard(shard):
+    """
+    Analyse a shard of an analysable WAV file segment by segment.
+
+    Args:
+        shard (tuple): Key (e.g. of the audio file), offset of the shard (seconds, a multiple of the segment
+            length), path of the analysable WAV file and length of the shard (seconds).
+
+    Returns:
+        tuple: The key, the offset of the shard and a list of (start time, speech, word times) tuples (all times
+            relative to the shard).
+    """
+    key, offset, wav_path, shard_length = shard
+    speech_segments = []
+    for start_time, pcm in read_pcm_shard_segments(wav_path, offset, shard_length, SpeechFinder.SEGMENT_LENGTH_SEC):
+        speech_segment, word_times = _segment_analyser.get_speech_and_word_times_from_pcm(pcm)
+        if speech_segment:
+            speech_segments.append((start_time, speech_segment, shift_word_times(word_times, start_time)))
+    return key, offset, speech_segments
+
+
+class SpeechWorkerPool:
+    """
+    Context manager around a process pool whose workers keep their Vosk model loaded.
+    """
+
+    def __init__(self, processes=None):
+        self._processes = processes or os.cpu_count()
+        self._pool = None
+
+    def __enter__(self):
+        self._pool = multiprocessing.Pool(self._processes, initializer=_init_worker)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+    @property
+    def processes(self):
+        return self._processes
+
+    def analyse_shard(self, shard, callback, error_callback):
+        """
+        Start the analysis of a shard in a worker process (see batch_scheduler.analyse_shards_on_demand).
+
+        Args:
+            shard (tuple): Key (e.g. of the audio file), offset (seconds), path of the analysable WAV file and
+                length (seconds) of the shard.
+            callback (callable): Called with the (key, offset, speech segments) tuple of the finished shard.
+            error_callback (callable): Called with the exception if the analysis failed.
+        """
+        key, offset, path, length = shard
+        self._pool.apply_async(_analyse_shard, ((key, offset, Path(path), length),), callback=callback,
+                               error_callback=error_callback)
@@ -0,0 +1,110 @@
+import wave
+from pathlib import Path
+import numpy as np
+
+"""
+Deterministic synthetic "broadcast" recordings for benchmarks (see benchmark.py).
+
+A recording alternates between speech and music parts. Music is a tonal bed (chords of harmonic tones with a slow
+envelope), speech is band-limited noise whose envelope is modulated with the syllable rate (~4 Hz) and interrupted
+by short pauses. The same seed always gives the same recording, so benchmark runs can be compared.
+"""
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+SPEECH_LENGTH_RANGE = (20, 60)
+MUSIC_LENGTH_RANGE = (120, 300)
+
+# Parts are synthesized in blocks of this length (seconds), so the memory usage does not depend on their length
+BLOCK_LENGTH_SEC = 10
+
+# Root frequencies of the chords of the music parts (Hz)
+CHORD_ROOTS = (110.0, 130.81, 146.83, 164.81, 196.0)
+
+
+def create_layout(length: float, seed: int):
+    """
+    Create the layout of a recording: alternating speech and music parts, starting with speech.
+
+    Args:
+        length (float): Length of the recording in seconds.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        list: (start, end, kind) tuples of the parts in seconds, kind is "speech" or "music".
+    """
+    rng = np.random.default_rng(seed)
+    layout = []
+    start = 0.0
+    kind = "speech"
+    while start < length:
+        length_range = SPEECH_LENGTH_RANGE if kind == "speech" else MUSIC_LENGTH_RANGE
+        end = min(start + float(rng.integers(*length_range)), length)
+        layout.append((start, end, kind))
+        start = end
+        kind = "music" if kind == "speech" else "speech"
+    return layout
+
+
+def create_recording(path: Path, length: float, seed: int):
+    """
+    Write a synthetic recording as 16-bit stereo WAV file with a sample rate of 44.1 kHz.
+
+    Args:
+        path (Path): Path of the WAV file.
+        length (float): Length of the recording in seconds.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        list: The layout of the recording (see create_layout).
+    """
+    layout = create_layout(length, seed)
+    rng = np.random.default_rng(seed + 1)
+    with wave.open(str(path), "wb") as wf:
+        wf.setnchannels(CHANNELS)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        for start, end, kind in layout:
+            synthesize = _synthesize_speech if kind == "speech" else _synthesize_music
+            part_rng = np.random.default_rng(rng.integers(1 << 32))
+            block_start = start
+            while block_start < end:
+                block_end = min(block_start + BLOCK_LENGTH_SEC, end)
+                samples = synthesize(part_rng, block_start, block_end)
+                stereo = np.repeat(np.clip(samples * 32767, -32768, 32767).astype(np.int16)[:, np.newaxis],
+                                   CHANNELS, axis=1)
+                wf.writeframes(stereo.tobytes())
+                block_start = block_end
+    return layout
+
+
+def _get_times(start, end):
+    first_sample = int(round(start * SAMPLE_RATE))
+    last_sample = int(round(end * SAMPLE_RATE))
+    return np.arange(first_sample, last_sample) / SAMPLE_RATE
+
+
+def _synthesize_music(rng, start, end):
+    t = _get_times(start, end)
+    # One chord per 4 seconds, chosen by the time only, so the blocks of a part fit together
+    chord = (t // 4).astype(int) % len(CHORD_ROOTS)
+    root = np.asarray(CHORD_ROOTS)[chord]
+    samples = np.zeros_like(t)
+    for interval in (1.0, 1.25, 1.5):
+        for harmonic in range(1, 5):
+            samples += np.sin(2 * np.pi * root * interval * harmonic * t) / harmonic
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 0.1 * t)
+    return 0.05 * samples * envelope + 0.002 * rng.standard_normal(len(t))
+
+
+def _synthesize_speech(rng, start, end):
+    t = _get_times(start, end)
+    noise = rng.standard_normal(len(t))
+    spectrum = np.fft.rfft(noise)
+    frequencies = np.fft.rfftfreq(len(t), d=1.0 / SAMPLE_RATE)
+    spectrum[(frequencies < 300) | (frequencies > 3400)] = 0
+    voice = np.fft.irfft(spectrum, n=len(t))
+    syllables = np.clip(np.sin(2 * np.pi * 4.0 * t + rng.uniform(0, 2 * np.pi)), 0, None)
+    pauses = (np.sin(2 * np.pi * 0.3 * t) > -0.7).astype(float)
+    return 0.3 * voice * syllables * pauses
@@ -0,0 +1,52 @@
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+from analysis_cache import AnalysisCache
+
+
+class TestAnalysisCache(TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.cache = AnalysisCache(Path(self._temp_dir.name) / "cache" / "analysis.sqlite", max_size=100)
+
+    def tearDown(self):
+        self.cache.close()
+        self._temp_dir.cleanup()
+
+    def test_lookup_by_pcm_fingerprint(self):
+        self.cache.store("pcm", "model", 20, ["0 at 0", "40 at 40"])
+        self.assertEqual(["0 at 0", "40 at 40"], self.cache.lookup("pcm", "model", 20))
+        self.assertIsNone(self.cache.lookup("pcm", "other model", 20))
+        self.assertIsNone(self.cache.lookup("pcm", "model", 10))
+        self.assertIsNone(self.cache.lookup("other pcm", "model", 20))
+
+    def test_lookup_by_source_fingerprint(self):
+        self.cache.store("pcm", "model", 20, ["0 at 0"], source_fingerprint="source")
+        self.assertEqual(["0 at 0"], self.cache.lookup_source("source", "model", 20))
+        self.assertIsNone(self.cache.lookup_source("copy", "model", 20))
+
+        # A copy in another container format is found by its PCM fingerprint and remembered
+        self.assertEqual(["0 at 0"], self.cache.lookup("pcm", "model", 20, source_fingerprint="copy"))
+        self.assertEqual(["0 at 0"], self.cache.lookup_source("copy", "model", 20))
+
+    def test_use_from_several_threads(self):
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda no: self.cache.store(f"pcm {no}", "model", 20, [f"{no}"]), range(4)))
+            results = list(executor.map(lambda no: self.cache.lookup(f"pcm {no}", "model", 20), range(4)))
+        self.assertEqual([["0"], ["1"], ["2"], ["3"]], results)
+
+    def test_analysis_without_speech(self):
+        self.cache.store("pcm", "model", 20, [])
+        self.assertEqual([], self.cache.lookup("pcm", "model", 20))
+
+    def test_least_recently_used_analyses_are_evicted(self):
+        self.cache.store("first", "model", 20, ["x" * 40], source_fingerprint="first source")
+        self.cache.store("second", "model", 20, ["x" * 40])
+        self.cache.lookup("first", "model", 20)
+        self.cache.store("third", "model", 20, ["x" * 40])
+
+        self.assertIsNotNone(self.cache.lookup("first", "model", 20))
+        self.assertIsNone(self.cache.lookup("second", "model", 20))
+        self.assertIsNotNone(self.cache.lookup("third", "model", 20))
+        self.assertIsNotNone(self.cache.lookup_source("first source", "model", 20))
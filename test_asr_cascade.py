@@ -0,0 +1,28 @@
+from unittest import TestCase
+from asr_cascade import find_border_segments, retranscribe_border_segments, format_tier_report
+
+
+class TestAsrCascade(TestCase):
+    LINES = ["20", "0 hello world", "20 still talking", "40 last words", "120 back again", "140 and more", "end"]
+
+    def test_border_segments(self):
+        self.assertEqual([40, 120, 140], find_border_segments(self.LINES, 200.0))
+
+    def test_speech_at_the_end_of_the_audio_borders_no_music(self):
+        self.assertEqual([40, 120], find_border_segments(self.LINES, 160.0))
+
+    def test_only_border_segments_are_transcribed_again(self):
+        transcribed = []
+
+        def transcribe(start_time):
+            transcribed.append(start_time)
+            return ("better transcript", [(1.0, 1.5)]) if start_time == 40 else ("", [])
+
+        speech_lines = retranscribe_border_segments(self.LINES, 160.0, transcribe)
+        self.assertEqual([40, 120], transcribed)
+        self.assertEqual(["0 hello world", "20 still talking", "40 better transcript\t41.00-41.50", "120 back again",
+                          "140 and more"], speech_lines)
+
+    def test_tier_report(self):
+        self.assertEqual("Small model processed 10:00 of 10:00 (100.0%), large model 0:40 (6.7%)",
+                         format_tier_report(600.0, 600.0, 40.0))
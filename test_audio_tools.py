@@ -0,0 +1,132 @@
+import tempfile
+import wave
+import numpy as np
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+import audio_tools
+from audio_tools import (create_ffmpeg_multi_split_command, AudioInfo, probe_audio, get_total_length_of_audio,
+                         get_wav_data_layout, read_pcm_shard_segments, get_file_fingerprint, get_source_fingerprint,
+                         FINGERPRINT_BLOCK_SIZE)
+
+
+class TestAudioTools(TestCase):
+    def test_multi_split_command_reads_the_audio_file_once(self):
+        command = create_ffmpeg_multi_split_command("in.mp3", [(20, 80.5, "01_x_with_speech.mp3"),
+                                                               (25.2, 75, "01_x.mp3")])
+        self.assertEqual(['ffmpeg', '-loglevel', 'error', '-n', '-i', 'in.mp3',
+                          '-ss', '20', '-t', '60.5', '-c', 'copy', '01_x_with_speech.mp3',
+                          '-ss', '25.2', '-t', '49.8', '-c', 'copy', '01_x.mp3'], command)
+
+    def test_multi_split_command_encodes_lossless_outputs(self):
+        command = create_ffmpeg_multi_split_command("in.flac", [(0, 10, "01_x.flac")], overwrite=True)
+        self.assertEqual(['ffmpeg', '-loglevel', 'error', '-y', '-i', 'in.flac', '-ss', '0', '-t', '10', '01_x.flac'],
+                         command)
+
+    def test_multi_split_command_writes_tags(self):
+        command = create_ffmpeg_multi_split_command("in.m4a",
+                                                    [(0, 10, "01_x.m4a", {"REPLAYGAIN_TRACK_GAIN": "-1.00 dB"})])
+        self.assertEqual(['ffmpeg', '-loglevel', 'error', '-n', '-i', 'in.m4a', '-ss', '0', '-t', '10', '-c', 'copy',
+                          '-metadata', 'REPLAYGAIN_TRACK_GAIN=-1.00 dB', '-movflags', 'use_metadata_tags', '01_x.m4a'],
+                         command)
+
+    def test_failed_split_removes_the_outputs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            outputs = [Path(temp_dir) / "01_x.flac", Path(temp_dir) / "01_x_with_speech.mp3"]
+
+            def fail(command, check=True):
+                for output in outputs:
+                    output.write_bytes(b"partial")
+                raise RuntimeError("ffmpeg failed: broken input")
+
+            with patch("tool_runner.run", side_effect=fail):
+                ranges = [(0, 10, outputs[0], {"REPLAYGAIN_TRACK_GAIN": "-1.00 dB"}), (0, 12, outputs[1])]
+                with self.assertRaisesRegex(RuntimeError, "broken input"):
+                    audio_tools.split_audio_ranges("in.flac", ranges)
+            self.assertFalse(any(output.exists() for output in outputs))
+
+    def test_failed_split_keeps_existing_files(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            existing, created = Path(temp_dir) / "01_x.mp3", Path(temp_dir) / "02_x.mp3"
+            existing.write_bytes(b"earlier export")
+
+            def fail(command, check=True):
+                self.assertIn("-n", command)
+                created.write_bytes(b"partial")
+                raise RuntimeError("ffmpeg failed: File '01_x.mp3' already exists. Exiting.")
+
+            with patch("tool_runner.run", side_effect=fail):
+                with self.assertRaisesRegex(RuntimeError, "already exists"):
+                    audio_tools.split_audio_ranges("in.mp3", [(0, 10, existing), (10, 20, created)])
+            self.assertEqual(b"earlier export", existing.read_bytes())
+            self.assertFalse(created.exists())
+
+    def test_probe_wav_from_header(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            wav_path = Path(temp_dir) / "x.wav"
+            write_wav(wav_path, channels=2, sample_rate=44100, frames=22050)
+            self.assertEqual(AudioInfo(0.5, 44100, 2, "pcm_s16le"), probe_audio(wav_path))
+
+    def test_probe_is_memoised_until_the_file_changes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            wav_path = Path(temp_dir) / "x.wav"
+            write_wav(wav_path, channels=1, sample_rate=16000, frames=16000)
+            with patch("audio_tools._read_wav_header", wraps=audio_tools._read_wav_header) as read_wav_header:
+                self.assertEqual(1.0, get_total_length_of_audio(wav_path))
+                self.assertEqual(1, probe_audio(wav_path).channels)
+                self.assertEqual(1, read_wav_header.call_count)
+                write_wav(wav_path, channels=1, sample_rate=16000, frames=32000)
+                self.assertEqual(2.0, get_total_length_of_audio(wav_path))
+                self.assertEqual(2, read_wav_header.call_count)
+
+    def test_source_fingerprint_samples_the_middle_of_the_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first, second = Path(temp_dir) / "first.mp3", Path(temp_dir) / "second.mp3"
+            data = bytearray(100 * FINGERPRINT_BLOCK_SIZE)
+            first.write_bytes(data)
+            # A part in the middle differs (e.g. another program of the same stream)
+            data[48 * FINGERPRINT_BLOCK_SIZE:52 * FINGERPRINT_BLOCK_SIZE] = b"\1" * (4 * FINGERPRINT_BLOCK_SIZE)
+            second.write_bytes(data)
+            # Same size, beginning and end
+            self.assertEqual(get_file_fingerprint(first), get_file_fingerprint(second))
+            self.assertNotEqual(get_source_fingerprint(first), get_source_fingerprint(second))
+            self.assertEqual(get_source_fingerprint(second), get_source_fingerprint(second))
+
+    def test_source_fingerprint_of_small_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "small.mp3"
+            path.write_bytes(b"abc")
+            first = get_source_fingerprint(path)
+            path.write_bytes(b"abd")
+            self.assertNotEqual(first, get_source_fingerprint(path))
+
+    def test_audio_info_from_pcm(self):
+        self.assertEqual(1.5, AudioInfo.from_pcm(bytes(48000)).duration)
+
+    def test_wav_data_layout(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            wav_path = Path(temp_dir) / "x.wav"
+            write_wav(wav_path, channels=1, sample_rate=16000, frames=100)
+            self.assertEqual((44, 200), get_wav_data_layout(wav_path))
+
+    def test_shard_segments_are_read_from_the_wav_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            wav_path = Path(temp_dir) / "x.wav"
+            samples = (np.arange(16000 * 50) % 1000).astype(np.int16)
+            with wave.open(str(wav_path), "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(16000)
+                wf.writeframes(samples.tobytes())
+            segments = list(read_pcm_shard_segments(wav_path, 20, 30.0, 20))
+            self.assertEqual([0, 20], [start_time for start_time, _ in segments])
+            self.assertEqual(samples[16000 * 20:16000 * 40].tobytes(), segments[0][1])
+            self.assertEqual(samples[16000 * 40:].tobytes(), segments[1][1])
+
+
+def write_wav(path, channels, sample_rate, frames):
+    with wave.open(str(path), "wb") as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(bytes(frames * channels * 2))
@@ -0,0 +1,82 @@
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+from batch_scheduler import collect_audio_files, analyse_shards_on_demand, ShardScheduler
+
+
+class TestBatchScheduler(TestCase):
+    def test_collect_audio_files_from_directories_and_globs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            directory = Path(temp_dir)
+            for name in ["b.mp3", "a.FLAC", "a.speech", "notes.txt"]:
+                (directory / name).touch()
+            (directory / "sub").mkdir()
+            (directory / "sub" / "c.mp3").touch()
+
+            self.assertEqual([directory / "a.FLAC", directory / "b.mp3"], collect_audio_files([temp_dir]))
+            self.assertEqual([directory / "sub" / "c.mp3", directory / "b.mp3"],
+                             collect_audio_files([f"{temp_dir}/*/*.mp3", f"{temp_dir}/*.mp3"]))
+
+    def test_collect_audio_files_without_duplicates(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            audio_file = Path(temp_dir) / "a.mp3"
+            audio_file.touch()
+            self.assertEqual([audio_file], collect_audio_files([str(audio_file), temp_dir]))
+
+    def test_shards_of_the_file_with_the_least_remaining_work_first(self):
+        scheduler = ShardScheduler()
+        scheduler.add("long", [(300, "long_300", 300.0), (0, "long_0", 300.0)])
+        scheduler.add("short", [(0, "short_0", 120.0)])
+        scheduler.add("middle", [(0, "middle_0", 300.0), (300, "middle_300", 10.5)])
+        self.assertEqual(5, len(scheduler))
+        self.assertEqual([("short", 0, "short_0", 120.0),
+                          ("middle", 0, "middle_0", 300.0),
+                          ("middle", 300, "middle_300", 10.5),
+                          ("long", 0, "long_0", 300.0),
+                          ("long", 300, "long_300", 300.0)], [scheduler.pop() for _ in range(5)])
+        self.assertEqual(0, len(scheduler))
+
+    def test_shorter_file_that_is_added_later_is_worked_on_first(self):
+        scheduler = ShardScheduler()
+        scheduler.add("long", [(0, "long_0", 300.0), (300, "long_300", 300.0), (600, "long_600", 300.0)])
+        self.assertEqual(("long", 0, "long_0", 300.0), scheduler.pop())
+        scheduler.add("short", [(0, "short_0", 300.0)])
+        # The long file has still 600 seconds of work left
+        self.assertEqual([("short", 0, "short_0", 300.0),
+                          ("long", 300, "long_300", 300.0),
+                          ("long", 600, "long_600", 300.0)], [scheduler.pop() for _ in range(3)])
+
+    def test_shards_are_handed_out_on_demand(self):
+        max_in_flight = 2
+        in_flight = []
+        peak_in_flight = []
+        lock = threading.Lock()
+
+        def analyse(shard, callback, error_callback):
+            with lock:
+                in_flight.append(shard)
+                peak_in_flight.append(len(in_flight))
+
+            def finish():
+                with lock:
+                    in_flight.remove(shard)
+                callback(shard[:2])
+
+            executor.submit(finish)
+
+        files = [("a", [(0, "a_0", 300.0), (300, "a_300", 300.0), (600, "a_600", 10.0)]),
+                 ("b", [(0, "b_0", 20.0)])]
+        with ThreadPoolExecutor(4) as executor:
+            results = list(analyse_shards_on_demand(iter(files), analyse, max_in_flight))
+        self.assertEqual({("a", 0), ("a", 300), ("a", 600), ("b", 0)}, set(results))
+        self.assertEqual(4, len(results))
+        self.assertLessEqual(max(peak_in_flight), max_in_flight)
+
+    def test_failed_shard_stops_the_analysis(self):
+        def analyse(shard, callback, error_callback):
+            error_callback(RuntimeError(f"{shard[2]} failed"))
+
+        with self.assertRaisesRegex(RuntimeError, "a_0 failed"):
+            list(analyse_shards_on_demand(iter([("a", [(0, "a_0", 300.0)])]), analyse, 2))
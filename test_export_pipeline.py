@@ -0,0 +1,58 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+from export_pipeline import ExportPipeline
+
+
+class TestExportPipeline(TestCase):
+    def test_reports_in_order_of_jobs(self):
+        reports = []
+        pipeline = ExportPipeline(max_workers=3, report=reports.append)
+
+        def export(no, delay):
+            time.sleep(delay)
+            return f"exported {no}"
+
+        pipeline.run([([], lambda: export(1, 0.06)), ([], lambda: export(2, 0.0)), ([], lambda: export(3, 0.03))])
+        self.assertEqual(["exported 1", "exported 2", "exported 3"], reports)
+
+    def test_stage_limit(self):
+        pipeline = ExportPipeline({"trim": 1}, max_workers=4, report=lambda report: None)
+        lock = threading.Lock()
+        in_stage = [0]
+        max_in_stage = [0]
+
+        def export():
+            with pipeline.stage("trim"):
+                with lock:
+                    in_stage[0] += 1
+                    max_in_stage[0] = max(max_in_stage[0], in_stage[0])
+                time.sleep(0.01)
+                with lock:
+                    in_stage[0] -= 1
+            with pipeline.stage("not limited"):
+                return ""
+
+        pipeline.run([([], export) for _ in range(4)])
+        self.assertEqual(1, max_in_stage[0])
+
+    def test_failure_removes_outputs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first_output = Path(temp_dir) / "01.mp3"
+            second_output = Path(temp_dir) / "02.mp3"
+
+            def export_first():
+                first_output.touch()
+                return "exported 1"
+
+            def export_second():
+                second_output.touch()
+                raise RuntimeError("trim failed")
+
+            pipeline = ExportPipeline(max_workers=1, report=lambda report: None)
+            with self.assertRaises(RuntimeError):
+                pipeline.run([([first_output], export_first), ([second_output], export_second)])
+            self.assertFalse(first_output.exists())
+            self.assertFalse(second_output.exists())
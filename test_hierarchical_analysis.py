@@ -0,0 +1,116 @@
+from unittest import TestCase
+from unittest.mock import patch
+import numpy as np
+import synthetic_corpus
+from hierarchical_analysis import find_speech_segments, INFERRED_SPEECH
+from music_pre_gate import is_certainly_music, SAMPLE_RATE
+
+
+class Recording:
+    """
+    Segments of a fake recording: "s" is speech, "m" is music that the pre-gate recognizes, "u" is music that the
+    pre-gate does not recognize and in which the VAD detects no speech, "v" is music with vocals that the pre-gate
+    does not recognize and in which the VAD detects speech.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.transcribed = []
+
+    def transcribe(self, index):
+        self.transcribed.append(index)
+        return (f"speech {index}", [(0.5, 1.0)]) if self.layout[index] == "s" else ("", [])
+
+    def is_certainly_music(self, index):
+        return self.layout[index] == "m"
+
+    def may_contain_speech(self, index):
+        return self.layout[index] in "sv"
+
+    def find(self, coarse_segments=4):
+        return find_speech_segments(len(self.layout), self.transcribe, self.is_certainly_music,
+                                    self.may_contain_speech, coarse_segments)
+
+
+class TestHierarchicalAnalysis(TestCase):
+    def test_speech_segments_are_found(self):
+        layout = "ssssssss" + "m" * 30 + "sssss" + "m" * 20 + "sss"
+        speech_segments = Recording(layout).find()
+        self.assertEqual([index for index, kind in enumerate(layout) if kind == "s"], sorted(speech_segments))
+
+    def test_speech_next_to_music_is_transcribed(self):
+        layout = "s" * 20 + "m" * 20 + "s" * 20
+        speech_segments = Recording(layout).find()
+        self.assertEqual(("speech 19", [(0.5, 1.0)]), speech_segments[19])
+        self.assertEqual(("speech 40", [(0.5, 1.0)]), speech_segments[40])
+        self.assertEqual(INFERRED_SPEECH, speech_segments[10][0])
+
+    def test_work_scales_with_transitions(self):
+        short = Recording("s" * 10 + "m" * 50 + "s" * 10)
+        short.find()
+        long = Recording("s" * 100 + "m" * 500 + "s" * 100)
+        long.find()
+        self.assertLess(len(long.transcribed), 700 // 8)
+        self.assertLess(len(long.transcribed) - len(short.transcribed), 200 // 4)
+        self.assertEqual(len(long.transcribed), len(set(long.transcribed)))
+
+    def test_work_scales_with_transitions_for_music_unknown_to_the_pre_gate(self):
+        recording = Recording("s" * 100 + "u" * 500 + "s" * 100)
+        speech_segments = recording.find()
+        self.assertEqual(list(range(100)) + list(range(600, 700)), sorted(speech_segments))
+        self.assertLess(len(recording.transcribed), 700 // 8)
+
+    def test_music_with_detected_speech_is_transcribed(self):
+        layout = "ss" + "v" * 12 + "s" + "v" * 12 + "ss"
+        recording = Recording(layout)
+        speech_segments = recording.find()
+        self.assertEqual([0, 1, 14, 27, 28], sorted(speech_segments))
+
+    def test_short_music_is_found_by_the_pre_gate(self):
+        layout = "s" * 9 + "m" + "s" * 10
+        speech_segments = Recording(layout).find()
+        self.assertNotIn(9, speech_segments)
+        self.assertEqual("speech 8", speech_segments[8][0])
+        self.assertEqual("speech 10", speech_segments[10][0])
+
+    def test_short_music_is_found_by_the_vad(self):
+        layout = "s" * 9 + "uu" + "s" * 9
+        recording = Recording(layout)
+        speech_segments = recording.find()
+        self.assertEqual(list(range(9)) + list(range(11, 20)), sorted(speech_segments))
+        self.assertEqual("speech 8", speech_segments[8][0])
+        self.assertEqual("speech 11", speech_segments[11][0])
+        self.assertFalse([index for index in recording.transcribed if layout[index] == "u"])
+
+    def test_empty_recording(self):
+        self.assertEqual({}, Recording("").find())
+
+
+class TestHierarchicalAnalysisOfSyntheticAudio(TestCase):
+    LAYOUT = [("speech", 5), ("music", 25), ("speech", 5)]
+
+    def setUp(self):
+        self.kinds = [kind for kind, count in self.LAYOUT for _ in range(count)]
+        self.transcribed = []
+        self.segments = {}
+
+    def read_segment(self, index):
+        if index in self.segments:
+            return self.segments[index]
+        synthesize = (synthetic_corpus._synthesize_speech if self.kinds[index] == "speech"
+                      else synthetic_corpus._synthesize_music)
+        with patch.object(synthetic_corpus, "SAMPLE_RATE", SAMPLE_RATE):
+            samples = synthesize(np.random.default_rng(index), index * 20, index * 20 + 20)
+        self.segments[index] = np.clip(samples * 32767, -32768, 32767).astype(np.int16).tobytes()
+        return self.segments[index]
+
+    def transcribe(self, index):
+        self.transcribed.append(index)
+        return ("speech", []) if self.kinds[index] == "speech" else ("", [])
+
+    def test_music_recognized_by_the_real_pre_gate_is_not_transcribed(self):
+        speech_segments = find_speech_segments(len(self.kinds), self.transcribe,
+                                               lambda index: is_certainly_music(self.read_segment(index)),
+                                               lambda index: True)
+        self.assertEqual(list(range(5)) + list(range(30, 35)), sorted(speech_segments))
+        self.assertFalse([index for index in self.transcribed if self.kinds[index] == "music"])
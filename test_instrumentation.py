@@ -0,0 +1,46 @@
+import subprocess
+import sys
+from unittest import TestCase
+import instrumentation
+from instrumentation import instrumented
+
+
+@instrumented("test_stage")
+def _start_process():
+    subprocess.run([sys.executable, "-c", "pass"])
+    return 42
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        instrumentation.enable()
+        instrumentation.reset()
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_instrumented_function_is_recorded(self):
+        self.assertEqual(42, _start_process())
+        self.assertEqual(42, _start_process())
+        statistics = instrumentation.get_summary()["stages"]["test_stage"]
+        self.assertEqual(2, statistics["calls"])
+        self.assertEqual(2, statistics["subprocesses"])
+        self.assertGreater(statistics["wall_seconds"], 0.0)
+        self.assertGreater(statistics["cpu_seconds"], 0.0)
+
+    def test_slowest_segments_and_realtime_factor(self):
+        for start_time in (0, 20, 40):
+            with instrumentation.segment(start_time):
+                pass
+        instrumentation.record_analysis(600.0, 30.0)
+        summary = instrumentation.get_summary()
+        self.assertEqual({0, 20, 40}, {segment["start"] for segment in summary["slowest_segments"]})
+        self.assertEqual(0.05, summary["analysis"]["realtime_factor"])
+        self.assertIn("real-time factor 0.0500", instrumentation.format_summary(summary))
+
+    def test_disable_restores_popen(self):
+        instrumentation.disable()
+        self.assertIs(instrumentation._original_popen_init, subprocess.Popen.__init__)
+        self.assertEqual(42, _start_process())
+        self.assertNotIn("test_stage", instrumentation.get_summary()["stages"])
@@ -0,0 +1,147 @@
+import io
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+from live_speech_finder import LiveSpeechFinder, read_blocks, PCM_BYTES_PER_SECOND
+from speech_file import (load_lines, read_header, write_atomically, SpeechFileHeader, STATE_RUNNING, STATE_COMPLETE,
+                         MODE_HIERARCHICAL)
+
+SEGMENT_BYTES = LiveSpeechFinder.SEGMENT_LENGTH_SEC * PCM_BYTES_PER_SECOND
+
+
+def create_pcm(layout, last_segment_fraction=1.0):
+    """
+    PCM data of a fake recording: "s" is a speech segment, "m" a music segment. The last segment can be partial.
+    """
+    pcm = b"".join(bytes([kind == "s"]) * SEGMENT_BYTES for kind in layout)
+    return pcm[:len(pcm) - int(SEGMENT_BYTES * (1 - last_segment_fraction))]
+
+
+class SegmentAnalyser:
+    """
+    Recognizes speech in the segments of create_pcm, or raises KeyboardInterrupt at a given segment.
+    """
+
+    def __init__(self, interrupt_at=None):
+        self.interrupt_at = interrupt_at
+        self.segment_lengths = []
+
+    def get_speech_and_word_times_from_pcm(self, pcm):
+        if len(self.segment_lengths) == self.interrupt_at:
+            raise KeyboardInterrupt()
+        self.segment_lengths.append(len(pcm) / PCM_BYTES_PER_SECOND)
+        return ("speech", [(0.5, 1.0)]) if pcm[0] else ("", [])
+
+
+class ChunkedStream:
+    """
+    A stream that returns at most chunk_size bytes per read, like a pipe.
+    """
+
+    def __init__(self, data, chunk_size):
+        self.stream = io.BytesIO(data)
+        self.chunk_size = chunk_size
+
+    def read(self, size):
+        return self.stream.read(min(size, self.chunk_size))
+
+
+class Process:
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+    def wait(self):
+        return self.returncode
+
+
+class TestReadBlocks(TestCase):
+    def test_blocks_are_complete(self):
+        self.assertEqual([b"abcd", b"efgh", b"ij"], list(read_blocks(ChunkedStream(b"abcdefghij", 3), 4)))
+
+    def test_no_empty_last_block(self):
+        self.assertEqual([b"abcd", b"efgh"], list(read_blocks(io.BytesIO(b"abcdefgh"), 4)))
+        self.assertEqual([], list(read_blocks(io.BytesIO(b""), 4)))
+
+
+class TestLiveSpeechFinder(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.speech_path = Path(self.temp_dir.name) / "recording.speech"
+        self.music_segments = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def create_finder(self, segment_analyser):
+        return LiveSpeechFinder(self.speech_path, self.music_segments.append, silent_operation=True, fsync=False,
+                                segment_analyser=segment_analyser)
+
+    def test_resume_time_of_new_analysis(self):
+        self.assertEqual(0, self.create_finder(SegmentAnalyser()).get_resume_time())
+
+    def test_complete_analysis_is_not_continued(self):
+        self.create_finder(SegmentAnalyser()).analyse(io.BytesIO(create_pcm("sms")))
+        with self.assertRaisesRegex(RuntimeError, "already contains an analysis"):
+            self.create_finder(SegmentAnalyser()).get_resume_time()
+
+    def test_coarse_to_fine_analysis_is_not_continued(self):
+        write_atomically(self.speech_path, SpeechFileHeader(20, 100.0, "", STATE_RUNNING, 0, mode=MODE_HIERARCHICAL),
+                         ["0 speech"])
+        with self.assertRaisesRegex(RuntimeError, "already contains an analysis"):
+            self.create_finder(SegmentAnalyser()).get_resume_time()
+
+    def test_music_segments_are_reported_when_closed_by_speech(self):
+        lines = self.create_finder(SegmentAnalyser()).analyse(io.BytesIO(create_pcm("ssmmmsmm")))
+        # The music at the end is not closed by speech
+        self.assertEqual([(20, 120)], [(segment.begin_seconds, segment.end_seconds)
+                                       for segment in self.music_segments])
+        self.assertEqual(["20", "0 speech\t0.50-1.00", "20 speech\t20.50-21.00", "100 speech\t100.50-101.00", "end"],
+                         lines)
+
+    def test_music_segments_are_not_reported_twice_after_resume(self):
+        pcm = create_pcm("smmsmmsm")
+        with self.assertRaises(KeyboardInterrupt):
+            self.create_finder(SegmentAnalyser(interrupt_at=5)).analyse(io.BytesIO(pcm))
+        self.assertEqual(STATE_RUNNING, read_header(self.speech_path).state)
+        finder = self.create_finder(SegmentAnalyser())
+        start_time = finder.get_resume_time()
+        self.assertEqual(100, start_time)
+        finder.analyse(io.BytesIO(pcm[start_time * PCM_BYTES_PER_SECOND:]), start_time)
+        self.assertEqual([(0, 80), (60, 140)], [(segment.begin_seconds, segment.end_seconds)
+                                                for segment in self.music_segments])
+
+    def test_partial_last_block(self):
+        analyser = SegmentAnalyser()
+        self.create_finder(analyser).analyse(ChunkedStream(create_pcm("sms", 0.5), 4096))
+        self.assertEqual([20, 20, 10], analyser.segment_lengths)
+        header = read_header(self.speech_path)
+        self.assertEqual(STATE_COMPLETE, header.state)
+        self.assertEqual(50, header.duration)
+        self.assertEqual(["20", "0 speech\t0.50-1.00", "40 speech\t40.50-41.00", "end"],
+                         load_lines(self.speech_path))
+
+    def test_failed_decoding_of_growing_file_leaves_analysis_unfinished(self):
+        audio_path = Path(self.temp_dir.name) / "recording.mp3"
+        audio_path.touch()
+        with self.assertRaisesRegex(RuntimeError, "Decoding"):
+            self.create_finder(SegmentAnalyser()).analyse(io.BytesIO(create_pcm("ss")), fingerprint_source=audio_path,
+                                                          process=Process(1), idle_timeout=60)
+        self.assertEqual(STATE_RUNNING, read_header(self.speech_path).state)
+        self.assertEqual(40, self.create_finder(SegmentAnalyser()).get_resume_time())
+
+    def test_idle_timeout_completes_analysis(self):
+        audio_path = Path(self.temp_dir.name) / "recording.mp3"
+        audio_path.touch()
+        os.utime(audio_path, (time.time() - 120, time.time() - 120))
+        self.create_finder(SegmentAnalyser()).analyse(io.BytesIO(create_pcm("ss")), fingerprint_source=audio_path,
+                                                      process=Process(1), idle_timeout=60)
+        self.assertEqual(STATE_COMPLETE, read_header(self.speech_path).state)
+
+    def test_successful_decoding_completes_analysis(self):
+        audio_path = Path(self.temp_dir.name) / "recording.mp3"
+        audio_path.touch()
+        self.create_finder(SegmentAnalyser()).analyse(io.BytesIO(create_pcm("ss")), fingerprint_source=audio_path,
+                                                      process=Process(0), idle_timeout=60)
+        self.assertEqual(STATE_COMPLETE, read_header(self.speech_path).state)
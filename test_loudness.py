@@ -0,0 +1,73 @@
+from unittest import TestCase
+import numpy as np
+from loudness import (get_block_statistics, get_integrated_loudness, get_gain, get_mp3_gain_steps,
+                      get_replay_gain_tags, REFERENCE_LOUDNESS)
+
+
+def create_sine(frequency, amplitude, seconds, sample_rate=16000, phase=0.0):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (amplitude * np.sin(2 * np.pi * frequency * t + phase) * 32767).astype(np.int16).tobytes()
+
+
+def interleave(left: bytes, right: bytes) -> bytes:
+    return np.column_stack((np.frombuffer(left, dtype=np.int16), np.frombuffer(right, dtype=np.int16))).tobytes()
+
+
+class TestLoudness(TestCase):
+    def test_loudness_of_1khz_sine(self):
+        # BS.1770: a full scale 997 Hz sine in one channel has a loudness of -3.01 LUFS
+        block_statistics = get_block_statistics(create_sine(997, 0.5, 10))
+        self.assertEqual((100, 2), block_statistics.shape)
+        self.assertAlmostEqual(-9.03, get_integrated_loudness(block_statistics), delta=0.1)
+
+    def test_loudness_at_source_sample_rate(self):
+        block_statistics = get_block_statistics(create_sine(997, 0.5, 10, 44100), sample_rate=44100)
+        self.assertEqual((100, 2), block_statistics.shape)
+        self.assertAlmostEqual(-9.03, get_integrated_loudness(block_statistics), delta=0.1)
+
+    def test_loudness_of_stereo_is_summed_up_over_the_channels(self):
+        sine = create_sine(997, 0.5, 10, 48000)
+        correlated = get_block_statistics(interleave(sine, sine), 2, 48000)
+        self.assertAlmostEqual(-6.02, get_integrated_loudness(correlated), delta=0.1)
+        # Channels in opposite phase cancel out in a mono downmix, but are as loud as correlated channels
+        opposite_phase = get_block_statistics(interleave(sine, create_sine(997, 0.5, 10, 48000, np.pi)), 2, 48000)
+        self.assertAlmostEqual(-6.02, get_integrated_loudness(opposite_phase), delta=0.1)
+        one_channel = get_block_statistics(interleave(sine, bytes(len(sine))), 2, 48000)
+        self.assertAlmostEqual(-9.03, get_integrated_loudness(one_channel), delta=0.1)
+
+    def test_gain_of_stereo_does_not_clip_in_any_channel(self):
+        left = np.frombuffer(create_sine(997, 0.01, 10, 44100), dtype=np.int16).copy()
+        right = left.copy()
+        left[1000] = 16384
+        right[1000] = -16384
+        gain, peak = get_gain(get_block_statistics(interleave(left.tobytes(), right.tobytes()), 2, 44100), 0.0, 10.0)
+        self.assertAlmostEqual(0.5, peak, delta=0.001)
+        self.assertAlmostEqual(6.02, gain, delta=0.01)
+
+    def test_loudness_of_silence(self):
+        self.assertIsNone(get_integrated_loudness(get_block_statistics(bytes(32000 * 5))))
+
+    def test_relative_gate_ignores_quiet_parts(self):
+        pcm = create_sine(997, 0.5, 10) + create_sine(997, 0.005, 10)
+        self.assertAlmostEqual(-9.03, get_integrated_loudness(get_block_statistics(pcm)), delta=0.1)
+
+    def test_gain_of_part(self):
+        block_statistics = get_block_statistics(create_sine(997, 0.05, 10) + create_sine(997, 0.5, 10))
+        gain, peak = get_gain(block_statistics, 0.0, 10.0)
+        self.assertAlmostEqual(REFERENCE_LOUDNESS + 29.03, gain, delta=0.1)
+        self.assertAlmostEqual(0.05, peak, delta=0.001)
+
+    def test_gain_does_not_clip(self):
+        samples = np.frombuffer(create_sine(997, 0.01, 10), dtype=np.int16).copy()
+        samples[1000] = 16384
+        gain, peak = get_gain(get_block_statistics(samples.tobytes()), 0.0, 10.0)
+        self.assertAlmostEqual(0.5, peak, delta=0.001)
+        self.assertAlmostEqual(6.02, gain, delta=0.01)
+
+    def test_mp3_gain_steps(self):
+        self.assertEqual(2, get_mp3_gain_steps(3.4))
+        self.assertEqual(-3, get_mp3_gain_steps(-3.4))
+
+    def test_replay_gain_tags(self):
+        self.assertEqual({"REPLAYGAIN_TRACK_GAIN": "-8.97 dB", "REPLAYGAIN_TRACK_PEAK": "0.500000"},
+                         get_replay_gain_tags(-8.974, 0.5))
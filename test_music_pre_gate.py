@@ -0,0 +1,49 @@
+from unittest import TestCase
+from unittest.mock import patch
+import numpy as np
+import synthetic_corpus
+from music_pre_gate import is_certainly_music, get_features, PreGateStatistics, SAMPLE_RATE
+
+
+def synthesize_pcm(synthesize, start, seed=1, length=20):
+    with patch.object(synthetic_corpus, "SAMPLE_RATE", SAMPLE_RATE):
+        samples = synthesize(np.random.default_rng(seed), start, start + length)
+    return np.clip(samples * 32767, -32768, 32767).astype(np.int16).tobytes()
+
+
+class TestMusicPreGate(TestCase):
+    def test_synthetic_music_is_certainly_music(self):
+        for start in (0, 20, 140):
+            self.assertTrue(is_certainly_music(synthesize_pcm(synthetic_corpus._synthesize_music, start)))
+
+    def test_synthetic_speech_is_not_certainly_music(self):
+        for start in (0, 20, 140):
+            self.assertFalse(is_certainly_music(synthesize_pcm(synthetic_corpus._synthesize_speech, start)))
+
+    def test_music_and_speech_is_not_certainly_music(self):
+        pcm = (synthesize_pcm(synthetic_corpus._synthesize_music, 0, length=10) +
+               synthesize_pcm(synthetic_corpus._synthesize_speech, 10, length=10))
+        self.assertFalse(is_certainly_music(pcm))
+
+    def test_modulation_depth_of_steady_and_modulated_envelopes(self):
+        t = np.arange(20 * SAMPLE_RATE) / SAMPLE_RATE
+        tone = np.sin(2 * np.pi * 220 * t)
+        steady = get_features((tone * 10000).astype(np.int16).tobytes())
+        modulated = get_features((tone * (0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)) * 10000).astype(np.int16).tobytes())
+        self.assertLess(steady["modulation_4hz"], 0.05)
+        self.assertGreater(modulated["modulation_4hz"], 0.3)
+
+    def test_silence_is_not_certainly_music(self):
+        self.assertFalse(is_certainly_music(bytes(20 * SAMPLE_RATE * 2)))
+
+    def test_statistics_judge_only_the_skipped_segments(self):
+        statistics = PreGateStatistics()
+        for skipped, speech_found in [(True, False), (True, False), (True, False), (True, True),
+                                      (False, False), (False, False), (False, True), (False, True)]:
+            statistics.add(skipped, speech_found)
+        self.assertEqual(4, statistics.skipped_count)
+        self.assertEqual(1, statistics.skipped_with_speech_count)
+        # Music segments that were not skipped do not count against the pre-gate
+        self.assertEqual("Pre-gate skipped 4 of 8 segments (50.0%)\n"
+                         "Skip precision: 75.0% of the skipped segments contained no speech "
+                         "(1 skipped segments contained speech)", repr(statistics))
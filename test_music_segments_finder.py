@@ -234,3 +234,16 @@ class TestMusicSegmentsFinder(TestCase):
             MusicSegment(0, "...", 120, "...")
         ]
         self.assertEqual(expected_segments, find(lines, total_length))
+
+    def test_find_precise_boundaries_with_word_times(self):
+        lines = ["20",
+                 "20 at 20\t21.00-21.50 33.20-33.75",
+                 "60 at 60\t64.10-64.50 70.00-70.25",
+                 "end"]
+        total_length = 100
+        expected_segments = [
+            MusicSegment(0, "...", 40, "at 20", 0.0, 21.0),
+            MusicSegment(20, "at 20", 80, "at 60", 33.75, 64.1),
+            MusicSegment(60, "at 60", 100, "...", 70.25, 100)
+        ]
+        self.assertEqual(expected_segments, find(lines, total_length))
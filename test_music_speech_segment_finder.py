@@ -73,3 +73,15 @@ class TestMusicSpeechSegmentsFinder(TestCase):
         total_length = 60
         expected_segments = []
         self.assertEqual(expected_segments, find(lines, total_length))
+
+    def test_find_precise_boundaries_with_word_times(self):
+        lines = ["20",
+                 "0 at 0\t1.00-1.50 13.20-13.75",
+                 "40 at 40\t44.10-44.50 50.00-50.25",
+                 "end"]
+        total_length = 80
+        expected_segments = [
+            MusicSegment(0, "at 0", 60, "at 40", 13.75, 50.25),
+            MusicSegment(40, "at 40", 80, "...", 50.25, 80)
+        ]
+        self.assertEqual(expected_segments, find(lines, total_length))
@@ -0,0 +1,104 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from speech_file import (SpeechFileHeader, SpeechFileWriter, HEADER_SIZE, STATE_RUNNING, STATE_INTERRUPTED,
+                         STATE_COMPLETE, read_header, load_lines, get_analysis_state, format_speech_line,
+                         parse_word_times, strip_word_times, MODE_LINEAR, MODE_HIERARCHICAL)
+
+
+class TestSpeechFile(TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self._temp_dir.name) / "audio.speech"
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_header_has_fixed_size(self):
+        header = SpeechFileHeader(20, 6962.233, "0123456789abcdef0123456789abcdef", STATE_INTERRUPTED, 1160)
+        data = header.to_bytes()
+        self.assertEqual(HEADER_SIZE, len(data))
+
+        parsed = SpeechFileHeader.from_bytes(data)
+        self.assertEqual(20, parsed.segment_length)
+        self.assertEqual(6962.233, parsed.duration)
+        self.assertEqual("0123456789abcdef0123456789abcdef", parsed.fingerprint)
+        self.assertEqual(STATE_INTERRUPTED, parsed.state)
+        self.assertEqual(1160, parsed.resume_time)
+
+    def test_header_with_mode(self):
+        header = SpeechFileHeader(20, 100.0, "abc", STATE_RUNNING, 0, 300, mode=MODE_HIERARCHICAL)
+        self.assertIn(b" mode=hierarchical", header.to_bytes())
+        self.assertEqual(MODE_HIERARCHICAL, SpeechFileHeader.from_bytes(header.to_bytes()).mode)
+        self.assertEqual(MODE_LINEAR, SpeechFileHeader.from_bytes(SpeechFileHeader(20, 100.0, "abc").to_bytes()).mode)
+
+    def test_version_1_has_no_header(self):
+        self.path.write_text("20\n0 at 0\n40\n")
+        self.assertIsNone(read_header(self.path))
+        self.assertEqual(["20", "0 at 0", "40"], load_lines(self.path))
+        self.assertEqual(STATE_INTERRUPTED, get_analysis_state(self.path))
+
+    def test_writer_appends_lines_and_updates_header(self):
+        with SpeechFileWriter(self.path, SpeechFileHeader(20, 100.0, "abc")) as writer:
+            writer.append("0 at 0")
+            self.assertEqual(STATE_RUNNING, get_analysis_state(self.path))
+            writer.set_state(STATE_INTERRUPTED, 40)
+        self.assertEqual(["20", "0 at 0", "40"], load_lines(self.path))
+
+        with SpeechFileWriter.append_to(self.path) as writer:
+            self.assertEqual(40, writer.header.resume_time)
+            writer.append("60 at 60")
+            writer.set_state(STATE_COMPLETE, 100)
+        self.assertEqual(["20", "0 at 0", "60 at 60", "end"], load_lines(self.path))
+        self.assertEqual(STATE_COMPLETE, get_analysis_state(self.path))
+
+    def test_continue_version_1_analysis(self):
+        self.path.write_text("20\n0 at 0\n40\n")
+        with SpeechFileWriter.continue_analysis(self.path, 100.0, "abc") as writer:
+            self.assertEqual(40, writer.header.resume_time)
+            writer.append("60 at 60")
+            writer.set_state(STATE_COMPLETE, 100)
+        self.assertEqual("abc", read_header(self.path).fingerprint)
+        self.assertEqual(["20", "0 at 0", "60 at 60", "end"], load_lines(self.path))
+
+    def test_continue_version_2_analysis(self):
+        with SpeechFileWriter(self.path, SpeechFileHeader(20, 100.0, "abc")) as writer:
+            writer.append("0 at 0")
+            writer.set_state(STATE_INTERRUPTED, 40)
+        with SpeechFileWriter.continue_analysis(self.path, 100.0, "abc") as writer:
+            self.assertEqual(40, writer.header.resume_time)
+        self.assertEqual(["20", "0 at 0", "40"], load_lines(self.path))
+
+    def test_speech_line_with_word_times(self):
+        line = format_speech_line(20, "at 20", [(21.5, 21.75), (22.0, 22.5)])
+        self.assertEqual("20 at 20\t21.50-21.75 22.00-22.50", line)
+        self.assertEqual("20 at 20", strip_word_times(line))
+        self.assertEqual([(21.5, 21.75), (22.0, 22.5)], parse_word_times(line))
+
+    def test_speech_line_without_word_times(self):
+        line = format_speech_line(20, "at 20")
+        self.assertEqual("20 at 20", line)
+        self.assertIsNone(parse_word_times(line))
+
+    def test_writer_discards_lines_after_last_checkpoint(self):
+        with SpeechFileWriter(self.path, SpeechFileHeader(20, 100.0, "abc")) as writer:
+            writer.append("0 at 0")
+            writer.checkpoint(40)
+            writer.append("40 at 40")
+        with open(self.path, "ab") as file:
+            file.write(b"60 at")  # crash while writing a line
+
+        self.assertEqual(STATE_RUNNING, get_analysis_state(self.path))
+        with SpeechFileWriter.append_to(self.path) as writer:
+            self.assertEqual(40, writer.header.resume_time)
+            writer.append("40 at 40")
+            writer.set_state(STATE_COMPLETE, 100)
+        self.assertEqual(["20", "0 at 0", "40 at 40", "end"], load_lines(self.path))
+
+    def test_header_of_other_size_is_kept(self):
+        header = SpeechFileHeader(20, 100.0, "abc", STATE_INTERRUPTED, 40, header_size=128)
+        self.path.write_bytes(header.to_bytes() + b"0 at 0\n")
+        with SpeechFileWriter.append_to(self.path) as writer:
+            writer.set_state(STATE_COMPLETE, 100)
+        self.assertEqual(128, read_header(self.path).header_size)
+        self.assertEqual(["20", "0 at 0", "end"], load_lines(self.path))
@@ -0,0 +1,45 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from speech_files_merger import get_shard_lines, IncrementalMerger
+from speech_file import (load_lines, read_header, SpeechFileHeader, SpeechFileWriter, STATE_RUNNING,
+                         STATE_COMPLETE)
+
+
+class TestSpeechFilesMerger(TestCase):
+    def test_shard_lines_offset_speech_segments_and_word_times(self):
+        self.assertEqual(["300 at 300", "320 at 320\t321.50-321.75 322.00-322.50"],
+                         get_shard_lines(300, [(0, "at 300", []), (20, "at 320", [(21.5, 21.75), (22.0, 22.5)])]))
+
+    def test_incremental_merger_appends_finished_shards_in_order(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir) / "merged.speech"
+            with SpeechFileWriter(output_path, SpeechFileHeader(20, 900.0, "abc")) as analysis_file:
+                merger = IncrementalMerger(analysis_file, [0, 300, 600])
+                merger.add(300, 20, [(20, "at 320", [])])
+                self.assertEqual(["20", "0"], load_lines(output_path))
+
+                merger.add(0, 20, [(0, "at 0", [])])
+                self.assertEqual(["20", "0 at 0", "320 at 320", "600"], load_lines(output_path))
+                self.assertEqual(STATE_RUNNING, read_header(output_path).state)
+
+                merger.add(600, 20, [])
+                self.assertEqual(["20", "0 at 0", "320 at 320", "end"], load_lines(output_path))
+
+    def test_incremental_merger_rejects_other_segment_lengths(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir) / "merged.speech"
+            with SpeechFileWriter(output_path, SpeechFileHeader(20, 600.0, "abc")) as analysis_file:
+                merger = IncrementalMerger(analysis_file, [0, 300])
+                with self.assertRaises(ValueError):
+                    merger.add(0, 10, [])
+
+    def test_incremental_merger_without_speech(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir) / "merged.speech"
+            with SpeechFileWriter(output_path, SpeechFileHeader(20, 600.0, "abc")) as analysis_file:
+                merger = IncrementalMerger(analysis_file, [0, 300])
+                merger.add(300, 20, [])
+                merger.add(0, 20, [])
+            self.assertEqual(["20", "end"], load_lines(output_path))
+            self.assertEqual(STATE_COMPLETE, read_header(output_path).state)
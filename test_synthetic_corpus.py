@@ -0,0 +1,33 @@
+import hashlib
+import tempfile
+import wave
+from pathlib import Path
+from unittest import TestCase
+from synthetic_corpus import create_layout, create_recording, SAMPLE_RATE
+
+
+class TestSyntheticCorpus(TestCase):
+    def test_layout_alternates_and_covers_recording(self):
+        layout = create_layout(1200, seed=1)
+        self.assertEqual(0.0, layout[0][0])
+        self.assertEqual(1200, layout[-1][1])
+        for (_, end, kind), (next_start, _, next_kind) in zip(layout, layout[1:]):
+            self.assertEqual(end, next_start)
+            self.assertNotEqual(kind, next_kind)
+        self.assertEqual("speech", layout[0][2])
+
+    def test_layout_is_deterministic(self):
+        self.assertEqual(create_layout(1200, seed=7), create_layout(1200, seed=7))
+        self.assertNotEqual(create_layout(1200, seed=7), create_layout(1200, seed=8))
+
+    def test_recording_is_deterministic(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            digests = []
+            for name in ("a.wav", "b.wav"):
+                path = Path(temp_dir) / name
+                create_recording(path, 25, seed=3)
+                with wave.open(str(path), "rb") as wf:
+                    self.assertEqual(25 * SAMPLE_RATE, wf.getnframes())
+                    self.assertEqual(2, wf.getnchannels())
+                digests.append(hashlib.sha256(path.read_bytes()).hexdigest())
+            self.assertEqual(digests[0], digests[1])
@@ -0,0 +1,42 @@
+import asyncio
+import sys
+import time
+from unittest import TestCase
+from unittest.mock import patch
+import tool_runner
+
+
+def python_command(code):
+    return [sys.executable, '-c', code]
+
+
+class TestToolRunner(TestCase):
+    def test_output_is_captured(self):
+        result = tool_runner.run(python_command("print('out'); import sys; print('err', file=sys.stderr)"))
+        self.assertEqual(0, result.returncode)
+        self.assertEqual(b"out\n", result.stdout)
+        self.assertEqual(b"err\n", result.stderr)
+
+    def test_failure_raises_with_stderr(self):
+        with self.assertRaisesRegex(RuntimeError, "broken input"):
+            tool_runner.run(python_command("import sys; sys.exit('broken input')"))
+
+    def test_failure_without_check(self):
+        result = tool_runner.run(python_command("import sys; sys.exit(3)"), check=False)
+        self.assertEqual(3, result.returncode)
+
+    def test_missing_tool(self):
+        with self.assertRaisesRegex(RuntimeError, "not installed"):
+            tool_runner.run(["tool-that-does-not-exist"])
+
+    def test_results_in_order_of_commands(self):
+        results = tool_runner.run_all([python_command(f"import time; time.sleep({delay}); print({no})")
+                                       for no, delay in enumerate([0.2, 0.0, 0.1])])
+        self.assertEqual([b"0\n", b"1\n", b"2\n"], [result.stdout for result in results])
+
+    def test_concurrency_limit(self):
+        with patch.object(tool_runner, "MAX_CONCURRENT_TOOLS", 2):
+            start = time.perf_counter()
+            asyncio.run(tool_runner.run_tools([python_command("import time; time.sleep(0.3)")] * 4))
+            elapsed = time.perf_counter() - start
+        self.assertGreaterEqual(elapsed, 0.6)
@@ -0,0 +1,25 @@
+from unittest import TestCase
+from vad_segments import get_speech_segment_starts
+
+
+class TestVadSegments(TestCase):
+    def test_span_within_a_segment(self):
+        self.assertEqual({20}, get_speech_segment_starts([(21.5, 38.0)], 20))
+
+    def test_span_across_segment_boundaries(self):
+        self.assertEqual({0, 20, 40}, get_speech_segment_starts([(5.0, 45.0)], 20))
+        self.assertEqual({0, 20}, get_speech_segment_starts([(19.9, 20.1)], 20))
+
+    def test_span_ending_at_segment_boundary(self):
+        self.assertEqual({0}, get_speech_segment_starts([(0.0, 20.0)], 20))
+        self.assertEqual({20}, get_speech_segment_starts([(39.5, 40.0)], 20))
+
+    def test_span_starting_at_segment_boundary(self):
+        self.assertEqual({40}, get_speech_segment_starts([(40.0, 41.0)], 20))
+
+    def test_empty_span(self):
+        self.assertEqual({60}, get_speech_segment_starts([(60.0, 60.0)], 20))
+
+    def test_overlapping_spans(self):
+        self.assertEqual({0, 20, 80}, get_speech_segment_starts([(1.0, 25.0), (22.0, 30.0), (85.0, 86.0)], 20))
+        self.assertEqual(set(), get_speech_segment_starts([], 20))
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+import subprocess
+import threading
+import weakref
+
+"""
+Runs the external tools (ffmpeg, ffprobe, mp3gain) as asyncio subprocesses.
+
+The commands are argument lists, no shell is started. The number of tools that run at once is limited to
+MAX_CONCURRENT_TOOLS per event loop. Synchronous code (from any thread) runs the tools in one shared event loop,
+so the limit applies to the whole process. The output of the tools is captured, so errors can be diagnosed from
+their stderr.
+"""
+
+MAX_CONCURRENT_TOOLS = os.cpu_count()
+
+# Number of characters of stderr that are included in the error message of a failed tool
+STDERR_EXCERPT_LENGTH = 500
+
+_semaphores = weakref.WeakKeyDictionary()
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+
+def _get_semaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_TOOLS)
+    return _semaphores[loop]
+
+
+def _get_shared_loop():
+    global _shared_loop
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = asyncio.new_event_loop()
+            threading.Thread(target=_shared_loop.run_forever, name="tool_runner", daemon=True).start()
+    return _shared_loop
+
+
+async def run_tool(command, check=True) -> subprocess.CompletedProcess:
+    """
+    Run an external tool and capture its output.
+
+    Args:
+        command (list): The tool and its arguments.
+        check (bool): If True, a RuntimeError is raised if the tool fails.
+
+    Returns:
+        subprocess.CompletedProcess: The return code and the output (bytes) of the tool.
+    """
+    command = [str(argument) for argument in command]
+    async with _get_semaphore():
+        try:
+            process = await asyncio.create_subprocess_exec(*command, stdin=subprocess.DEVNULL,
+                                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError(f"{command[0]} is not installed")
+        stdout, stderr = await process.communicate()
+    if check and process.returncode != 0:
+        message = stderr.decode(errors='replace').strip()
+        logging.error(f"{' '.join(command)} failed with return code {process.returncode}: {message}")
+        raise RuntimeError(f"{command[0]} failed: {message[-STDERR_EXCERPT_LENGTH:]}")
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+async def run_tools(commands, check=True):
+    """
+    Run several external tools at once (at most MAX_CONCURRENT_TOOLS at a time).
+
+    Returns:
+        list: The results (see run_tool) in the order of the commands.
+    """
+    return await asyncio.gather(*(run_tool(command, check) for command in commands))
+
+
+def run(command, check=True) -> subprocess.CompletedProcess:
+    """
+    Run an external tool from synchronous code (see run_tool).
+    """
+    return asyncio.run_coroutine_threadsafe(run_tool(command, check), _get_shared_loop()).result()
+
+
+def run_all(commands, check=True):
+    """
+    Run several external tools at once from synchronous code (see run_tools).
+    """
+    return asyncio.run_coroutine_threadsafe(run_tools(commands, check), _get_shared_loop()).result()
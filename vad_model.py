@@ -0,0 +1,105 @@
+import os
+import threading
+from pathlib import Path
+import numpy
+import torch
+from silero_vad import load_silero_vad, get_speech_timestamps
+from silero_vad.utils_vad import init_jit_model, OnnxWrapper
+from audio_tools import read_pcm_segments
+from instrumentation import instrumented
+
+# This software uses Silero VAD for voice activity detection.
+# Silero VAD is licensed under the MIT license.
+
+MODEL_DIR = os.path.expanduser("~/.local/models")
+JIT_MODEL_PATH = os.path.join(MODEL_DIR, "silero_vad.jit")
+ONNX_MODEL_PATH = os.path.join(MODEL_DIR, "silero_vad.onnx")
+
+# Length of the blocks (in seconds) in which an analysable audio file is streamed through the VAD
+BLOCK_LENGTH_SEC = 600
+
+# The Silero VAD model of this process (loaded on first use)
+_model = None
+
+# The model keeps a state between its calls, so it must only be used by one thread at a time
+model_lock = threading.Lock()
+
+
+def get_vad_model():
+    """
+    Get the Silero VAD model of this process. The model is loaded only once and then reused.
+
+    A local TorchScript (silero_vad.jit) or ONNX (silero_vad.onnx) model in ~/.local/models is preferred.
+    Otherwise the model bundled with the silero-vad package is used, so no network access is needed.
+
+    Returns:
+        The Silero VAD model.
+    """
+    global _model
+    if _model is None:
+        torch.set_num_threads(1)
+        _model = _load_model()
+    return _model
+
+
+@instrumented("model_load")
+def _load_model():
+    if os.path.exists(JIT_MODEL_PATH):
+        return init_jit_model(JIT_MODEL_PATH)
+    if os.path.exists(ONNX_MODEL_PATH):
+        try:
+            return OnnxWrapper(ONNX_MODEL_PATH, force_onnx_cpu=True)
+        except ImportError:
+            raise RuntimeError(f"onnxruntime must be installed to use {ONNX_MODEL_PATH}")
+    return load_silero_vad()
+
+
+def warm_up():
+    """
+    Load the Silero VAD model and run it once, so that the first real VAD run is not slowed down.
+    """
+    model = get_vad_model()
+    with model_lock:
+        model(torch.zeros(512), 16000)
+        model.reset_states()
+
+
+def find_speech_spans(wav_path: Path, threshold=0.5, min_speech_duration_ms=250):
+    """
+    Run the VAD once over a whole analysable (16 kHz mono) WAV file. The file is streamed in blocks of
+    BLOCK_LENGTH_SEC seconds, so the memory usage does not depend on the length of the audio.
+
+    Args:
+        wav_path (Path): Path to the analysable WAV file.
+        threshold (float): Speech probability threshold of the VAD.
+        min_speech_duration_ms (int): Shorter speech is ignored.
+
+    Returns:
+        list: (start, end) tuples in seconds of all detected speech.
+    """
+    speech_spans = []
+    for block_start, pcm in read_pcm_segments(wav_path, 0, BLOCK_LENGTH_SEC, float("inf")):
+        speech_spans.extend((block_start + start, block_start + end)
+                            for start, end in find_speech_spans_in_pcm(pcm, threshold, min_speech_duration_ms))
+    return speech_spans
+
+
+@instrumented("vad")
+def find_speech_spans_in_pcm(pcm: bytes, threshold=0.5, min_speech_duration_ms=250):
+    """
+    Run the VAD over raw 16 kHz mono 16-bit PCM data in memory.
+
+    Args:
+        pcm (bytes): The PCM data.
+        threshold (float): Speech probability threshold of the VAD.
+        min_speech_duration_ms (int): Shorter speech is ignored.
+
+    Returns:
+        list: (start, end) tuples in seconds (relative to the PCM data) of all detected speech.
+    """
+    model = get_vad_model()
+    samples = torch.from_numpy(numpy.frombuffer(pcm, dtype=numpy.int16).astype(numpy.float32) / 32768.0)
+    with model_lock:
+        timestamps = get_speech_timestamps(samples, model, sampling_rate=16000, threshold=threshold,
+                                           min_speech_duration_ms=min_speech_duration_ms)
+    return [(timestamp['start'] / 16000, timestamp['end'] / 16000) for timestamp in timestamps]
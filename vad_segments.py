@@ -0,0 +1,23 @@
+"""
+Mapping of the speech spans found by the VAD (see vad_model.py) to the segments of the analysis.
+"""
+
+
+def get_speech_segment_starts(speech_spans, segment_length: int):
+    """
+    Pad the speech spans to the segment grid.
+
+    Args:
+        speech_spans (list): (start, end) tuples in seconds.
+        segment_length (int): Length of the segments in seconds.
+
+    Returns:
+        set: The start times of all segments that overlap with a speech span. A span that ends exactly at the
+            beginning of a segment does not overlap with it.
+    """
+    speech_segment_starts = set()
+    for begin, end in speech_spans:
+        first_segment = int(begin // segment_length)
+        last_segment = int(max(begin, end - 0.001) // segment_length)
+        speech_segment_starts.update(segment * segment_length for segment in range(first_segment, last_segment + 1))
+    return speech_segment_starts